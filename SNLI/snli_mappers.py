@@ -2,6 +2,7 @@ import hashlib
 from typing import Dict
 from collections import OrderedDict
 
+from pos_and_ner.embedding_store import EmbeddingStore
 from pos_and_ner.mappers import BaseMapperWithPadding, TokenMapper
 
 UNK = "unkkkkkkkkkkk"
@@ -10,11 +11,12 @@ WORD_PAD = "paddddddddddddd"
 
 class SNLIMapperWithGloveIndices(BaseMapperWithPadding, TokenMapper):
 
-    def __init__(self, min_frequency: int = 5, split_char: str = "\t", glove_path: str = ""):
+    def __init__(self, min_frequency: int = 5, split_char: str = "\t", glove_path: str = "", glove_dtype: str = "float32"):
         super().__init__(min_frequency=min_frequency, split_char=split_char)
         self.unknown_label_symbol = "-"
         self.word_to_glove_idx = {}
         self.glove_path = glove_path
+        self.glove_dtype = glove_dtype
 
     def serialize(self) -> dict:
         serialization = super().serialize()
@@ -86,22 +88,10 @@ class SNLIMapperWithGloveIndices(BaseMapperWithPadding, TokenMapper):
             label_index += 1
 
     def _load_glove_words_indices(self) -> Dict[str, int]:
-        pre_trained_words_indices = {}
-        with open(self.glove_path, "r", encoding="utf8") as f:
-            for index, line in enumerate(f):
-                try:
-                    line = line[:-1]  # remove end of line
-                    line_tokens = line.split()
-
-                    # there are cases where file contains a "word" with a space
-                    # we will skip those defected lines
-                    if len(line_tokens) == 301:
-                        word = line_tokens[0]
-                        pre_trained_words_indices[word] = index
-                except ValueError:
-                    continue
-
-        return pre_trained_words_indices
+        # the glove indices are the rows of the binary glove store (created from the glove file on first use),
+        # the model gathers the pre-trained vectors from the same store
+        glove_store = EmbeddingStore.from_glove_file(self.glove_path, self.glove_dtype)
+        return glove_store.word_to_row
 
     def _init_unknown_tokens(self) -> None:
         """
@@ -1,15 +1,51 @@
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional
 
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from pos_and_ner.models import ModelWithPreTrainedEmbeddings
+from pos_and_ner.embedding_store import EmbeddingStore
+from pos_and_ner.models import ModelWithPreTrainedEmbeddings, store_embeddings_in_bf16, get_sequence_lengths
 from SNLI.snli_configs import SNLIDecomposeAttentionVanillaConfig
 from SNLI.snli_mappers import SNLIMapperWithGloveIndices
 
 
+def trim_and_mask_sentences(sent1: torch.tensor, sent2: torch.tensor, padding_index: int) -> Tuple[torch.tensor, torch.tensor, torch.tensor, torch.tensor]:
+    # sentences are padded at the end, the batch is trimmed to its longest sentence and the masks mark the real tokens
+    # (an empty sentence keeps its first position so the attention softmax is defined)
+    # both sentences keep the same length so they can be stacked
+    lengths1 = get_sequence_lengths(sent1 != padding_index)
+    lengths2 = get_sequence_lengths(sent2 != padding_index)
+
+    # a traced model would keep the length of the tracing batch, so a traced model keeps the whole padding (masked)
+    max_length = sent1.size(1) if torch.jit.is_tracing() else int(torch.max(torch.max(lengths1), torch.max(lengths2)))
+    positions = torch.arange(max_length, device=sent1.device).unsqueeze(0)
+
+    return sent1[:, :max_length], sent2[:, :max_length], positions < lengths1.unsqueeze(1), positions < lengths2.unsqueeze(1)
+
+
+def stack_sentences(x1: Optional[torch.tensor], x2: Optional[torch.tensor]) -> Optional[torch.tensor]:
+    # the premise and hypothesis tensors are stacked on the batch dimension so every shared layer runs once on both
+    if x1 is None:
+        return None
+
+    return torch.cat([x1, x2], dim=0)
+
+
+def split_sentences(stacked: torch.tensor) -> Tuple[torch.tensor, torch.tensor]:
+    x1, x2 = torch.chunk(stacked, 2, dim=0)
+    return x1, x2
+
+
+def masked_softmax(raw_weights: torch.tensor, keys_mask: Optional[torch.tensor]) -> torch.tensor:
+    # raw_weights has dimensions batch, queries, keys. keys_mask (batch, keys) marks the keys that can be attended
+    if keys_mask is not None:
+        raw_weights = raw_weights.masked_fill(~keys_mask.unsqueeze(1), float("-inf"))
+
+    return F.softmax(raw_weights, dim=2)
+
+
 class SNLIDecomposeAttentionMLP(nn.Module):
 
     def __init__(self, input_dim: int, output_dim: int):
@@ -39,16 +75,14 @@ class SNLIDecomposeAttentionEncoderLayer(nn.Module):
         self.embedding = nn.Embedding(tokens_dim, embedding_dim, padding_idx=padding_index)
         self.embedding_projection = nn.Linear(embedding_dim, hidden_dim, bias=True)
 
-    def forward(self, sent1: torch.tensor, sent2: torch.tensor) -> Tuple[torch.tensor, torch.tensor]:
-        # embeddings
-        sent1_embeddings = self.embedding(sent1)
-        sent2_embeddings = self.embedding(sent2)
+    def encode_stacked(self, sentences: torch.tensor, masks: Optional[torch.tensor] = None) -> torch.tensor:
+        # sentences are both sentences stacked on the batch dimension, embeddings and projection to hidden space
+        return self.embedding_projection(self.embedding(sentences))
 
-        # projection to hidden space
-        a = self.embedding_projection(sent1_embeddings)
-        b = self.embedding_projection(sent2_embeddings)
-
-        return a, b
+    def forward(self, sent1: torch.tensor, sent2: torch.tensor,
+                mask1: Optional[torch.tensor] = None, mask2: Optional[torch.tensor] = None) -> Tuple[torch.tensor, torch.tensor]:
+        stacked_features = self.encode_stacked(stack_sentences(sent1, sent2), stack_sentences(mask1, mask2))
+        return split_sentences(stacked_features)
 
     def get_embedding_layer(self) -> nn.Embedding:
         return self.embedding
@@ -64,42 +98,31 @@ class SNLIDecomposeAttentionIntraSentenceEncoderLayer(SNLIDecomposeAttentionEnco
         self.f_intra = SNLIDecomposeAttentionMLP(hidden_dim, hidden_dim)
         self.dist_bias = torch.nn.Parameter(torch.randn(sequence_length), requires_grad=True)
 
-    def _self_attention(self, x: torch.tensor) -> torch.tensor:
-        batch_size, sequence_len, _ = x.size()
-        distance_bias_matrix = self.dist_bias.expand(batch_size, sequence_len, sequence_len)
+    def _self_attention(self, x: torch.tensor, mask: Optional[torch.tensor] = None) -> torch.tensor:
+        _, sequence_len, _ = x.size()
+
+        # the batch may be trimmed to its longest sentence, the bias of the first sequence_len positions is used
+        distance_bias = self.dist_bias[:sequence_len]
 
         f_x = self.f_intra(x)
 
-        raw_weights = torch.einsum("bij,bkj->bik", f_x, f_x)
-        distance_aware_raw_weights = raw_weights + distance_bias_matrix
-        weights = F.softmax(distance_aware_raw_weights, dim=2)
-        x_tag = torch.einsum("bij,bjk->bik", weights, x)
+        raw_weights = torch.bmm(f_x, f_x.transpose(1, 2))
+        distance_aware_raw_weights = raw_weights + distance_bias
+        weights = masked_softmax(distance_aware_raw_weights, mask)
+        x_tag = torch.bmm(weights, x)
 
         return x_tag
 
-    def forward(self, sent1: torch.tensor, sent2: torch.tensor) -> Tuple[torch.tensor, torch.tensor]:
-        a, b = super().forward(sent1, sent2)
-
-        # self attention phase
-        a_tag = self._self_attention(a)
-        b_tag = self._self_attention(b)
-
-        # concatenate on features axis
-        a_a_tag = torch.cat([a, a_tag], dim=2)
-        b_b_tag = torch.cat([b, b_tag], dim=2)
+    def encode_stacked(self, sentences: torch.tensor, masks: Optional[torch.tensor] = None) -> torch.tensor:
+        x = super().encode_stacked(sentences)
 
-        return a_a_tag, b_b_tag
+        # self attention phase, concatenate on features axis
+        x_tag = self._self_attention(x, masks)
+        return torch.cat([x, x_tag], dim=2)
 
 
 class SNLIDecomposeAttentionAttendCompareAggregateLayer(nn.Module):
 
-    @staticmethod
-    def get_attention_weights(input1: torch.tensor, input2: torch.tensor) -> torch.tensor:
-        raw_weights = torch.einsum("bij,bkj->bik", input1, input2)
-        weights = F.softmax(raw_weights, dim=2)
-
-        return weights
-
     def __init__(self,
                  f_input_dim: int, f_output_dim: int,
                  g_input_dim: int, g_output_dim: int,
@@ -109,29 +132,33 @@ class SNLIDecomposeAttentionAttendCompareAggregateLayer(nn.Module):
         self.mlp_g = SNLIDecomposeAttentionMLP(g_input_dim, g_output_dim)
         self.mlp_h = SNLIDecomposeAttentionMLP(h_input_dim, h_output_dim)
 
-    def forward(self, a: torch.tensor, b: torch.tensor) -> torch.tensor:
-        # F MLP
-        f1 = self.mlp_f(a)
-        f2 = self.mlp_f(b)
+    def forward(self, a: torch.tensor, b: torch.tensor,
+                mask1: Optional[torch.tensor] = None, mask2: Optional[torch.tensor] = None) -> torch.tensor:
+        # F MLP (both sentences at once)
+        f1, f2 = split_sentences(self.mlp_f(stack_sentences(a, b)))
 
         # attention phase (computing beta and alpha)
-        beta_weights = self.get_attention_weights(f1, f2)
-        beta = torch.einsum("bij,bjk->bik", beta_weights, b)
-        alpha_weights = self.get_attention_weights(f2, f1)
-        alpha = torch.einsum("bij,bjk->bik", alpha_weights, a)
+        # the alpha raw weights (f2 f1^T) are the transpose of the beta raw weights, every token attends only to the
+        # real tokens of the other sentence
+        raw_weights = torch.bmm(f1, f2.transpose(1, 2))
+        beta_weights = masked_softmax(raw_weights, mask2)
+        alpha_weights = masked_softmax(raw_weights.transpose(1, 2), mask1)
+        beta, alpha = split_sentences(torch.bmm(stack_sentences(beta_weights, alpha_weights), stack_sentences(b, a)))
 
         # concatenation and G MLP
         # concatenate on features axis
         a_and_beta = torch.cat([a, beta], dim=2)
         b_and_alpha = torch.cat([b, alpha], dim=2)
-
-        v1 = self.mlp_g(a_and_beta)
-        v2 = self.mlp_g(b_and_alpha)
+        v = self.mlp_g(stack_sentences(a_and_beta, b_and_alpha))
 
         # aggregation and H MLP
+        # the padding positions are not part of the sum
+        masks = stack_sentences(mask1, mask2)
+        if masks is not None:
+            v = v * masks.unsqueeze(2).type(v.dtype)
+
         # sum over sequence axis
-        v1 = torch.sum(v1, dim=1)
-        v2 = torch.sum(v2, dim=1)
+        v1, v2 = split_sentences(torch.sum(v, dim=1))
 
         # again concatenate on features axis
         v1_and_v2 = torch.cat([v1, v2], dim=1)
@@ -143,42 +170,25 @@ class SNLIDecomposeAttentionAttendCompareAggregateLayer(nn.Module):
 class SNLIDecomposeAttentionVanillaModel(ModelWithPreTrainedEmbeddings):
 
     @staticmethod
-    def load_pre_trained_glove(embedding_layer: nn.Embedding, word_to_idx: Dict[str, int], word_to_glove_idx: Dict[str, int], glove_path: str) -> nn.Embedding:
-        embedding_matrix = embedding_layer.weight.detach().numpy()
+    def load_pre_trained_glove(embedding_layer: nn.Embedding, word_to_idx: Dict[str, int], word_to_glove_idx: Dict[str, int], glove_path: str,
+                               glove_dtype: str = "float32") -> nn.Embedding:
+        if len(word_to_glove_idx) == 0:
+            return embedding_layer
 
+        # glove indices are rows of the binary glove store, read the rows in file order
+        glove_store = EmbeddingStore.from_glove_file(glove_path, glove_dtype)
         glove_words_sorted_indices = sorted(word_to_glove_idx.items(), key=lambda x: x[1])
-        total_glove_words = len(glove_words_sorted_indices)
-        current_glove_index = 0
-
-        with open(glove_path, "r", encoding="utf-8") as f:
-            for index, line in enumerate(f):
-                # we read already all words in dictionary that are also in glove vocab
-                if current_glove_index == total_glove_words:
-                    break
-
-                # skip until we find a word that also appears in vocab
-                glove_word, glove_index = glove_words_sorted_indices[current_glove_index]
-                if index != glove_index:
-                    continue
-
-                # retrieve pre-trained vector
-                line = line[:-1]  # remove end of line
-                line_tokens = line.split()
-                word = line_tokens[0]
-                vector = np.array(line_tokens[1:], dtype=np.float)
-
-                # find out the corresponding index in our initiated embedding matrix  and update it
-                word_data_vocab_index = word_to_idx[word]
-                embedding_matrix[word_data_vocab_index] = vector
-
-                # update to next word appearing in glove
-                current_glove_index += 1
-
-        # load the new embedding matrix as the embedding layer parameters
-        embedding_layer.load_state_dict({'weight': torch.tensor(embedding_matrix)})
+        words, glove_rows = zip(*glove_words_sorted_indices)
+
+        # gather only the pre-trained vectors of the vocabulary words and update the embedding matrix at once
+        embedding_indices = torch.tensor([word_to_idx[word] for word in words])
+        pre_trained_vectors = torch.from_numpy(glove_store.get_rows(np.array(glove_rows)))
+        with torch.no_grad():
+            embedding_layer.weight[embedding_indices] = pre_trained_vectors
+
         return embedding_layer
 
-    def __init__(self, config: SNLIDecomposeAttentionVanillaConfig, mapper: SNLIMapperWithGloveIndices, glove_path: str = None):
+    def __init__(self, config: SNLIDecomposeAttentionVanillaConfig, mapper: SNLIMapperWithGloveIndices, glove_path: str = None, glove_dtype: str = "float32"):
         super().__init__(config, mapper)
 
         # define dimensions of layers
@@ -190,6 +200,10 @@ class SNLIDecomposeAttentionVanillaModel(ModelWithPreTrainedEmbeddings):
 
         print(f"Number of vocabulary tokens is: {self.tokens_dim}")
 
+        # with masked attention the padding is not attended or aggregated and every batch is trimmed to its longest sentence
+        self.padding_index = padding_index
+        self.masked_attention = "masked_attention" in config and config["masked_attention"]
+
         # define model sub components and layers
         self.encoder: SNLIDecomposeAttentionEncoderLayer = SNLIDecomposeAttentionEncoderLayer(tokens_dim, embedding_dim, hidden_dim, padding_index)
         self.attention_aggregation = SNLIDecomposeAttentionAttendCompareAggregateLayer(f_input_dim=hidden_dim, f_output_dim=hidden_dim,
@@ -203,20 +217,30 @@ class SNLIDecomposeAttentionVanillaModel(ModelWithPreTrainedEmbeddings):
         word_to_index = self.mapper.token_to_idx
         word_to_glove_index = self.mapper.word_to_glove_idx
         if glove_path is not None:
-            pre_trained_embedding_layer = self.load_pre_trained_glove(embedding_layer, word_to_index, word_to_glove_index, glove_path)
+            pre_trained_embedding_layer = self.load_pre_trained_glove(embedding_layer, word_to_index, word_to_glove_index, glove_path, glove_dtype)
             pre_trained_embedding_layer.weight.requires_grad = False
+
+            # the frozen glove matrix can be kept in bfloat16 to halve its memory
+            if "bf16_embeddings" in config and config["bf16_embeddings"]:
+                store_embeddings_in_bf16(pre_trained_embedding_layer)
+
             self.encoder.set_embedding_layer(pre_trained_embedding_layer)
 
     def forward(self, sent1: torch.tensor, sent2: torch.tensor) -> torch.tensor:
-        a, b = self.encoder(sent1, sent2)
-        hidden_output = self.attention_aggregation(a, b)
+        mask1, mask2 = None, None
+        if self.masked_attention:
+            sent1, sent2, mask1, mask2 = trim_and_mask_sentences(sent1, sent2, self.padding_index)
+
+        a, b = self.encoder(sent1, sent2, mask1, mask2)
+        hidden_output = self.attention_aggregation(a, b, mask1, mask2)
         output = self.classification_layer(hidden_output)
 
         return output
 
 
 class SNLIDecomposeAttentionIntraSentenceModel(ModelWithPreTrainedEmbeddings):
-    def __init__(self, config: SNLIDecomposeAttentionVanillaConfig, mapper: SNLIMapperWithGloveIndices, glove_path: str = None, sequence_length: int = 25):
+    def __init__(self, config: SNLIDecomposeAttentionVanillaConfig, mapper: SNLIMapperWithGloveIndices, glove_path: str = None, sequence_length: int = 25,
+                 glove_dtype: str = "float32"):
         super().__init__(config, mapper)
 
         # define dimensions of layers
@@ -228,6 +252,10 @@ class SNLIDecomposeAttentionIntraSentenceModel(ModelWithPreTrainedEmbeddings):
 
         print(f"Number of vocabulary tokens is: {self.tokens_dim}")
 
+        # with masked attention the padding is not attended or aggregated and every batch is trimmed to its longest sentence
+        self.padding_index = padding_index
+        self.masked_attention = "masked_attention" in config and config["masked_attention"]
+
         # define model sub components and layers
         self.encoder: SNLIDecomposeAttentionEncoderLayer = SNLIDecomposeAttentionIntraSentenceEncoderLayer(tokens_dim, embedding_dim, hidden_dim, padding_index, sequence_length)
         self.attention_aggregation = SNLIDecomposeAttentionAttendCompareAggregateLayer(f_input_dim=2 * hidden_dim, f_output_dim=hidden_dim,
@@ -241,13 +269,22 @@ class SNLIDecomposeAttentionIntraSentenceModel(ModelWithPreTrainedEmbeddings):
         word_to_index = self.mapper.token_to_idx
         word_to_glove_index = self.mapper.word_to_glove_idx
         if glove_path is not None:
-            pre_trained_embedding_layer = SNLIDecomposeAttentionVanillaModel.load_pre_trained_glove(embedding_layer, word_to_index, word_to_glove_index, glove_path)
+            pre_trained_embedding_layer = SNLIDecomposeAttentionVanillaModel.load_pre_trained_glove(embedding_layer, word_to_index, word_to_glove_index, glove_path, glove_dtype)
             pre_trained_embedding_layer.weight.requires_grad = False
+
+            # the frozen glove matrix can be kept in bfloat16 to halve its memory
+            if "bf16_embeddings" in config and config["bf16_embeddings"]:
+                store_embeddings_in_bf16(pre_trained_embedding_layer)
+
             self.encoder.set_embedding_layer(pre_trained_embedding_layer)
 
     def forward(self, sent1: torch.tensor, sent2: torch.tensor) -> torch.tensor:
-        a, b = self.encoder(sent1, sent2)
-        hidden_output = self.attention_aggregation(a, b)
+        mask1, mask2 = None, None
+        if self.masked_attention:
+            sent1, sent2, mask1, mask2 = trim_and_mask_sentences(sent1, sent2, self.padding_index)
+
+        a, b = self.encoder(sent1, sent2, mask1, mask2)
+        hidden_output = self.attention_aggregation(a, b, mask1, mask2)
         output = self.classification_layer(hidden_output)
 
         return output
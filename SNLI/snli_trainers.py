@@ -4,7 +4,7 @@ import torch
 from torch.utils import data
 
 from pos_and_ner.trainers import ModelTrainer
-from pos_and_ner.models import BaseModel
+from pos_and_ner.models import BaseModel, get_autocast_context
 from pos_and_ner.configs import TrainingConfig
 from pos_and_ner.predictors import BasePredictor
 
@@ -14,6 +14,9 @@ class SNLITrainer(ModelTrainer):
     def __init__(self, model: BaseModel, train_config: TrainingConfig, predictor: BasePredictor, loss_function):
         super().__init__(model, train_config, predictor, loss_function)
 
+    def get_default_optimizer_name(self) -> str:
+        return "adagrad"
+
     def train(self, model_name: str, train_dataset: data.Dataset, dev_dataset: data.Dataset) -> None:
         # training hyper parameters and configuration
         train_batch_size = self.train_config["batch_size"]
@@ -27,7 +30,7 @@ class SNLITrainer(ModelTrainer):
         # model, loss and optimizer
         model = self.model
         model = model.to(device)
-        optimizer = torch.optim.Adagrad(filter(lambda p: p.requires_grad, model.parameters()), lr=learning_rate)
+        optimizer = self.create_optimizer(model, learning_rate)
 
         # create data loaders
         train_config_dict = {"batch_size": train_batch_size, "num_workers": num_workers}
@@ -50,8 +53,9 @@ class SNLITrainer(ModelTrainer):
                 x_1, x_2, y = x_1.to(device), x_2.to(device), y.to(device)
 
                 optimizer.zero_grad()
-                outputs = model(x_1, x_2)
-                loss = self.loss_function(outputs, y)
+                with get_autocast_context(self.precision, device):
+                    outputs = model(x_1, x_2)
+                    loss = self.loss_function(outputs, y)
 
                 loss.backward()
                 optimizer.step()
@@ -94,10 +98,11 @@ class SNLITrainer(ModelTrainer):
             for batch_idx, sample in enumerate(loader):
                 x_1, x_2, y = sample
                 x_1, x_2, y = x_1.to(device), x_2.to(device), y.to(device)
-                outputs = model(x_1, x_2)
+                with get_autocast_context(self.precision, device):
+                    outputs = model(x_1, x_2)
 
-                # compute the loss of the batch
-                loss = self.loss_function(outputs, y)
+                    # compute the loss of the batch
+                    loss = self.loss_function(outputs, y)
                 dataset_loss += loss.item() * len(y)  # sum of losses, so multiply with batch size
 
                 # compute number of correct predictions for the batch
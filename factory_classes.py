@@ -1,12 +1,14 @@
 import torch.nn as nn
 import torch.utils.data as data
 
-from pos_and_ner.models import BaseModel, WindowTagger, WindowModelWithPreTrainedEmbeddings, WindowModelWithSubWords, AcceptorLSTM, BasicBiLSTM, BiLSTMWithSubWords, BiLSTMWithChars, BiLSTMWithCharsAndWords
-from pos_and_ner.mappers import BaseMapper, TokenMapperUnkCategory, TokenMapperWithSubWords, BaseMapperWithPadding, RegularLanguageMapper, TokenMapperUnkCategoryWithPadding, TokenMapperWithSubWordsWithPadding, TokenMapperWithCharsWithWordsWithPadding, TokenMapperWithCharsWithPadding
-from pos_and_ner.predictors import BasePredictor, WindowModelPredictor, WindowNERTaggerPredictor, AcceptorPredictor, GreedyLSTMPredictor, GreedyLSTMPredictorForNER
+from pos_and_ner.models import BaseModel, WindowTagger, WindowModelWithPreTrainedEmbeddings, WindowModelWithSubWords, AcceptorLSTM, BasicBiLSTM, BiLSTMWithSubWords, BiLSTMWithChars, BiLSTMWithCharsAndWords, MultiTaskBiLSTM
+from pos_and_ner.mappers import BaseMapper, TokenMapperUnkCategory, TokenMapperWithSubWords, BaseMapperWithPadding, RegularLanguageMapper, TokenMapperUnkCategoryWithPadding, TokenMapperWithSubWordsWithPadding, TokenMapperWithCharsWithWordsWithPadding, TokenMapperWithCharsWithPadding, MultiTaskTokenMapperWithPadding
+from pos_and_ner.predictors import BasePredictor, WindowModelPredictor, WindowNERTaggerPredictor, AcceptorPredictor, GreedyLSTMPredictor, GreedyLSTMPredictorForNER, \
+    ViterbiLSTMPredictor, ViterbiLSTMPredictorForNER
 from pos_and_ner.configs import BaseConfig, ModelConfig, TrainingConfig, WindowTaggerConfig, InferenceConfig, RNNConfig, RNNWithCharsEmbeddingsConfig, RNNWithCharsWithWordsEmbeddingsConfig
-from pos_and_ner.datasets import WindowDataset, WindowWithSubWordsDataset, RegularLanguageDataset, BiLSTMDataset, BiLSTMWithSubWordsDataset, BiLSTMWithCharsDataset, BiLSTMWithCharsAndWordDataset
+from pos_and_ner.datasets import WindowDataset, WindowWithSubWordsDataset, WindowSentenceDataset, WindowWithSubWordsSentenceDataset, RegularLanguageDataset, BiLSTMDataset, BiLSTMWithSubWordsDataset, BiLSTMWithCharsDataset, BiLSTMWithCharsAndWordDataset
 from pos_and_ner.trainers import ModelTrainer, AcceptorTrainer, BiLSTMTrainer
+from pos_and_ner.tokenizers import RawTextTokenizer
 from SNLI.snli_configs import SNLIDecomposeAttentionVanillaConfig
 from SNLI.snli_mappers import SNLIMapperWithGloveIndices
 from SNLI.snli_models import SNLIDecomposeAttentionVanillaModel, SNLIDecomposeAttentionIntraSentenceModel
@@ -38,6 +40,9 @@ class ConfigsFactory(object):
 
             return RNNConfig()
 
+        if "multitask" in config_type:
+            return RNNConfig()
+
         if config_type.startswith("SNLI"):
             return SNLIDecomposeAttentionVanillaConfig()
 
@@ -86,18 +91,31 @@ class MappersFactory(object):
 
             return RegularLanguageMapper(min_frequency, split_char)
 
+        if "multitask" in mapper_name:
+            return MultiTaskTokenMapperWithPadding(min_frequency, split_char)
+
         if mapper_name.startswith("SNLI"):
             config: SNLIDecomposeAttentionVanillaConfig
             if "glove_path" in config:
                 glove_path = config["glove_path"]
             else:
                 glove_path = ""
-            return SNLIMapperWithGloveIndices(min_frequency, split_char, glove_path)
+            glove_dtype = config["glove_dtype"] if "glove_dtype" in config else "float32"
+            return SNLIMapperWithGloveIndices(min_frequency, split_char, glove_path, glove_dtype)
 
 
 class ModelsFactory(object):
 
     def __call__(self, parameters_dict: TrainingConfig, model_config: ModelConfig, mapper: BaseMapper, model_name: str) -> BaseModel:
+        model = self._create_model(parameters_dict, model_config, mapper, model_name)
+
+        # window models can process whole sentences instead of per token windows
+        if "window" in model_name and "sentence_level" in parameters_dict and parameters_dict["sentence_level"]:
+            model.sentence_level = True
+
+        return model
+
+    def _create_model(self, parameters_dict: TrainingConfig, model_config: ModelConfig, mapper: BaseMapper, model_name: str) -> BaseModel:
 
         if "window" in model_name:
             # flags
@@ -162,6 +180,11 @@ class ModelsFactory(object):
             mapper: RegularLanguageMapper
             return AcceptorLSTM(model_config, mapper)
 
+        if "multitask" in model_name:
+            model_config: RNNConfig
+            mapper: MultiTaskTokenMapperWithPadding
+            return MultiTaskBiLSTM(model_config, mapper)
+
         if model_name.startswith("SNLI"):
             model_config: SNLIDecomposeAttentionVanillaConfig
             mapper: SNLIMapperWithGloveIndices
@@ -169,12 +192,13 @@ class ModelsFactory(object):
                 glove_path = parameters_dict["glove_path"]
             else:
                 glove_path = None
+            glove_dtype = parameters_dict["glove_dtype"] if "glove_dtype" in parameters_dict else "float32"
 
             if "vanilla" in model_name:
-                return SNLIDecomposeAttentionVanillaModel(model_config, mapper, glove_path)
+                return SNLIDecomposeAttentionVanillaModel(model_config, mapper, glove_path, glove_dtype)
             else:
                 sequence_length = parameters_dict["sequence_length"]
-                return SNLIDecomposeAttentionIntraSentenceModel(model_config, mapper, glove_path, sequence_length)
+                return SNLIDecomposeAttentionIntraSentenceModel(model_config, mapper, glove_path, sequence_length, glove_dtype)
 
 
 class PredictorsFactory(object):
@@ -184,12 +208,22 @@ class PredictorsFactory(object):
             if "_ner" in predictor_type:
                 return WindowNERTaggerPredictor(mapper)
 
-            if "pos_" in predictor_type:
+            if "_pos" in predictor_type:
                 return WindowModelPredictor(mapper)
 
         elif "lstm" in predictor_type:
             mapper: BaseMapperWithPadding
 
+            # Viterbi decoding over hard BIO constraints or over a saved transitions matrix instead of greedy argmax
+            if "decoding" in parameters_dict and parameters_dict["decoding"] == "viterbi":
+                transitions_path = parameters_dict["transitions_path"] if "transitions_path" in parameters_dict else None
+
+                if "_ner" in predictor_type:
+                    return ViterbiLSTMPredictorForNER(mapper, transitions_path)
+
+                if "_pos" in predictor_type:
+                    return ViterbiLSTMPredictor(mapper, transitions_path)
+
             if "_ner" in predictor_type:
                 return GreedyLSTMPredictorForNER(mapper)
 
@@ -205,6 +239,15 @@ class PredictorsFactory(object):
 
 class DatasetsFactory(object):
     def __call__(self, config: BaseConfig, file_path: str, mapper: BaseMapper, dataset_type: str) -> data.Dataset:
+        dataset = self._create_dataset(config, file_path, mapper, dataset_type)
+
+        # raw text documents are tokenized and split to sentences while the dataset is read
+        if "raw_text" in config and config["raw_text"]:
+            dataset.set_raw_text_tokenizer(RawTextTokenizer())
+
+        return dataset
+
+    def _create_dataset(self, config: BaseConfig, file_path: str, mapper: BaseMapper, dataset_type: str) -> data.Dataset:
 
         if "window" in dataset_type:
 
@@ -213,6 +256,19 @@ class DatasetsFactory(object):
             else:
                 window_size = 2  # default value
 
+            # sentence level samples - the windows are built by the model
+            if "sentence_level" in config and config["sentence_level"]:
+                if "sequence_length" in config:
+                    sequence_length = config["sequence_length"]
+                else:
+                    sequence_length = 50  # default value
+
+                if "sub_words" in dataset_type:
+                    mapper: TokenMapperWithSubWords
+                    return WindowWithSubWordsSentenceDataset(file_path, mapper, sequence_length)
+
+                return WindowSentenceDataset(file_path, mapper, sequence_length)
+
             if "sub_words" in dataset_type:
                 mapper: TokenMapperWithSubWords
                 return WindowWithSubWordsDataset(file_path, mapper, window_size)
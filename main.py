@@ -2,7 +2,12 @@ import argparse
 import sys
 
 from pos_and_ner.train_script import train
-from pos_and_ner.inference_script import inference
+from pos_and_ner.inference_script import inference, precision_report
+from pos_and_ner.export import export_model
+from pos_and_ner.numpy_export import export_numpy_model
+from pos_and_ner.compress import compress_checkpoint
+from pos_and_ner.distillation import distill
+from pos_and_ner.multitask import multitask_train, multitask_inference
 
 SUPPORTED_MODELS = ["window_ner", "window_pos", "window_pre_trained_ner", "window_pre_trained_pos",
                     "window_sub_words_ner", "window_sub_words_pos", "window_pre_trained_sub_words_ner",
@@ -45,6 +50,100 @@ if __name__ == '__main__':
     inference_parser.add_argument("--inference_config_path", type=str, required=True,
                                   help="path to a json file containing model hyper parameters for inference procedure")
 
+    precision_parser = subparsers.add_parser('precision_report')
+    precision_parser.add_argument("--model_type", type=str, required=True, choices=SUPPORTED_MODELS,
+                                     help='unique name of the training procedure (used for checkpoint saving')
+    precision_parser.add_argument("--dev_path", type=str, required=True,
+                                     help="a path to a labeled development set file")
+    precision_parser.add_argument("--trained_model_path", type=str, required=True,
+                                     help="a path to a trained model checkpoint (.pth file")
+    precision_parser.add_argument("--inference_config_path", type=str, required=True,
+                                     help="path to a json file containing model hyper parameters for inference procedure")
+
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument("--model_type", type=str, required=True, choices=SUPPORTED_MODELS,
+                               help='unique name of the training procedure (used for checkpoint saving')
+    export_parser.add_argument("--trained_model_path", type=str, required=True,
+                               help="a path to a trained model checkpoint (.pth file")
+    export_parser.add_argument("--example_path", type=str, required=True,
+                               help="a path to a file of the test format, the model is traced and checked on its samples")
+    export_parser.add_argument("--inference_config_path", type=str, required=True,
+                               help="path to a json file containing model hyper parameters for inference procedure")
+    export_parser.add_argument("--export_prefix", type=str, required=True,
+                               help="path prefix of the exported files (<prefix>.pt and <prefix>.json)")
+
+    numpy_export_parser = subparsers.add_parser('numpy_export')
+    numpy_export_parser.add_argument("--model_type", type=str, required=True, choices=SUPPORTED_MODELS,
+                                     help='unique name of the training procedure (used for checkpoint saving')
+    numpy_export_parser.add_argument("--trained_model_path", type=str, required=True,
+                                     help="a path to a trained model checkpoint (.pth file")
+    numpy_export_parser.add_argument("--example_path", type=str, required=True,
+                                     help="a path to a file of the test format, the numpy model is checked on its samples")
+    numpy_export_parser.add_argument("--inference_config_path", type=str, required=True,
+                                     help="path to a json file containing model hyper parameters for inference procedure")
+    numpy_export_parser.add_argument("--export_prefix", type=str, required=True,
+                                     help="path prefix of the exported files (<prefix>.npz and <prefix>.json)")
+
+    multitask_training_parser = subparsers.add_parser('multitask_training')
+    multitask_training_parser.add_argument("--name", type=str, required=True, metavar='multitask_pos_ner',
+                                           help='unique name of the training procedure (used for checkpoint saving')
+    multitask_training_parser.add_argument("--pos_train_path", type=str, required=True,
+                                           help="a path to the POS training file")
+    multitask_training_parser.add_argument("--pos_dev_path", type=str, required=True,
+                                           help="a path to the POS development set file")
+    multitask_training_parser.add_argument("--ner_train_path", type=str, required=True,
+                                           help="a path to the NER training file")
+    multitask_training_parser.add_argument("--ner_dev_path", type=str, required=True,
+                                           help="a path to the NER development set file")
+    multitask_training_parser.add_argument("--model_config_path", type=str, required=True,
+                                           help="path to a json file containing model hyper parameters")
+    multitask_training_parser.add_argument("--training_config_path", type=str, required=True,
+                                           help="path to a json file containing hyper parameters for training procedure")
+
+    multitask_inference_parser = subparsers.add_parser('multitask_inference')
+    multitask_inference_parser.add_argument("--test_path", type=str, required=True,
+                                            help="a path to a test set file")
+    multitask_inference_parser.add_argument("--trained_model_path", type=str, required=True,
+                                            help="a path to a trained multi task model checkpoint (.pth file")
+    multitask_inference_parser.add_argument("--save_output_path", type=str, required=True,
+                                            help="a path to a save the prediction results ")
+    multitask_inference_parser.add_argument("--inference_config_path", type=str, required=True,
+                                            help="path to a json file containing model hyper parameters for inference procedure")
+
+    distillation_parser = subparsers.add_parser('distillation')
+    distillation_parser.add_argument("--name", type=str, required=True, metavar='window_pos_distilled',
+                                     help='unique name of the training procedure (used for checkpoint saving')
+    distillation_parser.add_argument("--model_type", type=str, required=True, choices=[model for model in SUPPORTED_MODELS if "window" in model],
+                                     help='type of the trained (student) window model')
+    distillation_parser.add_argument("--teacher_model_type", type=str, required=True, choices=[model for model in SUPPORTED_MODELS if "lstm" in model],
+                                     help='type of the trained lstm (teacher) model')
+    distillation_parser.add_argument("--teacher_model_path", type=str, required=True,
+                                     help="a path to the teacher model checkpoint (.pth file")
+    distillation_parser.add_argument("--corpus_path", type=str, required=True,
+                                     help="a path to the training corpus, labels are not required")
+    distillation_parser.add_argument("--dev_path", type=str, required=True,
+                                     help="a path to a labeled development set file")
+    distillation_parser.add_argument("--model_config_path", type=str, required=True,
+                                     help="path to a json file containing model hyper parameters")
+    distillation_parser.add_argument("--training_config_path", type=str, required=True,
+                                     help="path to a json file containing hyper parameters for training procedure")
+
+    compress_parser = subparsers.add_parser('compress')
+    compress_parser.add_argument("--model_type", type=str, required=True, choices=SUPPORTED_MODELS,
+                                 help='unique name of the training procedure (used for checkpoint saving')
+    compress_parser.add_argument("--trained_model_path", type=str, required=True,
+                                 help="a path to a trained model checkpoint (.pth file")
+    compress_parser.add_argument("--dev_path", type=str, required=True,
+                                 help="a path to a labeled development set file")
+    compress_parser.add_argument("--inference_config_path", type=str, required=True,
+                                 help="path to a json file containing model hyper parameters for inference procedure")
+    compress_parser.add_argument("--method", type=str, default="pq", choices=["pq", "low_rank"],
+                                 help="product quantization (pq) or low rank factorization of the embedding tables")
+    compress_parser.add_argument("--compression_ratio", type=float, default=8,
+                                 help="targeted compression ratio of the embedding tables")
+    compress_parser.add_argument("--save_path", type=str, required=True,
+                                 help="a path to save the compressed checkpoint (.pth file)")
+
     args = parser.parse_args(sys.argv[1:])
     mode = sys.argv[1]
     if mode == "training":
@@ -64,3 +163,71 @@ if __name__ == '__main__':
         save_output_path = args.save_output_path
 
         inference(test_path, inference_config_path, trained_model_path, save_output_path, model_type)
+
+    if mode == "precision_report":
+        dev_path = args.dev_path
+        model_type = args.model_type
+        trained_model_path = args.trained_model_path
+        inference_config_path = args.inference_config_path
+
+        precision_report(dev_path, inference_config_path, trained_model_path, model_type)
+
+    if mode == "export":
+        model_type = args.model_type
+        trained_model_path = args.trained_model_path
+        example_path = args.example_path
+        inference_config_path = args.inference_config_path
+        export_prefix = args.export_prefix
+
+        export_model(model_type, trained_model_path, example_path, inference_config_path, export_prefix)
+
+    if mode == "numpy_export":
+        model_type = args.model_type
+        trained_model_path = args.trained_model_path
+        example_path = args.example_path
+        inference_config_path = args.inference_config_path
+        export_prefix = args.export_prefix
+
+        export_numpy_model(model_type, trained_model_path, example_path, inference_config_path, export_prefix)
+
+    if mode == "multitask_training":
+        name = args.name
+        pos_train_path = args.pos_train_path
+        pos_dev_path = args.pos_dev_path
+        ner_train_path = args.ner_train_path
+        ner_dev_path = args.ner_dev_path
+        model_config_path = args.model_config_path
+        training_config_path = args.training_config_path
+
+        multitask_train(name, pos_train_path, pos_dev_path, ner_train_path, ner_dev_path, model_config_path, training_config_path)
+
+    if mode == "multitask_inference":
+        test_path = args.test_path
+        trained_model_path = args.trained_model_path
+        inference_config_path = args.inference_config_path
+        save_output_path = args.save_output_path
+
+        multitask_inference(test_path, inference_config_path, trained_model_path, save_output_path)
+
+    if mode == "distillation":
+        name = args.name
+        model_type = args.model_type
+        teacher_model_type = args.teacher_model_type
+        teacher_model_path = args.teacher_model_path
+        corpus_path = args.corpus_path
+        dev_path = args.dev_path
+        model_config_path = args.model_config_path
+        training_config_path = args.training_config_path
+
+        distill(name, model_type, teacher_model_type, teacher_model_path, corpus_path, dev_path, model_config_path, training_config_path)
+
+    if mode == "compress":
+        model_type = args.model_type
+        trained_model_path = args.trained_model_path
+        dev_path = args.dev_path
+        inference_config_path = args.inference_config_path
+        method = args.method
+        compression_ratio = args.compression_ratio
+        save_path = args.save_path
+
+        compress_checkpoint(model_type, trained_model_path, dev_path, inference_config_path, method, compression_ratio, save_path)
@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import random
+import string
+import argparse
+import tempfile
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+from torch.utils import data
+
+from pos_and_ner.configs import RNNConfig, RNNWithCharsEmbeddingsConfig
+from pos_and_ner.mappers import TokenMapperWithCharsWithPadding, RegularLanguageMapper, TokenMapperUnkCategoryWithPadding
+from pos_and_ner.datasets import BiLSTMWithCharsDataset, RegularLanguageDataset, BiLSTMDataset
+from pos_and_ner.models import BaseModel, BiLSTMWithChars, AcceptorLSTM, BasicBiLSTM
+from pos_and_ner.predictors import GreedyLSTMPredictor
+
+# sentence encoders of the BiLSTM taggers (the "encoder" attribute of the model config)
+SENTENCE_ENCODERS = ["lstm", "dilated_cnn", "transformer"]
+
+
+def create_synthetic_tagging_file(file_path: str, num_sentences: int, vocabulary_size: int = 5000, seed: int = 1,
+                                  contextual_labels: bool = False) -> None:
+    # sentences of zipf distributed words (so frequent words repeat like in real text) with random labels
+    # contextual labels are a function of the previous word instead, so a tagger can only learn them from the context
+    # the vocabulary doesn't depend on the seed, so files of different seeds (train and dev) share their words
+    vocabulary_generator = random.Random(vocabulary_size)
+    vocabulary = ["".join(vocabulary_generator.choice(string.ascii_lowercase) for _ in range(vocabulary_generator.randint(1, 12)))
+                  for _ in range(vocabulary_size)]
+    random_generator = random.Random(seed)
+    words_weights = [1.0 / rank for rank in range(1, vocabulary_size + 1)]
+    labels = ["NN", "VB", "DT", "JJ", "IN"]
+
+    with open(file_path, "w", encoding="utf8") as f:
+        for _ in range(num_sentences):
+            sentence_length = random_generator.randint(5, 40)
+            words_indices = random_generator.choices(range(vocabulary_size), weights=words_weights, k=sentence_length)
+            for position, word_index in enumerate(words_indices):
+                if contextual_labels:
+                    label = labels[words_indices[position - 1] % len(labels)] if position > 0 else labels[0]
+                else:
+                    label = random_generator.choice(labels)
+
+                f.write(f"{vocabulary[word_index]}\t{label}\n")
+            f.write("\n")
+
+
+def measure_throughput(model: BaseModel, loader: data.DataLoader, padding_label_index: int, training: bool) -> float:
+    # returns the number of real (non padding) tokens processed per second
+    optimizer = torch.optim.Adam(model.parameters()) if training else None
+    loss_function = nn.CrossEntropyLoss(ignore_index=padding_label_index)
+    model.train(training)
+
+    num_tokens = 0
+    start_time = time.perf_counter()
+    with torch.set_grad_enabled(training):
+        for x, y in loader:
+            outputs = model(x)
+            if training:
+                optimizer.zero_grad()
+                loss = loss_function(outputs, y)
+                loss.backward()
+                optimizer.step()
+
+            num_tokens += int(torch.sum(y != padding_label_index))
+
+    return num_tokens / (time.perf_counter() - start_time)
+
+
+def measure_chars_encoder_throughput(model: BaseModel, loader: data.DataLoader, padding_label_index: int) -> float:
+    # returns the number of real words encoded per second by the chars encoder alone (inference mode)
+    model.eval()
+
+    num_words = 0
+    start_time = time.perf_counter()
+    with torch.no_grad():
+        for x, y in loader:
+            model.encode_words_chars(x)
+            num_words += int(torch.sum(y != padding_label_index))
+
+    return num_words / (time.perf_counter() - start_time)
+
+
+def benchmark_char_encoders(num_sentences: int, chars_lengths: List[int], batch_size: int) -> List[Tuple[str, int, float, float, float]]:
+    model_configs = [
+        ("lstm", {"char_encoder": "lstm"}),
+        ("lstm packed", {"char_encoder": "lstm", "pack_chars": True}),
+        ("cnn", {"char_encoder": "cnn"})
+    ]
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "synthetic_train")
+        create_synthetic_tagging_file(file_path, num_sentences)
+        mapper = TokenMapperWithCharsWithPadding(min_frequency=0, split_char="\t")
+        mapper.create_mapping(file_path)
+
+        for chars_length in chars_lengths:
+            dataset = BiLSTMWithCharsDataset(file_path, mapper, sequence_length=40, chars_length=chars_length)
+            loader = data.DataLoader(dataset, batch_size=batch_size)
+
+            for name, config_params in model_configs:
+                torch.manual_seed(1)
+                model_config = RNNWithCharsEmbeddingsConfig().from_dict(config_params)
+                model = BiLSTMWithChars(model_config, mapper)
+
+                train_throughput = measure_throughput(model, loader, mapper.get_label_padding_index(), training=True)
+                inference_throughput = measure_throughput(model, loader, mapper.get_label_padding_index(), training=False)
+                encoder_throughput = measure_chars_encoder_throughput(model, loader, mapper.get_label_padding_index())
+                results.append((name, chars_length, train_throughput, inference_throughput, encoder_throughput))
+
+    return results
+
+
+def measure_accuracy(model: BaseModel, loader: data.DataLoader, predictor: GreedyLSTMPredictor) -> float:
+    model.eval()
+    num_correct_predictions = 0
+    total_predictions = 0
+    with torch.no_grad():
+        for x, y in loader:
+            num_correct_batch, total_predictions_batch = predictor.infer_model_outputs_with_gold_labels(model(x), y)
+            num_correct_predictions += num_correct_batch
+            total_predictions += total_predictions_batch
+
+    return num_correct_predictions / total_predictions
+
+
+def benchmark_sentence_encoders(train_path: Optional[str], dev_path: Optional[str], num_sentences: int, num_epochs: int,
+                                batch_size: int, split_char: str = "\t") -> List[Tuple[str, float, float, float]]:
+    # trains a BiLSTM tagger with every sentence encoder and returns its train and inference throughput (tokens per
+    # second) and its dev accuracy. without train and dev files, synthetic files with contextual labels over a small
+    # vocabulary (learned in a few epochs) are used
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        if train_path is None or dev_path is None:
+            train_path = os.path.join(directory, "synthetic_train")
+            dev_path = os.path.join(directory, "synthetic_dev")
+            create_synthetic_tagging_file(train_path, num_sentences, vocabulary_size=500, contextual_labels=True)
+            create_synthetic_tagging_file(dev_path, num_sentences // 10, vocabulary_size=500, seed=2, contextual_labels=True)
+
+        mapper = TokenMapperUnkCategoryWithPadding(min_frequency=0, split_char=split_char)
+        mapper.create_mapping(train_path)
+        predictor = GreedyLSTMPredictor(mapper)
+        train_loader = data.DataLoader(BiLSTMDataset(train_path, mapper, sequence_length=40), batch_size=batch_size, shuffle=True)
+        dev_loader = data.DataLoader(BiLSTMDataset(dev_path, mapper, sequence_length=40), batch_size=batch_size)
+
+        for encoder in SENTENCE_ENCODERS:
+            torch.manual_seed(1)
+            model = BasicBiLSTM(RNNConfig().from_dict({"encoder": encoder}), mapper)
+
+            # the train throughput is the mean over the epochs
+            train_throughputs = [measure_throughput(model, train_loader, mapper.get_label_padding_index(), training=True)
+                                 for _ in range(num_epochs)]
+            inference_throughput = measure_throughput(model, dev_loader, mapper.get_label_padding_index(), training=False)
+            accuracy = measure_accuracy(model, dev_loader, predictor)
+            results.append((encoder, sum(train_throughputs) / num_epochs, inference_throughput, accuracy))
+
+    return results
+
+
+def benchmark_acceptor(file_path: str, batch_size: int) -> List[Tuple[str, float, float]]:
+    # throughput in strings per second of the acceptor on the padded strings and on the trimmed batches (pack_sequences)
+    mapper = RegularLanguageMapper(min_frequency=0, split_char="\t")
+    mapper.create_mapping()
+    dataset = RegularLanguageDataset(file_path, mapper)
+    loader = data.DataLoader(dataset, batch_size=batch_size)
+    loss_function = nn.CrossEntropyLoss()
+
+    results = []
+    for name, config_params in [("padded", {}), ("trimmed", {"pack_sequences": True})]:
+        torch.manual_seed(1)
+        model = AcceptorLSTM(RNNConfig().from_dict(config_params), mapper)
+        optimizer = torch.optim.Adam(model.parameters())
+        throughputs = []
+
+        for training in (True, False):
+            model.train(training)
+            start_time = time.perf_counter()
+            with torch.set_grad_enabled(training):
+                for x, y in loader:
+                    outputs = model(x)
+                    if training:
+                        optimizer.zero_grad()
+                        loss_function(outputs, y).backward()
+                        optimizer.step()
+
+            throughputs.append(len(dataset) / (time.perf_counter() - start_time))
+
+        results.append((name, throughputs[0], throughputs[1]))
+
+    return results
+
+
+if __name__ == '__main__':
+    # create the parser
+    parser = argparse.ArgumentParser(description='throughput benchmarks of the models variants')
+    parser.add_argument("--benchmark", type=str, choices=["char_encoders", "acceptor", "sentence_encoders"], default="char_encoders", help="which benchmark to run")
+    parser.add_argument("--acceptor_path", type=str, default="pos_and_ner/acceptor_data/acceptor_test", help="regular language strings file for the acceptor benchmark")
+    parser.add_argument("--train_path", type=str, default=None, help="tagging training file for the sentence encoders benchmark (synthetic when not given)")
+    parser.add_argument("--dev_path", type=str, default=None, help="tagging development file for the sentence encoders benchmark (synthetic when not given)")
+    parser.add_argument("--split_char", type=str, default="\t", help="separator of the words and labels in the train and dev files")
+    parser.add_argument("--num_epochs", type=int, default=3, help="number of training epochs of the sentence encoders benchmark")
+    parser.add_argument("--num_sentences", type=int, default=2000, help="number of synthetic sentences")
+    parser.add_argument("--chars_lengths", type=int, nargs="+", default=[10, 20], help="values of char_sequence_length to compare")
+    parser.add_argument("--batch_size", type=int, default=64, help="batch size")
+    parser.add_argument("--threads", type=int, default=0, help="number of torch threads (0 keeps the torch default)")
+
+    args = parser.parse_args(sys.argv[1:])
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    if args.benchmark == "acceptor":
+        print(f"{'acceptor':<12}{'train strings/sec':>19}{'inference strings/sec':>23}")
+        for variant_name, train_strings, inference_strings in benchmark_acceptor(args.acceptor_path, args.batch_size):
+            print(f"{variant_name:<12}{train_strings:>19.0f}{inference_strings:>23.0f}")
+        sys.exit(0)
+
+    if args.benchmark == "sentence_encoders":
+        print(f"{'encoder':<13}{'train tokens/sec':>18}{'inference tokens/sec':>22}{'dev accuracy':>14}")
+        for encoder_name, train_tokens, inference_tokens, accuracy in benchmark_sentence_encoders(
+                args.train_path, args.dev_path, args.num_sentences, args.num_epochs, args.batch_size, args.split_char):
+            print(f"{encoder_name:<13}{train_tokens:>18.0f}{inference_tokens:>22.0f}{accuracy:>14.4f}")
+        sys.exit(0)
+
+    print(f"{'encoder':<12}{'chars':>6}{'train tokens/sec':>18}{'inference tokens/sec':>22}{'encoder words/sec':>19}")
+    for encoder_name, chars_length_, train_tokens, inference_tokens, encoder_words in \
+            benchmark_char_encoders(args.num_sentences, args.chars_lengths, args.batch_size):
+        print(f"{encoder_name:<12}{chars_length_:>6}{train_tokens:>18.0f}{inference_tokens:>22.0f}{encoder_words:>19.0f}")
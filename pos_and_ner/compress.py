@@ -0,0 +1,66 @@
+import torch
+import torch.nn as nn
+from torch.utils import data
+
+from factory_classes import ConfigsFactory, PredictorsFactory, DatasetsFactory
+from pos_and_ner.inference_script import load_trained_model
+from pos_and_ner.models import BaseModel
+from pos_and_ner.quantization import get_model_size, evaluate_model
+from pos_and_ner.compressed_embeddings import compress_embeddings
+
+
+def get_module_size(module: nn.Module) -> int:
+    # size in bytes of the tensors of a module (embedding table, codebooks and codes or low rank factors)
+    return sum(tensor.numel() * tensor.element_size() for tensor in module.state_dict().values())
+
+
+def compress_checkpoint(model_type: str, trained_model_path: str, dev_path: str, inference_config_path: str,
+                        method: str, compression_ratio: float, save_path: str) -> None:
+    # replaces the word, prefix and suffix embedding tables of a trained model by product quantized ("pq") or low
+    # rank ("low_rank") tables, compares the accuracy of the original and the compressed models on a labeled dev
+    # file and saves the compressed checkpoint (loaded by load_trained_model like any other checkpoint)
+    config_factory = ConfigsFactory()
+    predictors_factory = PredictorsFactory()
+    dataset_factory = DatasetsFactory()
+
+    inference_config = config_factory("inference").from_json_file(inference_config_path)
+    model, _ = load_trained_model(trained_model_path, model_type)
+    model: BaseModel
+    predictor = predictors_factory(inference_config, model.mapper, model_type)
+
+    dev_dataset = dataset_factory(inference_config, dev_path, model.mapper, model_type)
+    dev_config_dict = {"batch_size": inference_config["batch_size"], "num_workers": inference_config["num_workers"]}
+    dev_loader = data.DataLoader(dev_dataset, **dev_config_dict)
+
+    # both models are measured on CPU
+    model = model.to(torch.device("cpu"))
+    model.eval()
+    accuracy, _ = evaluate_model(model, predictor, dev_loader)
+    model_size = get_model_size(model)
+
+    # the model is compressed in place, so the sizes of the original tables are measured first
+    tables_sizes = {name: get_module_size(module) for name, module in model.named_modules() if isinstance(module, nn.Embedding)}
+    compressed_embeddings = compress_embeddings(model, method, compression_ratio)
+    if len(compressed_embeddings) == 0:
+        raise ValueError(f"The {model_type} model doesn't have embedding tables large enough to compress")
+
+    compressed_accuracy, _ = evaluate_model(model, predictor, dev_loader)
+    compressed_model_size = get_model_size(model)
+    embeddings_size = sum(tables_sizes[name] for name in compressed_embeddings)
+    modules = dict(model.named_modules())
+    compressed_embeddings_size = sum(get_module_size(modules[name]) for name in compressed_embeddings)
+
+    print(f"compressed tables: {', '.join(compressed_embeddings)}")
+    print(f"{'model':<10}{'accuracy':>10}{'embeddings (MB)':>18}{'model (MB)':>12}")
+    print(f"{'fp32':<10}{accuracy:>10.4f}{embeddings_size / 2 ** 20:>18.2f}{model_size / 2 ** 20:>12.2f}")
+    print(f"{method:<10}{compressed_accuracy:>10.4f}{compressed_embeddings_size / 2 ** 20:>18.2f}{compressed_model_size / 2 ** 20:>12.2f}")
+    print(f"accuracy loss: {accuracy - compressed_accuracy:.4f}, "
+          f"embeddings compression: {embeddings_size / compressed_embeddings_size:.1f}x")
+
+    # the compressed checkpoint keeps all the parameters in its state (no frozen parameters side files)
+    checkpoint_data = torch.load(trained_model_path)
+    model_data = checkpoint_data["model"]
+    model_data["state"] = model.state_dict()
+    model_data["compressed_embeddings"] = compressed_embeddings
+    model_data.pop("frozen_parameters", None)
+    torch.save(checkpoint_data, save_path)
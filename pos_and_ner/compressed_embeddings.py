@@ -0,0 +1,191 @@
+from typing import Dict, Tuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def _nearest_centroids(vectors: torch.tensor, centroids: torch.tensor, batch_size: int = 65536) -> torch.tensor:
+    # distances are computed in batches of vectors to bound the memory of the vectors x centroids matrix
+    return torch.cat([torch.argmin(torch.cdist(vectors[start: start + batch_size], centroids), dim=1)
+                      for start in range(0, vectors.size(0), batch_size)])
+
+
+def kmeans(vectors: torch.tensor, num_centroids: int, num_iterations: int = 20, seed: int = 1) -> Tuple[torch.tensor, torch.tensor]:
+    # returns the centroids and the centroid index of every vector
+    generator = torch.Generator().manual_seed(seed)
+    centroids = vectors[torch.randperm(vectors.size(0), generator=generator)[:num_centroids]].clone()
+
+    for _ in range(num_iterations):
+        assignments = _nearest_centroids(vectors, centroids)
+        sums = torch.zeros_like(centroids).index_add_(0, assignments, vectors)
+        counts = torch.bincount(assignments, minlength=num_centroids)
+
+        # a centroid without vectors keeps its position
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty].unsqueeze(1).type(vectors.dtype)
+
+    return centroids, _nearest_centroids(vectors, centroids)
+
+
+class ProductQuantizedEmbedding(nn.Module):
+    """
+    Embedding table compressed by product quantization. Every vector is split to num_subspaces sub vectors and every
+    sub vector is replaced by the index (one byte) of its nearest centroid in the codebook of its subspace
+    """
+
+    def __init__(self, num_embeddings: int, embedding_dim: int, num_subspaces: int, num_centroids: int = 256,
+                 padding_idx: int = None):
+        super().__init__()
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.num_subspaces = num_subspaces
+        self.num_centroids = num_centroids
+        self.padding_idx = padding_idx
+
+        codes_dtype = torch.uint8 if num_centroids <= 256 else torch.int16
+        self.register_buffer("codebooks", torch.zeros(num_subspaces, num_centroids, embedding_dim // num_subspaces))
+        self.register_buffer("codes", torch.zeros(num_embeddings, num_subspaces, dtype=codes_dtype))
+        self.register_buffer("subspaces", torch.arange(num_subspaces))
+
+    @classmethod
+    def from_embedding(cls, embedding: nn.Embedding, num_subspaces: int, num_centroids: int = 256) -> "ProductQuantizedEmbedding":
+        weight = embedding.weight.detach().float().cpu()
+        num_embeddings, embedding_dim = weight.size()
+        num_centroids = min(num_centroids, num_embeddings)
+        compressed = cls(num_embeddings, embedding_dim, num_subspaces, num_centroids, embedding.padding_idx)
+
+        # the padding vector is not clustered, it gets the last centroid of every codebook which is kept all zero,
+        # so padding positions stay zero vectors
+        rows = torch.arange(num_embeddings)
+        num_clusters = num_centroids
+        if embedding.padding_idx is not None:
+            rows = rows[rows != embedding.padding_idx]
+            num_clusters = num_centroids - 1
+            compressed.codes[embedding.padding_idx] = num_centroids - 1
+
+        # every subspace has its own codebook
+        sub_vectors = weight[rows].view(rows.size(0), num_subspaces, -1)
+        for subspace in range(num_subspaces):
+            centroids, assignments = kmeans(sub_vectors[:, subspace], num_clusters)
+            compressed.codebooks[subspace, :num_clusters] = centroids
+            compressed.codes[rows, subspace] = assignments.type(compressed.codes.dtype)
+
+        return compressed.to(embedding.weight.device)
+
+    @property
+    def weight(self) -> torch.tensor:
+        # the decompressed table, used by the code that reads the whole table (e.g. window position tables)
+        return self(torch.arange(self.num_embeddings, device=self.codes.device))
+
+    def forward(self, x: torch.tensor) -> torch.tensor:
+        # codes of the tokens have dimensions (..., num_subspaces), the sub vectors are concatenated back
+        codes = self.codes[x].long()
+        sub_vectors = self.codebooks[self.subspaces, codes]
+        return torch.flatten(sub_vectors, start_dim=-2)
+
+
+class LowRankEmbedding(nn.Module):
+    """
+    Embedding table compressed to the product of a (num_embeddings x rank) table and a (rank x embedding_dim) matrix
+    (truncated SVD of the original table)
+    """
+
+    def __init__(self, num_embeddings: int, embedding_dim: int, rank: int, padding_idx: int = None):
+        super().__init__()
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.rank = rank
+        self.padding_idx = padding_idx
+        self.left_factor = nn.Parameter(torch.zeros(num_embeddings, rank))
+        self.right_factor = nn.Parameter(torch.zeros(rank, embedding_dim))
+
+    @classmethod
+    def from_embedding(cls, embedding: nn.Embedding, rank: int) -> "LowRankEmbedding":
+        weight = embedding.weight.detach().float().cpu()
+        num_embeddings, embedding_dim = weight.size()
+        compressed = cls(num_embeddings, embedding_dim, rank, embedding.padding_idx)
+
+        u, s, v = torch.svd(weight)
+        with torch.no_grad():
+            compressed.left_factor.copy_(u[:, :rank] * s[:rank])
+            compressed.right_factor.copy_(v[:, :rank].t())
+
+            # the padding vector stays exactly zero
+            if embedding.padding_idx is not None:
+                compressed.left_factor[embedding.padding_idx] = 0
+
+        return compressed.to(embedding.weight.device)
+
+    @property
+    def weight(self) -> torch.tensor:
+        return self.left_factor @ self.right_factor
+
+    def forward(self, x: torch.tensor) -> torch.tensor:
+        return F.embedding(x, self.left_factor) @ self.right_factor
+
+
+def get_num_subspaces(num_embeddings: int, embedding_dim: int, compression_ratio: float, num_centroids: int = 256) -> int:
+    # the float32 table takes 4 * num_embeddings * embedding_dim bytes. the compressed table takes num_subspaces bytes
+    # per vector and 4 * num_centroids * embedding_dim bytes of codebooks, so the largest divisor of embedding_dim
+    # that reaches the compression ratio is used
+    codebooks_size = 4 * min(num_centroids, num_embeddings) * embedding_dim
+    max_num_subspaces = (4 * num_embeddings * embedding_dim / compression_ratio - codebooks_size) / num_embeddings
+    return max(divisor for divisor in range(1, max(1, int(max_num_subspaces)) + 1) if embedding_dim % divisor == 0)
+
+
+def get_rank(num_embeddings: int, embedding_dim: int, compression_ratio: float) -> int:
+    # the factors take 4 * rank * (num_embeddings + embedding_dim) bytes
+    return max(1, int(num_embeddings * embedding_dim / (compression_ratio * (num_embeddings + embedding_dim))))
+
+
+def create_compressed_embedding(embedding: nn.Embedding, method: str, compression_ratio: float) -> Tuple[nn.Module, dict]:
+    # returns the compressed embedding and the description needed to create it again when the checkpoint is loaded
+    num_embeddings, embedding_dim = embedding.num_embeddings, embedding.embedding_dim
+    if method == "pq":
+        num_subspaces = get_num_subspaces(num_embeddings, embedding_dim, compression_ratio)
+        compressed = ProductQuantizedEmbedding.from_embedding(embedding, num_subspaces)
+        description = {"method": method, "num_subspaces": num_subspaces, "num_centroids": compressed.num_centroids}
+    elif method == "low_rank":
+        rank = get_rank(num_embeddings, embedding_dim, compression_ratio)
+        compressed = LowRankEmbedding.from_embedding(embedding, rank)
+        description = {"method": method, "rank": rank}
+    else:
+        raise ValueError(f"Unknown embedding compression method {method}, should be 'pq' or 'low_rank'")
+
+    description.update({"num_embeddings": num_embeddings, "embedding_dim": embedding_dim, "padding_idx": embedding.padding_idx})
+    return compressed, description
+
+
+def _set_module(model: nn.Module, module_name: str, module: nn.Module) -> None:
+    # the root module has the empty name in named_modules
+    parent_name, _, attribute_name = module_name.rpartition(".")
+    parent = dict(model.named_modules())[parent_name]
+    setattr(parent, attribute_name, module)
+
+
+def compress_embeddings(model: nn.Module, method: str, compression_ratio: float, min_rows: int = 256) -> Dict[str, dict]:
+    # replaces every embedding table with at least min_rows rows (words, prefixes, suffixes) by its compressed version
+    # small tables (characters) are kept. returns the descriptions of the compressed tables
+    descriptions = {}
+    embeddings = [(name, module) for name, module in model.named_modules() if isinstance(module, nn.Embedding)]
+    for name, embedding in embeddings:
+        if embedding.num_embeddings >= min_rows:
+            compressed, descriptions[name] = create_compressed_embedding(embedding, method, compression_ratio)
+            _set_module(model, name, compressed)
+
+    return descriptions
+
+
+def replace_with_compressed_embeddings(model: nn.Module, descriptions: Dict[str, dict]) -> None:
+    # creates empty compressed tables in place of the embeddings of a model, before loading a compressed checkpoint
+    for name, description in descriptions.items():
+        if description["method"] == "pq":
+            compressed = ProductQuantizedEmbedding(description["num_embeddings"], description["embedding_dim"],
+                                                   description["num_subspaces"], description["num_centroids"],
+                                                   description["padding_idx"])
+        else:
+            compressed = LowRankEmbedding(description["num_embeddings"], description["embedding_dim"],
+                                          description["rank"], description["padding_idx"])
+
+        _set_module(model, name, compressed)
@@ -89,10 +89,14 @@ class RNNConfig(ModelConfig):
 
 
 class RNNWithCharsEmbeddingsConfig(RNNConfig):
-    def __init__(self, config_dict=None, embedding_dim: int = 50, hidden_dim: int = 150, char_hidden_dim: int = 50):
+    def __init__(self, config_dict=None, embedding_dim: int = 50, hidden_dim: int = 150, char_hidden_dim: int = 50,
+                 char_encoder: str = "lstm", char_cnn_widths: tuple = (2, 3, 4), char_cnn_filters: int = 50):
         super().__init__(config_dict, embedding_dim, hidden_dim)
         if config_dict is None:
             self.config["char_hidden_dim"] = char_hidden_dim
+            self.config["char_encoder"] = char_encoder  # "lstm" or "cnn"
+            self.config["char_cnn_widths"] = list(char_cnn_widths)
+            self.config["char_cnn_filters"] = char_cnn_filters
 
 
 class RNNWithCharsWithWordsEmbeddingsConfig(RNNWithCharsEmbeddingsConfig):
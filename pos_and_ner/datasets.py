@@ -1,9 +1,52 @@
-from typing import Tuple, List
+from contextlib import closing
+from typing import Tuple, List, Optional
 
 import torch
 import torch.utils.data as data
 
-from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding, TokenMapperWithSubWords, TokenMapperWithSubWordsWithPadding, TokenMapperWithCharsWithWordsWithPadding, TokenMapperWithCharsWithPadding,BEGIN, END
+from pos_and_ner.tokenizers import RawTextTokenizer
+from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding, TokenMapperWithSubWords, TokenMapperWithSubWordsWithPadding, TokenMapperWithCharsWithWordsWithPadding, TokenMapperWithCharsWithPadding,BEGIN, END, IGNORED_LABEL_INDEX
+
+
+def get_real_tokens_mask(x: torch.tensor, model_type: str, padding_index: int) -> torch.tensor:
+    # returns a flat mask of the batch tokens that are not padding, in the order of the flattened sequence predictions
+    # special case for character embeddings
+    if "char_embeddings" in model_type:
+        batch_size, num_words, chars_in_word = x.size()
+
+        # fold num words dimension into batch dimension
+        all_batch_words = x.view(batch_size * num_words, chars_in_word)
+
+        # a valid word is a word that has at least 1 char that is not the char padding
+        return ~torch.all(all_batch_words == padding_index, dim=1)
+
+    if "char_word_embeddings" in model_type:
+        words_x = x[:, :, -1]
+        return (words_x != padding_index).flatten()
+
+    # sub words samples have the words, prefixes and suffixes sequences
+    if len(x.size()) == 3:
+        return (x[:, 0, :] != padding_index).flatten()
+
+    return (x != padding_index).flatten()
+
+
+def get_sentence_chunks(sentence_length: int, chunk_length: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    # splits a sentence to chunks of chunk_length tokens, consecutive chunks share 2 * overlap tokens.
+    # returns the start and end of every chunk in the sentence and the start and end (in the chunk) of the tokens it
+    # predicts - the center of the chunk, without the overlap tokens that are predicted by the neighbour chunks
+    if sentence_length <= chunk_length:
+        return [(0, sentence_length, 0, sentence_length)]
+
+    stride = chunk_length - 2 * overlap
+    chunks = []
+    start = 0
+    while start + chunk_length < sentence_length:
+        chunks.append((start, start + chunk_length, 0 if start == 0 else overlap, chunk_length - overlap))
+        start += stride
+
+    chunks.append((start, sentence_length, overlap, sentence_length - start))
+    return chunks
 
 
 class BaseDataset(data.Dataset):
@@ -13,6 +56,69 @@ class BaseDataset(data.Dataset):
         self.mapper = mapper
         self.samples = []
         self.labels = []
+        self.tokenizer: Optional[RawTextTokenizer] = None
+        self.chunk_length: Optional[int] = None
+        self.chunk_overlap = 0
+
+    def set_raw_text_tokenizer(self, tokenizer: RawTextTokenizer) -> None:
+        # the dataset file is a raw text document and not a one-token-per-line file
+        self.tokenizer = tokenizer
+
+    def set_chunking(self, chunk_length: int, overlap: int) -> None:
+        # sentences longer than chunk_length are read as overlapping chunks, every chunk is a sample
+        if chunk_length <= 2 * overlap:
+            raise ValueError(f"Chunks of {chunk_length} tokens can't have an overlap of {overlap} tokens on each side")
+
+        self.chunk_length = chunk_length
+        self.chunk_overlap = overlap
+
+    def _open_file_lines(self):
+        # raw text documents are tokenized on the fly into the one-token-per-line format
+        if self.tokenizer is not None:
+            return closing(self.tokenizer.iter_token_lines(self.filepath))
+
+        return open(self.filepath, "r", encoding="utf8")
+
+    def _open_lines(self):
+        if self.chunk_length is None:
+            return self._open_file_lines()
+
+        return closing(self._iter_chunks_lines())
+
+    def _iter_chunks_lines(self):
+        # every chunk of a long sentence is given as a sentence of its own
+        with self._open_file_lines() as f:
+            sentence = []
+            for line in f:
+                if line != "\n":
+                    sentence.append(line)
+                    continue
+
+                for start, end, _, _ in get_sentence_chunks(len(sentence), self.chunk_length, self.chunk_overlap):
+                    yield from sentence[start:end]
+                    yield "\n"
+
+                sentence = []
+
+    def stitch_chunks_predictions(self, predictions: list) -> list:
+        # the predictions of the chunks tokens (in the order of the chunks) to the predictions of the sentences tokens,
+        # every token gets the prediction of the chunk it is in the center of
+        stitched_predictions = []
+        index = 0
+        with self._open_file_lines() as f:
+            sentence_length = 0
+            for line in f:
+                if line != "\n":
+                    sentence_length += 1
+                    continue
+
+                for start, end, predicted_start, predicted_end in get_sentence_chunks(sentence_length, self.chunk_length, self.chunk_overlap):
+                    stitched_predictions.extend(predictions[index + predicted_start:index + predicted_end])
+                    index += end - start
+
+                sentence_length = 0
+
+        return stitched_predictions
 
     def _init_dataset(self) -> None:
         raise NotImplementedError("A dataset class must implement a method to read the dataset to memory")
@@ -38,7 +144,7 @@ class WindowDataset(BaseDataset):
     def _init_dataset(self) -> None:
         curr_sent = []
         curr_labels = []
-        with open(self.filepath, "r", encoding="utf8") as f:
+        with self._open_lines() as f:
             for line in f:
                 if line == "\n":  # marks end of sentence
                     self._create_window_samples_from_sent(curr_sent, curr_labels)
@@ -91,6 +197,30 @@ class WindowDataset(BaseDataset):
         return x, y
 
 
+class SoftLabelsDataset(data.Dataset):
+    """
+    Samples of a dataset with soft labels (a distribution over the labels for every sample) instead of its own
+    labels, e.g. the distributions predicted by a teacher model for distillation
+    """
+    def __init__(self, dataset: BaseDataset, soft_labels: torch.tensor):
+        super().__init__()
+        self.dataset = dataset
+        self.soft_labels = soft_labels
+
+        # the labels of the dataset file (if it has any) are not used
+        self.dataset.init_dataset_if_not_initiated()
+        self.dataset.labels = []
+        if len(self.dataset) != len(self.soft_labels):
+            raise ValueError(f"{self.dataset.filepath} has {len(self.dataset)} samples but {len(self.soft_labels)} soft labels were given")
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, item_idx: int) -> Tuple[torch.tensor, torch.tensor]:
+        x, _ = self.dataset[item_idx]
+        return x, self.soft_labels[item_idx]
+
+
 class WindowWithSubWordsDataset(WindowDataset):
     def __init__(self, filepath: str, mapper: TokenMapperWithSubWords, window_size: int = 2):
         super().__init__(filepath, mapper, window_size)
@@ -116,7 +246,7 @@ class WindowWithSubWordsDataset(WindowDataset):
         curr_prefixes = []
         curr_suffixes = []
 
-        with open(self.filepath, "r", encoding="utf8") as f:
+        with self._open_lines() as f:
             for line in f:
                 if line == "\n":  # marks end of sentence
                     self._create_window_samples_from_sent(curr_sent, curr_labels)
@@ -179,7 +309,7 @@ class RegularLanguageDataset(BaseDataset):
         self.sequence_length = sequence_length
 
     def _init_dataset(self) -> None:
-        with open(self.filepath, "r", encoding="utf8") as f:
+        with self._open_lines() as f:
             for line in f:
                 sample, label = line[:-1].split(self.mapper.split_char)
                 sample = self._prune_or_pad_sample(sample)
@@ -223,7 +353,7 @@ class BiLSTMDataset(BaseDataset):
         self.sequence_length = sequence_length
 
     def _init_dataset(self) -> None:
-        with open(self.filepath, "r", encoding="utf8") as f:
+        with self._open_lines() as f:
             curr_sentence = []
             curr_labels = []
             for line in f:
@@ -288,7 +418,7 @@ class BiLSTMDataset(BaseDataset):
 
     def get_dataset_max_sequence_length(self):
         max_sequence_length = 0
-        with open(self.filepath, "r", encoding="utf8") as f:
+        with self._open_lines() as f:
             current_sequence_length = 0
             for line in f:
                 if line == "\n":  # empty line denotes end of a sentence
@@ -300,6 +430,96 @@ class BiLSTMDataset(BaseDataset):
         return max_sequence_length
 
 
+class WindowSentenceDataset(BiLSTMDataset):
+    """
+    Sentence level dataset for the window based taggers.
+    Every sample is a whole sentence padded with END tokens, the windows are built by the model itself
+    """
+    def __init__(self, filepath: str, mapper: BaseMapper, sequence_length: int = 65):
+        super().__init__(filepath, mapper, sequence_length)
+
+    def _init_dataset(self) -> None:
+        with self._open_lines() as f:
+            curr_sentence = []
+            curr_labels = []
+            for line in f:
+
+                if line == "\n":  # empty line denotes end of a sentence
+                    if len(curr_labels) > 0:
+                        self.labels.append(curr_labels)
+                        curr_labels = []
+
+                    self.samples.append(curr_sentence)
+                    curr_sentence = []
+
+                else:  # append word and label to current sentence
+                    tokens = line[:-1].split(self.mapper.split_char)
+
+                    # check that indeed we have a label and it is not a blind test set
+                    if len(tokens) == 2:
+                        label = tokens[1]
+                        curr_labels.append(label)
+
+                    word = tokens[0]
+                    curr_sentence.append(word)
+
+    def _prune_or_pad_sample(self, sample: List[str]) -> List[str]:
+        # words after the end of the sentence are END tokens, exactly as in the windows of the last words
+        sample = sample[:self.sequence_length]
+        padding_length = self.sequence_length - len(sample)
+
+        return sample + [END] * padding_length
+
+    def _get_labels_tensor(self, item_idx: int) -> torch.tensor:
+        # verify if it a train/dev dataset of a test dataset
+        if len(self.labels) == 0:
+            return torch.tensor([])
+
+        labels = self.labels[item_idx][:self.sequence_length]
+        labels_indices = [self.mapper.get_label_idx(label) for label in labels]
+
+        # padding words are ignored by the loss and by the accuracy computation
+        labels_indices += [IGNORED_LABEL_INDEX] * (self.sequence_length - len(labels_indices))
+        return torch.tensor(labels_indices)
+
+    def __getitem__(self, item_idx: int) -> Tuple[torch.tensor, torch.tensor]:
+        self.init_dataset_if_not_initiated()
+
+        # padding is done here so the sequence length can still be changed after reading the dataset
+        sample = self._prune_or_pad_sample(self.samples[item_idx])
+        sample_indices = [self.mapper.get_token_idx(word) for word in sample]
+        x = torch.tensor(sample_indices)
+        y = self._get_labels_tensor(item_idx)
+
+        return x, y
+
+
+class WindowWithSubWordsSentenceDataset(WindowSentenceDataset):
+
+    def __init__(self, filepath: str, mapper: TokenMapperWithSubWords, sequence_length: int = 65):
+        super().__init__(filepath, mapper, sequence_length)
+
+    def __getitem__(self, item_idx: int) -> Tuple[torch.tensor, torch.tensor]:
+        self.init_dataset_if_not_initiated()
+
+        # retrieve sample and transform from tokens to indices
+        self.mapper: TokenMapperWithSubWords
+        sample = self._prune_or_pad_sample(self.samples[item_idx])
+        sample_indices = [self.mapper.get_token_idx(word) for word in sample]
+
+        # the padding END token is also the prefix and suffix of the padding words
+        prefixes_indices = [self.mapper.get_prefix_index(word if word == END else word[:3]) for word in sample]
+        suffixes_indices = [self.mapper.get_suffix_index(word if word == END else word[-3:]) for word in sample]
+
+        sample_indices = torch.tensor(sample_indices)
+        prefixes_indices = torch.tensor(prefixes_indices)
+        suffixes_indices = torch.tensor(suffixes_indices)
+        x = torch.stack([sample_indices, prefixes_indices, suffixes_indices])
+        y = self._get_labels_tensor(item_idx)
+
+        return x, y
+
+
 class BiLSTMWithSubWordsDataset(BiLSTMDataset):
 
     def __init__(self, filepath: str, mapper: TokenMapperWithSubWordsWithPadding, sequence_length: int = 65):
@@ -308,7 +528,7 @@ class BiLSTMWithSubWordsDataset(BiLSTMDataset):
         self.suffixes = []
 
     def _init_dataset(self) -> None:
-        with open(self.filepath, "r", encoding="utf8") as f:
+        with self._open_lines() as f:
             curr_sentence = []
             curr_prefixes = []
             curr_suffixes = []
@@ -389,7 +609,7 @@ class BiLSTMWithCharsDataset(BiLSTMDataset):
         self.chars_length = chars_length
 
     def _init_dataset(self) -> None:
-        with open(self.filepath, "r", encoding="utf8") as f:
+        with self._open_lines() as f:
             curr_sentence = []
             curr_labels = []
             for line in f:
@@ -480,7 +700,7 @@ class BiLSTMWithCharsAndWordDataset(BiLSTMDataset):
         self.chars_length = chars_length
 
     def _init_dataset(self) -> None:
-        with open(self.filepath, "r", encoding="utf8") as f:
+        with self._open_lines() as f:
             curr_sentence_chars = []
             curr_sentence = []
             curr_labels = []
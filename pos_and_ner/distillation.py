@@ -0,0 +1,134 @@
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils import data
+
+from factory_classes import ConfigsFactory, MappersFactory, ModelsFactory, PredictorsFactory, DatasetsFactory, TrainerFactory
+from pos_and_ner.inference_script import load_trained_model
+from pos_and_ner.models import BaseModel
+from pos_and_ner.mappers import BaseMapperWithPadding
+from pos_and_ner.configs import BaseConfig
+from pos_and_ner.datasets import BiLSTMDataset, SoftLabelsDataset, get_real_tokens_mask
+
+
+class SoftCrossEntropyLoss(nn.Module):
+    """
+    Cross entropy with soft targets (distributions over the labels) for knowledge distillation. The outputs are
+    softened by the temperature the targets were computed with, and the loss is scaled by temperature ** 2 so the
+    gradients size doesn't depend on the temperature. Hard targets (label indices, e.g. of a dev set) get the
+    usual cross entropy
+    """
+
+    def __init__(self, temperature: float = 1.0):
+        super().__init__()
+        self.temperature = temperature
+
+    def forward(self, outputs: torch.tensor, targets: torch.tensor) -> torch.tensor:
+        if targets.dim() < outputs.dim():
+            return F.cross_entropy(outputs, targets)
+
+        log_probabilities = F.log_softmax(outputs / self.temperature, dim=1)
+        return -torch.sum(targets * log_probabilities, dim=1).mean() * self.temperature ** 2
+
+
+def compute_soft_labels(teacher: BaseModel, teacher_type: str, corpus_path: str, config: BaseConfig,
+                        temperature: float) -> Tuple[List[str], torch.tensor]:
+    # returns the teacher labels and the teacher distribution over them for every token of the corpus, in file order
+    datasets_factory = DatasetsFactory()
+    mapper: BaseMapperWithPadding = teacher.mapper
+    device = torch.device(config["device"])
+
+    # the whole sentences are tagged, none is pruned
+    corpus_dataset: BiLSTMDataset = datasets_factory(config, corpus_path, mapper, teacher_type)
+    corpus_dataset.sequence_length = corpus_dataset.get_dataset_max_sequence_length()
+    corpus_loader = data.DataLoader(corpus_dataset, batch_size=config["batch_size"], num_workers=config["num_workers"])
+
+    # the padding label is not a label of the student
+    label_padding_index = mapper.get_label_padding_index()
+    labels_indices = [index for index in sorted(mapper.idx_to_label) if index != label_padding_index]
+    labels = [mapper.get_label_from_idx(index) for index in labels_indices]
+
+    teacher = teacher.to(device)
+    teacher.eval()
+    soft_labels = []
+    with torch.no_grad():
+        for sample in corpus_loader:
+            x, _ = sample
+            x = x.to(device)
+
+            # outputs have dimensions batch, labels, sequence - every real token gets a distribution over the labels
+            outputs = teacher(x).permute(0, 2, 1)
+            outputs = outputs.reshape(-1, outputs.size(2))[:, labels_indices]
+            real_tokens_mask = get_real_tokens_mask(x, teacher_type, mapper.get_padding_index())
+            soft_labels.append(F.softmax(outputs[real_tokens_mask] / temperature, dim=1).cpu())
+
+    return labels, torch.cat(soft_labels)
+
+
+def get_file_signature(file_path: str) -> dict:
+    # a file rewritten in place (e.g. a teacher retrained the same day, which gets the same checkpoint name) has another
+    # modification time or size
+    return {"path": os.path.abspath(file_path), "mtime": os.path.getmtime(file_path), "size": os.path.getsize(file_path)}
+
+
+def load_or_compute_soft_labels(teacher_type: str, teacher_path: str, corpus_path: str, config: BaseConfig,
+                                temperature: float, soft_labels_path: str) -> Tuple[List[str], torch.tensor]:
+    # the soft labels are cached to disk, and computed again only for another (or modified) teacher or corpus, or for
+    # another temperature
+    cache_key = {"teacher": get_file_signature(teacher_path), "corpus": get_file_signature(corpus_path), "temperature": temperature}
+    if os.path.exists(soft_labels_path):
+        cached_soft_labels = torch.load(soft_labels_path)
+        if cached_soft_labels["key"] == cache_key:
+            return cached_soft_labels["labels"], cached_soft_labels["soft_labels"]
+
+    teacher, _ = load_trained_model(teacher_path, teacher_type)
+    labels, soft_labels = compute_soft_labels(teacher, teacher_type, corpus_path, config, temperature)
+
+    Path(soft_labels_path).parent.mkdir(parents=True, exist_ok=True)
+    torch.save({"key": cache_key, "labels": labels, "soft_labels": soft_labels}, soft_labels_path)
+    return labels, soft_labels
+
+
+def distill(training_unique_name: str, model_type: str, teacher_type: str, teacher_path: str, corpus_path: str,
+            dev_path: str, model_config_path: str, training_config_path: str) -> None:
+    # trains a window tagger on the label distributions a trained lstm tagger (the teacher) predicts for the tokens
+    # of a corpus. the corpus doesn't need labels, the dev set is labeled and the student is evaluated on it
+    if "window" not in model_type or "lstm" not in teacher_type:
+        raise ValueError(f"Distillation trains a window tagger from an lstm tagger, got {model_type} from {teacher_type}")
+
+    config_factory = ConfigsFactory()
+    mappers_factory = MappersFactory()
+    models_factory = ModelsFactory()
+    predictors_factory = PredictorsFactory()
+    datasets_factory = DatasetsFactory()
+    trainer_factory = TrainerFactory()
+
+    training_config = config_factory("training").from_json_file(training_config_path)
+    model_config = config_factory(model_type).from_json_file(model_config_path)
+    if "sentence_level" in training_config and training_config["sentence_level"]:
+        raise ValueError("Distillation trains on per token windows, sentence_level is not supported")
+
+    temperature = training_config["distillation_temperature"] if "distillation_temperature" in training_config else 1.0
+    if "soft_labels_path" in training_config:
+        soft_labels_path = training_config["soft_labels_path"]
+    else:
+        soft_labels_path = str(Path(training_config["checkpoints_path"]) / training_unique_name / "soft_labels.pth")
+
+    labels, soft_labels = load_or_compute_soft_labels(teacher_type, teacher_path, corpus_path, training_config,
+                                                      temperature, soft_labels_path)
+
+    # the student has the words of the corpus and the labels of the teacher, in the order of the soft labels
+    mapper = mappers_factory(training_config, mapper_name=model_type)
+    mapper.create_mapping(corpus_path)
+    mapper.set_labels(labels)
+
+    train_data = SoftLabelsDataset(datasets_factory(training_config, corpus_path, mapper, dataset_type=model_type), soft_labels)
+    dev_data = datasets_factory(training_config, dev_path, mapper, dataset_type=model_type)
+    model = models_factory(training_config, model_config, mapper, model_name=model_type)
+    predictor = predictors_factory(training_config, mapper, predictor_type=model_type)
+    trainer = trainer_factory(model, training_config, predictor, SoftCrossEntropyLoss(temperature), model_type=model_type)
+    trainer.train(training_unique_name, train_dataset=train_data, dev_dataset=dev_data)
@@ -0,0 +1,143 @@
+import os
+import json
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+class EmbeddingStore(object):
+    """
+    Binary store of pre-trained word vectors. The vectors are saved as a raw matrix that is memory mapped
+    on load, so opening the store doesn't parse or copy the vectors, only the rows that are used are read.
+    A store is made of 3 files sharing the same prefix:
+    <prefix>.bin - raw matrix of vectors (one row per word)
+    <prefix>.words - the words, one per line, in the order of the matrix rows
+    <prefix>.json - the matrix metadata (number of rows, dimension and data type)
+    The vectors can be stored as float16 to halve the size of the store, rows are returned as float32
+    """
+
+    def __init__(self, store_prefix: str):
+        self.store_prefix = store_prefix
+
+        with open(f"{store_prefix}.json", "r", encoding="utf8") as f:
+            metadata = json.load(f)
+
+        self.word_to_row: Dict[str, int] = {}
+        # only "\n" ends a line, some pre-trained words contain other line breaking characters
+        with open(f"{store_prefix}.words", "r", encoding="utf8", newline="\n") as f:
+            for row, word in enumerate(f):
+                word = word[:-1]  # remove end of line token
+                self.word_to_row[word] = row
+
+        self.vectors: np.memmap = np.memmap(f"{store_prefix}.bin", dtype=metadata["dtype"], mode="r",
+                                            shape=(metadata["rows"], metadata["dim"]))
+
+    def __len__(self) -> int:
+        return len(self.word_to_row)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.word_to_row
+
+    def get_vectors_dim(self) -> int:
+        return self.vectors.shape[1]
+
+    def lookup(self, words: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # returns the positions (in the given words) of the words that are in the store, and their rows
+        positions = []
+        rows = []
+        for position, word in enumerate(words):
+            row = self.word_to_row.get(word)
+            if row is not None:
+                positions.append(position)
+                rows.append(row)
+
+        return np.array(positions, dtype=np.int64), np.array(rows, dtype=np.int64)
+
+    def get_rows(self, rows: np.ndarray) -> np.ndarray:
+        # reads only the requested rows from the memory mapped matrix, as float32
+        return np.asarray(self.vectors[rows], dtype=np.float32)
+
+    @staticmethod
+    def is_store_up_to_date(store_prefix: str, source_paths: List[str]) -> bool:
+        store_files = [f"{store_prefix}.{extension}" for extension in ("bin", "words", "json")]
+        if not all(os.path.exists(path) for path in store_files):
+            return False
+
+        # the store is considered stale if one of the source files was modified after it was created
+        store_time = min(os.path.getmtime(path) for path in store_files)
+        return all(os.path.getmtime(path) <= store_time for path in source_paths)
+
+    @staticmethod
+    def get_store_prefix(source_path: str, dtype: str = "float32") -> str:
+        # the store is kept next to its source file, a float16 store gets its own files
+        store_prefix = os.path.splitext(source_path)[0]
+        return store_prefix if dtype == "float32" else f"{store_prefix}.{dtype}"
+
+    @staticmethod
+    def convert_text_files(vocab_path: str, vectors_path: str, store_prefix: str, dtype: str = "float32") -> None:
+        # vocab file has a word per line, vectors file has the matching vector per line (space separated values)
+        with open(vocab_path, "r", encoding="utf8") as vocab_file, open(vectors_path, "r", encoding="utf8") as vectors_file:
+            words_and_vectors = ((word[:-1] if word.endswith("\n") else word, line.split())
+                                 for word, line in zip(vocab_file, vectors_file))
+            EmbeddingStore._write_store(words_and_vectors, store_prefix, dtype, skip_defected=False)
+
+    @staticmethod
+    def convert_glove_file(glove_path: str, store_prefix: str, dtype: str = "float32") -> None:
+        # every line of a glove file is a word followed by its vector (space separated values)
+        with open(glove_path, "r", encoding="utf8", newline="\n") as glove_file:
+            words_and_vectors = ((line_tokens[0], line_tokens[1:]) for line_tokens in (line.split(" ") for line in glove_file))
+            EmbeddingStore._write_store(words_and_vectors, store_prefix, dtype, skip_defected=True)
+
+    @staticmethod
+    def _write_store(words_and_vectors: Iterable[Tuple[str, List[str]]], store_prefix: str, dtype: str, skip_defected: bool) -> None:
+        rows = 0
+        dim = None
+        with open(f"{store_prefix}.words", "w", encoding="utf8", newline="\n") as words_file, open(f"{store_prefix}.bin", "wb") as matrix_file:
+            for word, vector_values in words_and_vectors:
+                try:
+                    vector = np.array(vector_values, dtype=np.float32)
+                except ValueError:
+                    vector = None
+
+                dim = len(vector) if dim is None and vector is not None else dim
+                if vector is None or len(vector) != dim:
+                    # there are cases where glove contains a "word" with a space, we skip those defected lines
+                    if skip_defected:
+                        continue
+                    raise ValueError(f"Vector of word {word} can't be parsed as a vector of dimension {dim}")
+
+                words_file.write(f"{word}\n")
+                matrix_file.write(vector.astype(dtype).tobytes())
+                rows += 1
+
+        # metadata is written last, so an interrupted conversion doesn't leave a valid looking store
+        with open(f"{store_prefix}.json", "w", encoding="utf8") as f:
+            json.dump({"rows": rows, "dim": dim, "dtype": dtype}, f)
+
+    @classmethod
+    def from_text_files(cls, vocab_path: str, vectors_path: str, dtype: str = "float32") -> "EmbeddingStore":
+        # the store is created next to the vectors file the first time it is needed and reused afterwards
+        store_prefix = cls.get_store_prefix(vectors_path, dtype)
+        if not cls.is_store_up_to_date(store_prefix, [vocab_path, vectors_path]):
+            cls.convert_text_files(vocab_path, vectors_path, store_prefix, dtype)
+
+        return cls(store_prefix)
+
+    @classmethod
+    def from_glove_file(cls, glove_path: str, dtype: str = "float32") -> "EmbeddingStore":
+        # the rows of the store are the indices used by the mapper, so the mapper and the model must open the same store
+        store_prefix = cls.get_store_prefix(glove_path, dtype)
+        if not cls.is_store_up_to_date(store_prefix, [glove_path]):
+            cls.convert_glove_file(glove_path, store_prefix, dtype)
+
+        return cls(store_prefix)
+
+
+if __name__ == '__main__':
+    # usage: embedding_store.py <vocab file> <vectors file> or embedding_store.py <glove file> [float32|float16]
+    import sys
+    if len(sys.argv) > 2 and sys.argv[2] not in ("float32", "float16"):
+        store_ = EmbeddingStore.from_text_files(sys.argv[1], sys.argv[2])
+    else:
+        store_ = EmbeddingStore.from_glove_file(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "float32")
+    print(f"Embedding store {store_.store_prefix} has {len(store_)} words with vectors of dimension {store_.get_vectors_dim()}")
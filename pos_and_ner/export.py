@@ -0,0 +1,84 @@
+import json
+
+import torch
+from torch.utils import data
+
+from factory_classes import ConfigsFactory, DatasetsFactory
+from pos_and_ner.inference_script import load_trained_model
+from pos_and_ner.models import BaseModel
+from pos_and_ner.mappers import BaseMapperWithPadding, END, encode_mapper_state
+
+# dataset attributes that are passed to the dataset constructor by the loader of the exported model
+DATASET_ATTRIBUTES = ["window_size", "sequence_length", "chars_length"]
+
+
+def export_model(model_type: str, trained_model_path: str, example_path: str, inference_config_path: str, export_prefix: str) -> None:
+    # traces a trained model on the samples of the example file and saves the TorchScript module to <prefix>.pt
+    # and the mapper and the inputs settings to <prefix>.json (see pos_and_ner.exported_model for the loader)
+    config_factory = ConfigsFactory()
+    dataset_factory = DatasetsFactory()
+
+    inference_config = config_factory("inference").from_json_file(inference_config_path)
+    model, model_name = load_trained_model(trained_model_path, model_type)
+    model: BaseModel
+    mapper = model.mapper
+
+    sentence_level = "window" in model_type and "sentence_level" in inference_config and inference_config["sentence_level"]
+    if sentence_level:
+        model.sentence_level = True
+
+    sequence_predictions = "lstm" in model_type or sentence_level
+    example_dataset = dataset_factory(inference_config, example_path, mapper, model_type)
+    if sequence_predictions:
+        example_dataset.sequence_length = example_dataset.get_dataset_max_sequence_length()
+
+    # the exported model runs on CPU, the cpu model is traced in eval mode (no dropout)
+    model = model.to(torch.device("cpu"))
+    model.eval()
+    example_loader = data.DataLoader(example_dataset, batch_size=inference_config["batch_size"])
+    examples_inputs = [tuple(sample[:-1]) for sample in example_loader]
+
+    # all the example batches have the sequence length of the tracing batch, so the first batch is checked padded to
+    # a shorter and a longer sequence length as well (a trace that kept the sequence length would pass the examples)
+    if hasattr(example_dataset, "sequence_length"):
+        for sequence_length in [max(1, example_dataset.sequence_length // 2), example_dataset.sequence_length * 2]:
+            length_dataset = dataset_factory(inference_config, example_path, mapper, model_type)
+            length_dataset.sequence_length = sequence_length
+            length_loader = data.DataLoader(length_dataset, batch_size=inference_config["batch_size"])
+            examples_inputs.append(tuple(next(iter(length_loader))[:-1]))
+
+    with torch.no_grad():
+        traced_model = torch.jit.trace(model, examples_inputs[0], check_trace=False)
+
+        # the trace records the operations of the first batch only, make sure it reproduces the model on all the batches
+        for inputs in examples_inputs:
+            try:
+                reproduced = torch.allclose(traced_model(*inputs), model(*inputs), atol=1e-5)
+            except RuntimeError as error:
+                raise ValueError(f"The traced {model_name} model fails on the inputs of size {inputs[0].size()} from {example_path}") from error
+
+            if not reproduced:
+                raise ValueError(f"The traced {model_name} model doesn't reproduce the model outputs on {example_path}")
+
+    torch.jit.save(traced_model, f"{export_prefix}.pt")
+
+    padding_index = None
+    if sequence_predictions:
+        mapper: BaseMapperWithPadding
+        padding_index = mapper.get_token_idx(END) if sentence_level else mapper.get_padding_index()
+
+    dataset_class = example_dataset.__class__
+    metadata = {
+        "model_type": model_type,
+        "model_name": model_name,
+        "mapper": {"module": mapper.__class__.__module__, "name": mapper.__class__.__name__,
+                   "state": encode_mapper_state(mapper.serialize())},
+        "dataset": {"module": dataset_class.__module__, "name": dataset_class.__name__,
+                    "kwargs": {name: getattr(example_dataset, name) for name in DATASET_ATTRIBUTES if hasattr(example_dataset, name)}},
+        "raw_text": example_dataset.tokenizer is not None,
+        "sequence_predictions": sequence_predictions,
+        "padding_index": padding_index
+    }
+
+    with open(f"{export_prefix}.json", "w", encoding="utf8") as f:
+        json.dump(metadata, f)
@@ -0,0 +1,75 @@
+import sys
+import json
+import importlib
+from typing import List
+
+import torch
+from torch.utils import data
+
+from pos_and_ner.mappers import BaseMapper, decode_mapper_state
+from pos_and_ner.datasets import get_real_tokens_mask
+from pos_and_ner.tokenizers import RawTextTokenizer
+
+
+def create_object(class_description: dict, *args, **kwargs):
+    # classes of the mapper and the dataset are saved by module and name, so only the modules they need are imported
+    module = importlib.import_module(class_description["module"])
+    return getattr(module, class_description["name"])(*args, **kwargs)
+
+
+class ExportedModel(object):
+    """
+    Runs inference with a model exported by pos_and_ner.export - a TorchScript module (<prefix>.pt) and a json file
+    with the mapper and the inputs settings (<prefix>.json). The model classes, the factories and the training code
+    are not imported, exported models run on CPU
+    """
+
+    def __init__(self, export_prefix: str):
+        with open(f"{export_prefix}.json", "r", encoding="utf8") as f:
+            self.metadata = json.load(f)
+
+        self.model_type: str = self.metadata["model_type"]
+        self.mapper: BaseMapper = create_object(self.metadata["mapper"])
+        self.mapper.deserialize(decode_mapper_state(self.metadata["mapper"]["state"]))
+
+        self.model = torch.jit.load(f"{export_prefix}.pt", map_location="cpu")
+        self.model.eval()
+
+    def create_dataset(self, file_path: str) -> data.Dataset:
+        dataset_description = self.metadata["dataset"]
+        dataset = create_object(dataset_description, file_path, self.mapper, **dataset_description["kwargs"])
+
+        if self.metadata["raw_text"]:
+            dataset.set_raw_text_tokenizer(RawTextTokenizer())
+
+        # sequence models are run on the longest sentence of the file
+        if self.metadata["sequence_predictions"]:
+            dataset.sequence_length = dataset.get_dataset_max_sequence_length()
+
+        return dataset
+
+    def predict(self, file_path: str, batch_size: int = 200) -> List[str]:
+        # returns the predicted label of every token (tagging models) or of every sample
+        loader = data.DataLoader(self.create_dataset(file_path), batch_size=batch_size)
+        predictions = []
+
+        with torch.no_grad():
+            for sample in loader:
+                *x, _ = sample
+                outputs = self.model(*x)
+                _, batch_predictions = torch.max(outputs, dim=1)
+
+                if self.metadata["sequence_predictions"]:
+                    real_tokens_mask = get_real_tokens_mask(x[0], self.model_type, self.metadata["padding_index"])
+                    batch_predictions = batch_predictions.flatten()[real_tokens_mask]
+
+                predictions.extend(self.mapper.get_label_from_idx(prediction) for prediction in batch_predictions.tolist())
+
+        return predictions
+
+
+if __name__ == '__main__':
+    # usage: exported_model.py <export prefix> <test file> - prints a predicted label per line
+    exported_model = ExportedModel(sys.argv[1])
+    for label in exported_model.predict(sys.argv[2]):
+        print(label)
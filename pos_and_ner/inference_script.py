@@ -1,11 +1,17 @@
+import os
+import copy
+
 import torch
 from torch.utils import data
 
 from factory_classes import ModelsFactory, MappersFactory, ConfigsFactory, PredictorsFactory, DatasetsFactory
-from pos_and_ner.models import BaseModel
-from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding
+from pos_and_ner.models import BaseModel, get_autocast_context, store_embeddings_in_bf16
+from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding, END
 from pos_and_ner.configs import BaseConfig, ModelConfig
-from pos_and_ner.datasets import BiLSTMDataset
+from pos_and_ner.datasets import BiLSTMDataset, get_real_tokens_mask
+from pos_and_ner.tokenizers import RawTextTokenizer
+from pos_and_ner.quantization import quantize_model, get_model_size, evaluate_model
+from pos_and_ner.compressed_embeddings import replace_with_compressed_embeddings
 
 
 def load_trained_model(path_to_pth_file: str, model_type: str):
@@ -37,7 +43,18 @@ def load_trained_model(path_to_pth_file: str, model_type: str):
 
     # create a model
     trained_model: BaseModel = models_factory(model_name, model_config, trained_mapper, model_type)
-    trained_model.load_state_dict(model_state)
+
+    # checkpoints of pos_and_ner.compress have compressed embedding tables (codebooks or low rank factors)
+    if "compressed_embeddings" in model_data:
+        replace_with_compressed_embeddings(trained_model, model_data["compressed_embeddings"])
+
+    # frozen parameters saved to side files next to the checkpoint are memory mapped instead of loaded
+    frozen_parameters = model_data["frozen_parameters"] if "frozen_parameters" in model_data else {}
+    trained_model.load_frozen_parameters(os.path.dirname(path_to_pth_file), frozen_parameters)
+    missing_keys, unexpected_keys = trained_model.load_state_dict(model_state, strict=False)
+    if set(missing_keys) != set(frozen_parameters) or len(unexpected_keys) > 0:
+        raise RuntimeError(f"Checkpoint {path_to_pth_file} doesn't match the {model_name} model parameters, "
+                           f"missing: {missing_keys}, unexpected: {unexpected_keys}")
 
     return trained_model, model_name
 
@@ -59,6 +76,20 @@ def save_predictions_to_file(test_path: str, predictions: list, save_model_path:
                     index += 1  # don't forge to move to next prediction
 
 
+def save_raw_text_predictions_to_file(test_path: str, predictions: list, save_model_path: str, tokenizer: RawTextTokenizer):
+    index = 0
+    with open(save_model_path, "w", encoding="utf8") as out_file:
+        # tokenize the raw document again to restore the character offsets of every predicted token
+        for sentence in tokenizer.iter_sentences(test_path):
+            for word, start, end in sentence:
+                label = predictions[index]
+                prediction_line = f"{start}\t{end}\t{word}\t{label}\n"
+                out_file.write(prediction_line)
+                index += 1
+
+            out_file.write("\n")  # end of sentence in prediction file
+
+
 def inference(test_path: str, inference_config_path: str, saved_model_path: str, save_predictions_path: str, model_type: str) -> None:
     # initiate factory object
     config_factory = ConfigsFactory()
@@ -75,21 +106,58 @@ def inference(test_path: str, inference_config_path: str, saved_model_path: str,
     # check if model is a model with sub word units
 
     # create dataset object and preform inference
-    test_dataset = dataset_factory(BaseConfig(), test_path, mapper, model_type)
+    test_dataset = dataset_factory(inference_config, test_path, mapper, model_type)
     test_config_dict = {"batch_size": inference_config["batch_size"], "num_workers": inference_config["num_workers"]}
     test_loader = data.DataLoader(test_dataset, **test_config_dict)
 
-    device = torch.device(inference_config["device"])
+    # window models can tag whole sentences at once instead of per token windows
+    sentence_level = "window" in model_type and "sentence_level" in inference_config and inference_config["sentence_level"]
+    if sentence_level:
+        model.sentence_level = True
+
+    # int8 dynamic quantization of the LSTM and linear layers, quantized models run on CPU only
+    quantized = "quantization" in inference_config and inference_config["quantization"] == "int8"
+    device = torch.device("cpu") if quantized else torch.device(inference_config["device"])
     model = model.to(device)
     model.eval()
+    if quantized:
+        model = quantize_model(model)
+
+    # window models can replace the hidden layer matmul with gathers from precomputed position tables
+    # (not for a quantized model, its hidden layer doesn't have float weights to build the tables from)
+    precomputed_tables = "precomputed_tables" in inference_config and inference_config["precomputed_tables"]
+    if "window" in model_type and precomputed_tables and not quantized:
+        model.precompute_position_tables()
+
+    # "bf16" precision runs the model under bfloat16 autocast (not for a quantized model), the embedding tables
+    # can be stored in bfloat16 as well
+    precision = inference_config["precision"] if "precision" in inference_config and not quantized else "fp32"
+    if "bf16_embeddings" in inference_config and inference_config["bf16_embeddings"]:
+        store_embeddings_in_bf16(model)
+
+    # char based models can cache the char encoder vectors of the vocabulary words and of recently seen words
+    is_chars_model = "char_embeddings" in model_type or "char_word_embeddings" in model_type
+    if is_chars_model and "chars_vectors_cache" in inference_config and inference_config["chars_vectors_cache"]:
+        max_oov_words = inference_config["chars_vectors_cache_size"] if "chars_vectors_cache_size" in inference_config else 10000
+        model.build_chars_vectors_cache(test_dataset.chars_length, max_oov_words)
+
     predictions = []
 
-    # if it an LSTM model we must make sure that the sequence length is the maximum sequence length in the data
-    # and to use mask tensor to make sure we only predict for real tokens
-    if "lstm" in model_type:
+    # if it an LSTM model (or a sentence level window model) we must make sure that the sequence length is the
+    # maximum sequence length in the data and to use mask tensor to make sure we only predict for real tokens
+    if "lstm" in model_type or sentence_level:
         test_dataset: BiLSTMDataset
         mapper: BaseMapperWithPadding
-        padding_index = mapper.get_padding_index()
+
+        # sentences of the window models are padded with END tokens
+        padding_index = mapper.get_token_idx(END) if sentence_level else mapper.get_padding_index()
+
+        # long sentences can be split to overlapping chunks of "sequence_length" tokens instead, so the batches
+        # length doesn't depend on the longest sentence of the file
+        chunked = "chunk_overlap" in inference_config
+        if chunked:
+            test_dataset.set_chunking(test_dataset.sequence_length, inference_config["chunk_overlap"])
+
         max_sequence_length = test_dataset.get_dataset_max_sequence_length()
         test_dataset.sequence_length = max_sequence_length
 
@@ -99,36 +167,23 @@ def inference(test_path: str, inference_config_path: str, saved_model_path: str,
             for batch_idx, sample in enumerate(test_loader):
                 x, _ = sample
                 x = x.to(device)
-                outputs = model(x)
-
-                real_tokens_mask: torch.tensor
-
-                # special case for character embeddings
-                if "char_embeddings" in model_type:
-                    batch_size, num_words, chars_in_word = x.size()
-
-                    # fold num words dimension into batch dimension
-                    all_batch_words = x.view(batch_size * num_words, chars_in_word)
-
-                    # a valid word is a word that has at least 1 char that is not the char padding
-                    real_tokens_mask = ~torch.all(all_batch_words == padding_index, dim=1)
+                with get_autocast_context(precision, device):
+                    outputs = model(x)
 
-                elif "char_word_embeddings" in model_type:
-                    words_x = x[:, :, -1]
-                    real_tokens_mask = (words_x != padding_index).flatten()
-                else:
-                    if len(x.size()) == 3:
-                        real_tokens_mask = (x[:, 0, :] != padding_index).flatten()
-                    else:
-                        real_tokens_mask = (x != padding_index).flatten()
+                real_tokens_mask = get_real_tokens_mask(x, model_type, padding_index)
 
-                batch_predictions: torch.tensor = predictor.infer_model_outputs(outputs)
+                # the mask keeps the padding out of sequence decoding (Viterbi)
+                batch_predictions: torch.tensor = predictor.infer_model_outputs(outputs, real_tokens_mask.view(x.size(0), -1))
                 batch_predictions = batch_predictions.flatten()
 
                 for i in range(len(batch_predictions)):
                     if real_tokens_mask[i]:
                         predicted_label = mapper.get_label_from_idx(batch_predictions[i].item())
                         predictions.append(predicted_label)
+
+        # every token gets the prediction of the chunk it is in the center of
+        if chunked:
+            predictions = test_dataset.stitch_chunks_predictions(predictions)
     else:
         # run the model in batches to create the predictions
         with torch.no_grad():
@@ -136,12 +191,47 @@ def inference(test_path: str, inference_config_path: str, saved_model_path: str,
             for batch_idx, sample in enumerate(test_loader):
                 x, _ = sample
                 x = x.to(device)
-                outputs = model(x)
+                with get_autocast_context(precision, device):
+                    outputs = model(x)
                 batch_predictions = predictor.infer_model_outputs(outputs)
 
                 for prediction in batch_predictions:
-                    predicted_label = mapper.get_label_from_idx(prediction)
+                    predicted_label = mapper.get_label_from_idx(prediction.item())
                     predictions.append(predicted_label)
 
-    save_predictions_to_file(test_path, predictions, save_predictions_path)
+    if test_dataset.tokenizer is not None:
+        save_raw_text_predictions_to_file(test_path, predictions, save_predictions_path, test_dataset.tokenizer)
+    else:
+        save_predictions_to_file(test_path, predictions, save_predictions_path)
+
+
+
+def precision_report(dev_path: str, inference_config_path: str, saved_model_path: str, model_type: str) -> None:
+    # compare accuracy, throughput and size of the fp32 model, its int8 quantized version and its bf16 version on a labeled dev file
+    config_factory = ConfigsFactory()
+    predictors_factory = PredictorsFactory()
+    dataset_factory = DatasetsFactory()
+
+    inference_config = config_factory("inference").from_json_file(inference_config_path)
+    model, _ = load_trained_model(saved_model_path, model_type)
+    model: BaseModel
+    predictor = predictors_factory(inference_config, model.mapper, model_type)
+
+    dev_dataset = dataset_factory(inference_config, dev_path, model.mapper, model_type)
+    dev_config_dict = {"batch_size": inference_config["batch_size"], "num_workers": inference_config["num_workers"]}
+    dev_loader = data.DataLoader(dev_dataset, **dev_config_dict)
+
+    # quantized models run on CPU only, so all the models are measured on CPU
+    model = model.to(torch.device("cpu"))
+    model.eval()
+    quantized_model = quantize_model(model)
+
+    # bf16 - bfloat16 autocast with the embedding tables stored in bfloat16
+    bf16_model = copy.deepcopy(model)
+    store_embeddings_in_bf16(bf16_model)
 
+    print(f"{'model':<8}{'accuracy':>10}{'tokens/sec':>14}{'size (MB)':>12}")
+    for name, evaluated_model in [("fp32", model), ("int8", quantized_model), ("bf16", bf16_model)]:
+        accuracy, tokens_per_second = evaluate_model(evaluated_model, predictor, dev_loader, precision=name)
+        model_size = get_model_size(evaluated_model) / 2 ** 20
+        print(f"{name:<8}{accuracy:>10.4f}{tokens_per_second:>14.0f}{model_size:>12.2f}")
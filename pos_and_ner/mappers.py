@@ -1,4 +1,5 @@
 import re
+from typing import Dict, List
 from collections import OrderedDict
 
 UNK = "UNK"
@@ -7,6 +8,21 @@ CHAR_PAD = "|"
 WORD_PAD = "PADDDDDDDD"
 BEGIN = "<s>"
 END = "</s>"
+IGNORED_LABEL_INDEX = -100  # label index skipped by the loss and the accuracy computation (default ignore_index of CrossEntropyLoss)
+
+
+def encode_mapper_state(mapper_state: dict) -> dict:
+    # json objects have only string keys, so the mapper dictionaries (some have int keys) are saved as lists of pairs
+    return {
+        "dicts": {name: list(value.items()) for name, value in mapper_state.items() if isinstance(value, dict)},
+        "values": {name: value for name, value in mapper_state.items() if not isinstance(value, dict)}
+    }
+
+
+def decode_mapper_state(encoded_state: dict) -> dict:
+    mapper_state = {name: {key: value for key, value in pairs} for name, pairs in encoded_state["dicts"].items()}
+    mapper_state.update(encoded_state["values"])
+    return mapper_state
 
 
 class BaseMapper(object):
@@ -62,6 +78,11 @@ class BaseMapper(object):
     def get_label_from_idx(self, index: int) -> str:
         return self.idx_to_label[index]
 
+    def set_labels(self, labels: List[str]) -> None:
+        # replaces the labels of the mapping, e.g. by the labels of a teacher model
+        self.label_to_idx = {label: index for index, label in enumerate(labels)}
+        self.idx_to_label = {index: label for index, label in enumerate(labels)}
+
 
 class BaseMapperWithPadding(BaseMapper):
 
@@ -110,10 +131,12 @@ class TokenMapper(BaseMapper):
                 else:
                     line_tokens = line[:-1].split(self.split_char)  # remove end of line
                     word = line_tokens[0]
-                    label = line_tokens[1]
-
                     words_frequencies[word] = words_frequencies.get(word, 0) + 1
-                    labels[label] = 0
+
+                    # an unlabeled corpus (e.g. for distillation) gives the words only
+                    if len(line_tokens) > 1:
+                        label = line_tokens[1]
+                        labels[label] = 0
 
         # remove word below min_frequency
         words = self._remove_non_frequent(words_frequencies)
@@ -440,6 +463,80 @@ class TokenMapperUnkCategoryWithPadding(TokenMapperUnkCategory, BaseMapperWithPa
         return WORD_PAD
 
 
+class MultiTaskTokenMapperWithPadding(TokenMapperUnkCategoryWithPadding):
+    """
+    Mapper of a multi task tagger - one words mapping for the corpora of all the tasks and a labels mapping for
+    every task. The mapper of a single task (get_task_mapper) has the shared words mapping and the labels of the task
+    """
+    def __init__(self, min_frequency: int = 0, split_char="\t", tasks: List[str] = ("pos", "ner")):
+        super().__init__(min_frequency, split_char=split_char)
+        self.tasks = list(tasks)
+        self.tasks_label_to_idx = {}
+        self.tasks_idx_to_label = {}
+
+    def serialize(self) -> dict:
+        params_dict = super().serialize()
+        params_dict["tasks"] = self.tasks
+        params_dict["tasks_label_to_idx"] = self.tasks_label_to_idx
+        params_dict["tasks_idx_to_label"] = self.tasks_idx_to_label
+
+        return params_dict
+
+    def deserialize(self, serialized_mapper: dict) -> None:
+        super().deserialize(serialized_mapper)
+        self.tasks = serialized_mapper["tasks"]
+        self.tasks_label_to_idx = serialized_mapper["tasks_label_to_idx"]
+        self.tasks_idx_to_label = serialized_mapper["tasks_idx_to_label"]
+
+    def create_tasks_mapping(self, tasks_filepaths: Dict[str, str]) -> None:
+        words_frequencies = OrderedDict()
+
+        for task in self.tasks:
+            # padding label first, as in the single task mappers
+            labels = OrderedDict([(WORD_PAD, 0)])
+
+            with open(tasks_filepaths[task], "r", encoding="utf8") as f:
+                for line in f:
+
+                    # skip empty line (end of sentence)
+                    if line == "\n":
+                        continue
+
+                    # the words frequencies are counted over the corpora of all the tasks
+                    line_tokens = line[:-1].split(self.split_char)  # remove end of line
+                    word = line_tokens[0]
+                    label = line_tokens[1]
+                    words_frequencies[word] = words_frequencies.get(word, 0) + 1
+                    labels[label] = 0
+
+            self.tasks_label_to_idx[task] = {label: index for index, label in enumerate(labels.keys())}
+            self.tasks_idx_to_label[task] = {index: label for index, label in enumerate(labels.keys())}
+
+        # remove word below min_frequency
+        words = self._remove_non_frequent(words_frequencies)
+
+        # init mappings with padding and unknown indices
+        self._init_mappings()
+
+        # transform token to indices
+        for index, word in enumerate(words.keys(), len(self.token_to_idx)):
+            self.token_to_idx[word] = index
+            self.idx_to_token[index] = word
+
+    def get_task_labels_dim(self, task: str) -> int:
+        return len(self.tasks_label_to_idx[task])
+
+    def get_task_mapper(self, task: str) -> TokenMapperUnkCategoryWithPadding:
+        # a single task mapper that shares the words mapping, used by the datasets and predictors of the task
+        task_mapper = TokenMapperUnkCategoryWithPadding(self.min_frequency, self.split_char)
+        task_mapper.token_to_idx = self.token_to_idx
+        task_mapper.idx_to_token = self.idx_to_token
+        task_mapper.label_to_idx = self.tasks_label_to_idx[task]
+        task_mapper.idx_to_label = self.tasks_idx_to_label[task]
+
+        return task_mapper
+
+
 class TokenMapperWithSubWordsWithPadding(TokenMapperWithSubWords, BaseMapperWithPadding):
 
     def __init__(self, min_frequency: int = 0, split_char="\t"):
@@ -546,6 +643,11 @@ class TokenMapperWithCharsWithPadding(BaseMapperWithPadding, TokenMapper):
         # if word doesn't appear - assign the index of unknown
         return self.token_to_idx[UNK_CHAR]
 
+    def get_word_chars_indices(self, word: str, chars_length: int) -> List[int]:
+        # chars indices of a word pruned or padded to chars_length, as in the chars datasets
+        chars = [c for c in word[:chars_length]] + [CHAR_PAD] * max(chars_length - len(word), 0)
+        return [self.get_token_idx(c) for c in chars]
+
 
 class TokenMapperWithCharsWithWordsWithPadding(TokenMapperUnkCategoryWithPadding):
 
@@ -555,6 +657,20 @@ class TokenMapperWithCharsWithWordsWithPadding(TokenMapperUnkCategoryWithPadding
         self.idx_to_char = {}
         self.char_min_frequency = char_min_frequency
 
+    def serialize(self) -> dict:
+        params_dict = super().serialize()
+        params_dict["char_to_idx"] = self.char_to_idx
+        params_dict["idx_to_char"] = self.idx_to_char
+        params_dict["char_min_frequency"] = self.char_min_frequency
+
+        return params_dict
+
+    def deserialize(self, serialized_mapper: dict) -> None:
+        super().deserialize(serialized_mapper)
+        self.char_to_idx = serialized_mapper["char_to_idx"]
+        self.idx_to_char = serialized_mapper["idx_to_char"]
+        self.char_min_frequency = serialized_mapper["char_min_frequency"]
+
     def create_mapping(self, filepath: str) -> None:
         char_frequencies = OrderedDict()
         words_frequencies = OrderedDict()
@@ -631,6 +747,16 @@ class TokenMapperWithCharsWithWordsWithPadding(TokenMapperUnkCategoryWithPadding
     def get_char_from_idx(self, index: int) -> str:
         return self.idx_to_char[index]
 
+    def get_word_chars_indices(self, word: str, chars_length: int) -> List[int]:
+        # chars indices of a word pruned or padded to chars_length, as in the chars datasets
+        chars = [c for c in word[:chars_length]] + [CHAR_PAD] * max(chars_length - len(word), 0)
+        return [self.get_char_idx(c) for c in chars]
+
+    def get_vocabulary_words(self) -> List[str]:
+        # the words seen in training, without the padding and the unknown categories tokens
+        special_tokens = set(self.unk_categories + [UNK, WORD_PAD])
+        return [word for word in self.token_to_idx.keys() if word not in special_tokens]
+
     def _remove_non_frequent_chars(self, chars_frequencies) -> dict:
         # remove word below min_frequency
         chars = OrderedDict()
@@ -1,8 +1,208 @@
+import os
+import math
+import hashlib
+from contextlib import nullcontext
+from typing import ContextManager, Dict, List, Optional, Tuple
+from collections import OrderedDict
+
 import numpy as np
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from pos_and_ner.configs import ModelConfig, WindowTaggerConfig, RNNConfig, RNNWithCharsEmbeddingsConfig, RNNWithCharsWithWordsEmbeddingsConfig
-from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding, TokenMapperWithSubWords, TokenMapperWithSubWordsWithPadding, TokenMapperWithCharsWithWordsWithPadding, TokenMapperWithCharsWithPadding
+from pos_and_ner.embedding_store import EmbeddingStore
+from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding, TokenMapperWithSubWords, TokenMapperWithSubWordsWithPadding, TokenMapperWithCharsWithWordsWithPadding, TokenMapperWithCharsWithPadding, MultiTaskTokenMapperWithPadding, BEGIN, END
+
+
+def pad_sentences_for_windows(x: torch.tensor, window_size: int, begin_index: int, end_index: int) -> torch.tensor:
+    # add window_size BEGIN tokens before and window_size END tokens after every sentence in the batch
+    batch_size = x.size(0)
+    begin_padding = x.new_full((batch_size, window_size), begin_index)
+    end_padding = x.new_full((batch_size, window_size), end_index)
+
+    return torch.cat([begin_padding, x, end_padding], dim=1)
+
+
+def sentence_windows(embeddings: torch.tensor, window_size: int) -> torch.tensor:
+    # build the windows of all the tokens from embeddings of size (batch, sequence_length + 2 * window_size, features)
+    # unfold results in tensor of size (batch, sequence_length, features, window_size * 2 + 1)
+    windows = embeddings.unfold(1, 2 * window_size + 1, 1)
+
+    # concatenate the embeddings of every window in the same order as the per token window samples
+    return torch.flatten(windows.transpose(2, 3), start_dim=2)
+
+
+def get_sequence_lengths(real_tokens_mask: torch.tensor) -> torch.tensor:
+    # sequences are padded at the end, the length is the position of the last real token
+    # sequences without real tokens get length 1 since a packed sequence can't be empty
+    _, sequence_length = real_tokens_mask.size()
+    positions = torch.arange(1, sequence_length + 1, device=real_tokens_mask.device)
+
+    return torch.clamp(torch.max(real_tokens_mask.long() * positions, dim=1)[0], min=1)
+
+
+def run_lstm(lstm: nn.LSTM, inputs: torch.tensor, lengths: Optional[torch.tensor] = None) -> torch.tensor:
+    # runs a batch first LSTM over the inputs, only on the first "length" steps of every sequence if lengths are given
+    if lengths is None:
+        outputs, _ = lstm(inputs)
+        return outputs
+
+    packed_inputs = pack_padded_sequence(inputs, lengths.cpu(), batch_first=True, enforce_sorted=False)
+    packed_outputs, _ = lstm(packed_inputs)
+
+    # the padding positions get zero features, so the output keeps the dimensions of the inputs
+    outputs, _ = pad_packed_sequence(packed_outputs, batch_first=True, total_length=inputs.size(1))
+    return outputs
+
+
+def get_sentence_encoder_name(config: ModelConfig) -> str:
+    # "lstm" (default), "dilated_cnn" or "transformer"
+    return config["encoder"] if "encoder" in config else "lstm"
+
+
+def uses_sequence_lengths(config: ModelConfig) -> bool:
+    # the LSTM runs only on the real tokens with pack_sequences, the convolution and transformer encoders always
+    # need the lengths of the sentences to mask the padding
+    return ("pack_sequences" in config and config["pack_sequences"]) or get_sentence_encoder_name(config) != "lstm"
+
+
+def get_padding_mask(lengths: torch.tensor, sequence_length: int) -> torch.tensor:
+    # True for the padding positions (after the length of every sequence)
+    positions = torch.arange(sequence_length, device=lengths.device)
+    return positions.unsqueeze(0) >= lengths.to(positions.device).unsqueeze(1)
+
+
+class DilatedConvolutionEncoder(nn.Module):
+    """
+    Sentence encoder of residual blocks of 1D convolutions with dilations 1, 2, 4, ... so the context of every token
+    grows exponentially with the number of blocks, and all the positions are computed in parallel.
+    The padding positions are zeroed before every block, so the features of the real tokens don't depend on the padding
+    """
+
+    def __init__(self, input_size: int, output_size: int, num_blocks: int = 4, kernel_size: int = 3, dropout: float = 0.2):
+        super().__init__()
+        self.input_projection = nn.Linear(input_size, output_size)
+        self.convolutions = nn.ModuleList([
+            nn.Conv1d(output_size, output_size, kernel_size, dilation=2 ** block, padding=(kernel_size // 2) * 2 ** block)
+            for block in range(num_blocks)
+        ])
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, inputs: torch.tensor, lengths: torch.tensor) -> torch.tensor:
+        # inputs have dimensions batch, sequence, features
+        real_tokens = ~get_padding_mask(lengths, inputs.size(1)).unsqueeze(2)
+        features = self.input_projection(inputs) * real_tokens
+
+        for convolution in self.convolutions:
+            # convolutions expect dimensions batch, features, sequence
+            block_features = torch.relu(convolution(features.permute(0, 2, 1))).permute(0, 2, 1)
+            features = (features + self.dropout(block_features)) * real_tokens
+
+        return features
+
+
+class TransformerSentenceEncoder(nn.Module):
+    """
+    Sentence encoder of transformer encoder layers over the inputs with sinusoidal position encodings,
+    the attention doesn't attend to the padding positions
+    """
+
+    def __init__(self, input_size: int, output_size: int, num_layers: int = 2, num_heads: int = 4, dropout: float = 0.1):
+        super().__init__()
+        self.output_size = output_size
+        self.input_projection = nn.Linear(input_size, output_size)
+        encoder_layer = nn.TransformerEncoderLayer(d_model=output_size, nhead=num_heads, dim_feedforward=output_size * 2,
+                                                   dropout=dropout, batch_first=True)
+        self.encoder = nn.TransformerEncoder(encoder_layer, num_layers, enable_nested_tensor=False)
+
+    def get_position_encodings(self, sequence_length: int, device: torch.device) -> torch.tensor:
+        positions = torch.arange(sequence_length, device=device).unsqueeze(1)
+        frequencies = torch.exp(torch.arange(0, self.output_size, 2, device=device) * (-math.log(10000.0) / self.output_size))
+        encodings = torch.zeros(sequence_length, self.output_size, device=device)
+        encodings[:, 0::2] = torch.sin(positions * frequencies)
+        encodings[:, 1::2] = torch.cos(positions * frequencies)
+        return encodings
+
+    def forward(self, inputs: torch.tensor, lengths: torch.tensor) -> torch.tensor:
+        # inputs have dimensions batch, sequence, features
+        sequence_length = inputs.size(1)
+        padding_mask = get_padding_mask(lengths, sequence_length)
+        features = self.input_projection(inputs) + self.get_position_encodings(sequence_length, inputs.device)
+        features = self.encoder(features, src_key_padding_mask=padding_mask)
+
+        # the padding positions get zero features, as with packed sequences
+        return features * ~padding_mask.unsqueeze(2)
+
+
+def create_sentence_encoder(config: ModelConfig, input_size: int, hidden_dim: int) -> nn.Module:
+    # all the encoders return hidden_dim * 2 features for every token, as the bi-directional LSTM
+    encoder_name = get_sentence_encoder_name(config)
+    num_layers = config["encoder_layers"] if "encoder_layers" in config else None
+
+    if encoder_name == "dilated_cnn":
+        kernel_size = config["encoder_kernel_size"] if "encoder_kernel_size" in config else 3
+        if kernel_size % 2 == 0:
+            raise ValueError(f"The dilated convolution encoder needs an odd encoder_kernel_size to keep the sentence length, got {kernel_size}")
+        return DilatedConvolutionEncoder(input_size, hidden_dim * 2, num_layers or 4, kernel_size)
+
+    if encoder_name == "transformer":
+        num_heads = config["encoder_heads"] if "encoder_heads" in config else 4
+        if (hidden_dim * 2) % num_heads != 0:
+            raise ValueError(f"The transformer encoder features (2 * hidden_dim = {hidden_dim * 2}) should be divisible by encoder_heads ({num_heads})")
+        return TransformerSentenceEncoder(input_size, hidden_dim * 2, num_layers or 2, num_heads)
+
+    if encoder_name != "lstm":
+        raise ValueError(f"Unknown sentence encoder {encoder_name}, should be 'lstm', 'dilated_cnn' or 'transformer'")
+
+    return nn.LSTM(input_size=input_size, hidden_size=hidden_dim,
+                   num_layers=2, bidirectional=True, dropout=0.5, batch_first=True)
+
+
+def run_sentence_encoder(encoder: nn.Module, inputs: torch.tensor, lengths: Optional[torch.tensor] = None) -> torch.tensor:
+    # any other encoder is an LSTM, possibly replaced by its int8 version (not an nn.LSTM subclass) by quantize_model
+    if isinstance(encoder, (DilatedConvolutionEncoder, TransformerSentenceEncoder)):
+        return encoder(inputs, lengths)
+
+    return run_lstm(encoder, inputs, lengths)
+
+
+def get_autocast_context(precision: str, device: torch.device) -> ContextManager:
+    # with "bf16" precision the matmuls (linear, LSTM, attention) run in bfloat16 while the parameters stay float32
+    # (master weights), bfloat16 has the exponent range of float32 so the loss doesn't need scaling
+    # other precisions don't enter autocast at all, so fp32 runs don't depend on it
+    if precision != "bf16":
+        return nullcontext()
+
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+
+
+def _embedding_output_to_float(module: nn.Module, inputs: tuple, output: torch.tensor) -> torch.tensor:
+    return output.float()
+
+
+def store_embeddings_in_bf16(module: nn.Module) -> None:
+    # halves the memory of the embedding tables, the looked up rows are returned as float32
+    # should be used only for tables that are not trained (the optimizer would update bfloat16 weights)
+    for embedding in module.modules():
+        if isinstance(embedding, nn.Embedding) and embedding.weight.dtype != torch.bfloat16:
+            embedding.weight.data = embedding.weight.data.to(torch.bfloat16)
+            embedding.register_forward_hook(_embedding_output_to_float)
+
+
+def tensor_to_array(tensor: torch.tensor) -> np.ndarray:
+    # numpy has no bfloat16, bfloat16 tensors are saved as their int16 bits
+    tensor = tensor.detach().cpu().contiguous()
+    if tensor.dtype == torch.bfloat16:
+        tensor = tensor.view(torch.int16)
+
+    return tensor.numpy()
+
+
+def array_to_tensor(array: np.ndarray, dtype: str) -> torch.tensor:
+    tensor = torch.from_numpy(array)
+    return tensor.view(torch.bfloat16) if dtype == str(torch.bfloat16) else tensor
 
 
 class BaseModel(nn.Module):
@@ -12,7 +212,10 @@ class BaseModel(nn.Module):
         self.config = config
         self.mapper = mapper
 
-    def serialize_model(self) -> dict:
+        # digest of every frozen parameter, kept with the parameter version so unchanged parameters are not hashed again
+        self.frozen_parameters_digests: Dict[str, tuple] = {}
+
+    def serialize_model(self, frozen_parameters_dir: Optional[str] = None) -> dict:
         model_name = self.__class__.__name__
         config_class_name = self.config.__class__.__name__
         mapper_class_name = self.mapper.__class__.__name__
@@ -21,16 +224,109 @@ class BaseModel(nn.Module):
         model_state = self.state_dict()
         mapper_state = self.mapper.serialize()
 
+        # frozen parameters (e.g. pre-trained glove) can be saved once to side files, the checkpoint only references them
+        frozen_parameters = {}
+        if frozen_parameters_dir is not None:
+            frozen_parameters = self.save_frozen_parameters(frozen_parameters_dir)
+            model_state = OrderedDict((name, value) for name, value in model_state.items() if name not in frozen_parameters)
+
         model_state = {
-            "model": {"name": model_name, "state": model_state},
+            "model": {"name": model_name, "state": model_state, "frozen_parameters": frozen_parameters},
             "config": {"name": config_class_name, "state": config_params},
             "mapper": {"name": mapper_class_name, "state": mapper_state},
         }
 
         return model_state
 
+    def get_frozen_parameter_digest(self, name: str, parameter: nn.Parameter) -> str:
+        # the version of a tensor changes on every in place update, so the digest is computed again only if needed
+        version = (parameter._version, parameter.data_ptr())
+        if name in self.frozen_parameters_digests and self.frozen_parameters_digests[name][0] == version:
+            return self.frozen_parameters_digests[name][1]
+
+        digest = hashlib.sha256(tensor_to_array(parameter).tobytes()).hexdigest()
+        self.frozen_parameters_digests[name] = (version, digest)
+        return digest
+
+    def save_frozen_parameters(self, directory: str) -> Dict[str, dict]:
+        # every frozen parameter is saved to a .npy file named by the digest of its content, a file that already
+        # exists (saved by a previous checkpoint) is not written again. returns the reference of every parameter
+        references = {}
+        for name, parameter in self.named_parameters():
+            if parameter.requires_grad:
+                continue
+
+            file_name = f"{self.get_frozen_parameter_digest(name, parameter)}.npy"
+            file_path = os.path.join(directory, file_name)
+            if not os.path.exists(file_path):
+                # write to a temporary file first, so an interrupted save doesn't leave a partial file with a valid name
+                temporary_path = f"{file_path}.tmp"
+                with open(temporary_path, "wb") as f:
+                    np.save(f, tensor_to_array(parameter))
+                os.replace(temporary_path, file_path)
+
+            references[name] = {"file": file_name, "dtype": str(parameter.dtype)}
+
+        return references
+
+    def load_frozen_parameters(self, directory: str, references: Dict[str, dict]) -> None:
+        # the side files are memory mapped (copy on write), the parameters data is read from disk only when used
+        parameters = dict(self.named_parameters())
+        modules = dict(self.named_modules())
+        for name, reference in references.items():
+            array = np.load(os.path.join(directory, reference["file"]), mmap_mode="c")
+            tensor = array_to_tensor(array, reference["dtype"])
+
+            # an embedding table saved in bfloat16 returns its looked up rows as float32 (see store_embeddings_in_bf16)
+            module = modules[name.rpartition(".")[0]]
+            if isinstance(module, nn.Embedding) and tensor.dtype == torch.bfloat16 and module.weight.dtype != torch.bfloat16:
+                module.register_forward_hook(_embedding_output_to_float)
+
+            parameters[name].data = tensor
 
-class WindowTagger(BaseModel):
+
+class WindowPositionTablesMixin(object):
+    """
+    Inference mode for the window models. The hidden layer pre-activation of a window is a sum over
+    the window positions of E[token] @ W_position, so the E @ W_position tables can be computed once
+    and every window costs only row gathers and a sum
+    """
+    position_tables: Optional[List[torch.tensor]] = None
+
+    def _window_embedding_layers(self) -> List[nn.Embedding]:
+        raise NotImplementedError("A window model using position tables must define its window embedding layers")
+
+    def precompute_position_tables(self) -> None:
+        # should be called after the model was moved to its device, the tables are not part of the model state
+        window_length = 2 * self.window_size + 1
+        with torch.no_grad():
+            # hidden weight has dimensions hidden_dim, window_length * embedding_dim
+            position_weights = self.hidden.weight.view(self.hidden.out_features, window_length, -1)
+
+            # one table of size window_length, vocabulary, hidden_dim for each embedding layer
+            self.position_tables = [torch.einsum("ve,hpe->pvh", layer.weight, position_weights)
+                                    for layer in self._window_embedding_layers()]
+
+    def train(self, mode: bool = True):
+        # the tables are valid only as long as the weights are not updated
+        if mode:
+            self.position_tables = None
+
+        return super().train(mode)
+
+    def _hidden_from_position_tables(self, windows: List[torch.tensor]) -> torch.tensor:
+        # every windows tensor is of size (..., window_length) with the indices of one embedding layer
+        window_length = 2 * self.window_size + 1
+        positions = torch.arange(window_length, device=windows[0].device)
+        pre_activation = self.hidden.bias
+
+        for tables, window in zip(self.position_tables, windows):
+            pre_activation = pre_activation + torch.sum(tables[positions, window], dim=-2)
+
+        return torch.tanh(pre_activation)
+
+
+class WindowTagger(WindowPositionTablesMixin, BaseModel):
 
     def __init__(self, config: WindowTaggerConfig, mapper: BaseMapper):
         super().__init__(config, mapper)
@@ -40,13 +336,29 @@ class WindowTagger(BaseModel):
         labels_dim = mapper.get_labels_dim()
         hidden_dim = config["hidden_dim"]
 
+        # sentence level inputs are whole sentences padded with END tokens instead of per token windows
+        self.window_size = window_size
+        self.sentence_level = False
+        self.begin_index = mapper.get_token_idx(BEGIN)
+        self.end_index = mapper.get_token_idx(END)
+
         # layers
         input_dim = (2 * window_size + 1) * embedding_dim
         self.embedding = nn.Embedding(tokens_dim, embedding_dim)
         self.hidden = nn.Linear(in_features=input_dim, out_features=hidden_dim)
         self.output = nn.Linear(in_features=hidden_dim, out_features=labels_dim)
 
+    def _window_embedding_layers(self) -> List[nn.Embedding]:
+        return [self.embedding]
+
     def forward(self, x: torch.tensor) -> torch.tensor:
+        if self.sentence_level:
+            return self.forward_sentences(x)
+
+        if self.position_tables is not None:
+            y_hat = self.output(self._hidden_from_position_tables([x]))
+            return y_hat
+
         window_embeddings = self.embedding(x)  # results in tensor of size (batch, window_size * 2 + 1, embedding_dim)
         embedding = torch.flatten(window_embeddings, start_dim=1)  # concatenate the embeddings of the window words and current word
         hidden = torch.tanh(self.hidden(embedding))
@@ -54,6 +366,24 @@ class WindowTagger(BaseModel):
 
         return y_hat
 
+    def forward_sentences(self, x: torch.tensor) -> torch.tensor:
+        # every token of the sentences is embedded once and the windows are built from the sentence embeddings
+        x = pad_sentences_for_windows(x, self.window_size, self.begin_index, self.end_index)
+
+        if self.position_tables is not None:
+            # windows of token indices of size (batch, sequence_length, window_size * 2 + 1)
+            hidden = self._hidden_from_position_tables([x.unfold(1, 2 * self.window_size + 1, 1)])
+        else:
+            sentence_embeddings = self.embedding(x)  # results in tensor of size (batch, sequence_length + window_size * 2, embedding_dim)
+            embedding = sentence_windows(sentence_embeddings, self.window_size)
+            hidden = torch.tanh(self.hidden(embedding))
+
+        y_hat = self.output(hidden)
+
+        # Cross Entropy loss expects dimensions of type batch, features, sequence
+        y_hat = y_hat.permute(0, 2, 1)
+        return y_hat
+
 
 class ModelWithPreTrainedEmbeddings(BaseModel):
 
@@ -65,34 +395,23 @@ class ModelWithPreTrainedEmbeddings(BaseModel):
         self.num_pre_trained_used = 0
 
     def load_pre_trained_embeddings(self, pre_trained_vocab_path: str, pre_trained_embedding_path: str):
-        pre_trained_matrix: np.ndarray = np.loadtxt(pre_trained_embedding_path)
-        embedding_matrix = self.embedding.weight.detach().numpy()
-        pre_trained_vocab = self._load_pre_trained_vocab(pre_trained_vocab_path)
-        mapper_vocab = self.mapper.token_to_idx
-
-        for word, index in mapper_vocab.items():
-            lower_word = word.lower()  # assign the pre-trained vector in a case-insensitive matter
-
-            if lower_word in pre_trained_vocab:
-                word_pre_trained_vector = pre_trained_matrix[pre_trained_vocab[lower_word]]
-                # assign the pre-trained vector for the word
-                embedding_matrix[index] = word_pre_trained_vector
-                self.num_pre_trained_used += 1
+        # the text files are converted once to a binary store that is memory mapped on the next loads
+        pre_trained_store = EmbeddingStore.from_text_files(pre_trained_vocab_path, pre_trained_embedding_path)
+        mapper_words, mapper_indices = zip(*self.mapper.token_to_idx.items())
 
-        # load the new embedding matrix as the embedding layer parameters
-        self.embedding.load_state_dict({'weight': torch.tensor(embedding_matrix)})
+        # assign the pre-trained vectors in a case-insensitive matter
+        found_positions, pre_trained_rows = pre_trained_store.lookup(word.lower() for word in mapper_words)
+        embedding_indices = torch.tensor(mapper_indices)[torch.from_numpy(found_positions)]
+        pre_trained_vectors = torch.from_numpy(pre_trained_store.get_rows(pre_trained_rows))
 
-    def _load_pre_trained_vocab(self, vocab_path: str) -> dict:
-        pre_trained_vocab = {}
-        with open(vocab_path, "r", encoding="utf8") as f:
-            for index, word in enumerate(f):
-                word = word[:-1]  # remove end of line token
-                pre_trained_vocab[word] = index
+        # assign all the pre-trained vectors to the embedding layer parameters at once
+        with torch.no_grad():
+            self.embedding.weight[embedding_indices] = pre_trained_vectors
 
-        return pre_trained_vocab
+        self.num_pre_trained_used += len(embedding_indices)
 
 
-class WindowModelWithPreTrainedEmbeddings(ModelWithPreTrainedEmbeddings):
+class WindowModelWithPreTrainedEmbeddings(WindowPositionTablesMixin, ModelWithPreTrainedEmbeddings):
     def __init__(self, config: WindowTaggerConfig, mapper: BaseMapper, pre_trained_vocab_path: str,
                  pre_trained_embedding_path: str):
         super().__init__(config, mapper)
@@ -104,12 +423,27 @@ class WindowModelWithPreTrainedEmbeddings(ModelWithPreTrainedEmbeddings):
         labels_dim = mapper.get_labels_dim()
         hidden_dim = config["hidden_dim"]
 
+        self.window_size = window_size
+        self.sentence_level = False
+        self.begin_index = mapper.get_token_idx(BEGIN)
+        self.end_index = mapper.get_token_idx(END)
+
         input_dim = (2 * window_size + 1) * self.embedding_dim
         self.embedding = nn.Embedding(tokens_dim, self.embedding_dim)
         self.hidden = nn.Linear(in_features=input_dim, out_features=hidden_dim)
         self.output = nn.Linear(in_features=hidden_dim, out_features=labels_dim)
 
+    def _window_embedding_layers(self) -> List[nn.Embedding]:
+        return [self.embedding]
+
     def forward(self, x: torch.tensor) -> torch.tensor:
+        if self.sentence_level:
+            return self.forward_sentences(x)
+
+        if self.position_tables is not None:
+            y_hat = self.output(self._hidden_from_position_tables([x]))
+            return y_hat
+
         window_embeddings = self.embedding(x)  # results in tensor of size (batch, window_size * 2 + 1, embedding_dim)
         embedding = torch.flatten(window_embeddings, start_dim=1)  # concatenate the embeddings of the window words and current word
         hidden = torch.tanh(self.hidden(embedding))
@@ -117,8 +451,24 @@ class WindowModelWithPreTrainedEmbeddings(ModelWithPreTrainedEmbeddings):
 
         return y_hat
 
+    def forward_sentences(self, x: torch.tensor) -> torch.tensor:
+        x = pad_sentences_for_windows(x, self.window_size, self.begin_index, self.end_index)
+
+        if self.position_tables is not None:
+            hidden = self._hidden_from_position_tables([x.unfold(1, 2 * self.window_size + 1, 1)])
+        else:
+            sentence_embeddings = self.embedding(x)  # results in tensor of size (batch, sequence_length + window_size * 2, embedding_dim)
+            embedding = sentence_windows(sentence_embeddings, self.window_size)
+            hidden = torch.tanh(self.hidden(embedding))
+
+        y_hat = self.output(hidden)
+
+        # Cross Entropy loss expects dimensions of type batch, features, sequence
+        y_hat = y_hat.permute(0, 2, 1)
+        return y_hat
+
 
-class WindowModelWithSubWords(ModelWithPreTrainedEmbeddings):
+class WindowModelWithSubWords(WindowPositionTablesMixin, ModelWithPreTrainedEmbeddings):
     def __init__(self, config: WindowTaggerConfig, mapper: TokenMapperWithSubWords, pre_trained: bool = False,
                  pre_trained_vocab_path: str = "", pre_trained_embedding_path: str = ""):
         super().__init__(config, mapper)
@@ -133,12 +483,28 @@ class WindowModelWithSubWords(ModelWithPreTrainedEmbeddings):
         suffix_dim = mapper.get_suffix_dim()
         input_dim = (2 * window_size + 1) * self.embedding_dim
 
+        self.window_size = window_size
+        self.sentence_level = False
+        self.begin_indices = [mapper.get_token_idx(BEGIN), mapper.get_prefix_index(BEGIN), mapper.get_suffix_index(BEGIN)]
+        self.end_indices = [mapper.get_token_idx(END), mapper.get_prefix_index(END), mapper.get_suffix_index(END)]
+
         self.prefix_embedding = nn.Embedding(prefix_dim, self.embedding_dim)
         self.suffix_embedding = nn.Embedding(suffix_dim, self.embedding_dim)
         self.hidden = nn.Linear(in_features=input_dim, out_features=hidden_dim)
         self.output = nn.Linear(in_features=hidden_dim, out_features=labels_dim)
 
+    def _window_embedding_layers(self) -> List[nn.Embedding]:
+        # the order matches the order of the tokens in the model input
+        return [self.embedding, self.prefix_embedding, self.suffix_embedding]
+
     def forward(self, x: list) -> torch.tensor:
+        if self.sentence_level:
+            return self.forward_sentences(x)
+
+        if self.position_tables is not None:
+            y_hat = self.output(self._hidden_from_position_tables([x[:, 0, :], x[:, 1, :], x[:, 2, :]]))
+            return y_hat
+
         words_tokens = x[:, 0, :]
         prefix_tokens = x[:, 1, :]
         suffix_tokens = x[:, 2, :]
@@ -153,6 +519,32 @@ class WindowModelWithSubWords(ModelWithPreTrainedEmbeddings):
 
         return y_hat
 
+    def forward_sentences(self, x: torch.tensor) -> torch.tensor:
+        # x dimensions are batch, 3 (words, prefixes, suffixes), sequence_length
+        words_tokens, prefix_tokens, suffix_tokens = [
+            pad_sentences_for_windows(x[:, i, :], self.window_size, self.begin_indices[i], self.end_indices[i])
+            for i in range(3)
+        ]
+
+        if self.position_tables is not None:
+            window_length = 2 * self.window_size + 1
+            windows = [tokens.unfold(1, window_length, 1) for tokens in (words_tokens, prefix_tokens, suffix_tokens)]
+            hidden = self._hidden_from_position_tables(windows)
+        else:
+            word_embeddings = self.embedding(words_tokens)
+            prefix_embeddings = self.prefix_embedding(prefix_tokens)
+            suffix_embeddings = self.suffix_embedding(suffix_tokens)
+
+            embeddings_sum = word_embeddings + prefix_embeddings + suffix_embeddings
+            embedding = sentence_windows(embeddings_sum, self.window_size)
+            hidden = torch.tanh(self.hidden(embedding))
+
+        y_hat = self.output(hidden)
+
+        # Cross Entropy loss expects dimensions of type batch, features, sequence
+        y_hat = y_hat.permute(0, 2, 1)
+        return y_hat
+
 
 class AcceptorLSTM(BaseModel):
     def __init__(self, config: RNNConfig, mapper: BaseMapperWithPadding):
@@ -167,15 +559,31 @@ class AcceptorLSTM(BaseModel):
         self.lstm = nn.LSTM(input_size=self.embedding_dim, hidden_size=self.hidden_dim,
                             batch_first=True, bidirectional=False)
         self.linear = nn.Linear(in_features=self.hidden_dim, out_features=self.labels_dim)
+        self.pack_sequences = "pack_sequences" in config and config["pack_sequences"]
+
+    def forward(self, x: torch.tensor, lengths: Optional[torch.tensor] = None) -> torch.tensor:
+        if lengths is None and self.pack_sequences:
+            lengths = get_sequence_lengths(x != self.padding_idx)
+
+        if lengths is not None:
+            # the batch is trimmed to its longest string, and since the LSTM is uni-directional the output at the
+            # last real token of every string is its true last state (same result as a packed sequence, but
+            # a padded batch runs faster than a packed one on CPU)
+            # a traced model would keep the length of the tracing batch, so a traced model runs on the whole padding
+            if not torch.jit.is_tracing():
+                x = x[:, :int(torch.max(lengths))]
 
-    def forward(self, x: torch.tensor) -> torch.tensor:
         x = self.embedding(x)
         x = self.dropout(x)
-        _, last_hidden = self.lstm(x)
+        rnn_features, last_hidden = self.lstm(x)
 
-        h_n, _ = last_hidden
-        _, batch, features = h_n.size()
-        h_n = h_n.view(batch, features)
+        if lengths is not None:
+            batch_indices = torch.arange(rnn_features.size(0), device=rnn_features.device)
+            h_n = rnn_features[batch_indices, lengths.to(rnn_features.device) - 1]
+        else:
+            h_n, _ = last_hidden
+            _, batch, features = h_n.size()
+            h_n = h_n.view(batch, features)
 
         y_hat = self.linear(h_n)
         return y_hat
@@ -190,13 +598,17 @@ class BasicBiLSTM(BaseModel):
         self.embedding_dim = config["embedding_dim"]
         self.hidden_dim = config["hidden_dim"]
         self.embedding = nn.Embedding(self.tokens_dim, self.embedding_dim, padding_idx=self.padding_idx)
-        self.LSTM = nn.LSTM(input_size=self.embedding_dim, hidden_size=self.hidden_dim,
-                            num_layers=2, bidirectional=True, dropout=0.5, batch_first=True)
+        self.LSTM = create_sentence_encoder(config, self.embedding_dim, self.hidden_dim)
         self.linear = nn.Linear(in_features=self.hidden_dim * 2, out_features=self.labels_dim)
+        self.pack_sequences = uses_sequence_lengths(config)
+
+    def forward(self, x: torch.tensor, lengths: Optional[torch.tensor] = None) -> torch.tensor:
+        # with packed sequences the LSTM runs only on the real tokens of every sentence
+        if lengths is None and self.pack_sequences:
+            lengths = get_sequence_lengths(x != self.padding_idx)
 
-    def forward(self, x: torch.tensor) -> torch.tensor:
         x = self.embedding(x)
-        rnn_features, _ = self.LSTM(x)
+        rnn_features = run_sentence_encoder(self.LSTM, x, lengths)
         # RNN outputs has dimensions batch, sequence_length, features (features is num_directions * hidden dim)
 
         y_hat = self.linear(rnn_features)
@@ -206,6 +618,36 @@ class BasicBiLSTM(BaseModel):
         return y_hat
 
 
+class MultiTaskBiLSTM(BaseModel):
+    """
+    BiLSTM tagger for several tasks (e.g. POS and NER) - the embedding and the BiLSTM encoder are shared and every
+    task has its own output layer, so a single forward pass tags the sentences for all the tasks
+    """
+    def __init__(self, config: RNNConfig, mapper: MultiTaskTokenMapperWithPadding):
+        super().__init__(config, mapper)
+        self.tasks = mapper.tasks
+        self.tokens_dim = mapper.get_tokens_dim()
+        self.padding_idx = mapper.get_padding_index()
+        self.embedding_dim = config["embedding_dim"]
+        self.hidden_dim = config["hidden_dim"]
+        self.embedding = nn.Embedding(self.tokens_dim, self.embedding_dim, padding_idx=self.padding_idx)
+        self.LSTM = create_sentence_encoder(config, self.embedding_dim, self.hidden_dim)
+        self.heads = nn.ModuleList([nn.Linear(in_features=self.hidden_dim * 2, out_features=mapper.get_task_labels_dim(task))
+                                    for task in self.tasks])
+        self.pack_sequences = uses_sequence_lengths(config)
+
+    def forward(self, x: torch.tensor, lengths: Optional[torch.tensor] = None) -> Tuple[torch.tensor, ...]:
+        # with packed sequences the LSTM runs only on the real tokens of every sentence
+        if lengths is None and self.pack_sequences:
+            lengths = get_sequence_lengths(x != self.padding_idx)
+
+        x = self.embedding(x)
+        rnn_features = run_sentence_encoder(self.LSTM, x, lengths)
+
+        # outputs of every task (in the order of the tasks) have dimensions batch, labels, sequence as in BasicBiLSTM
+        return tuple(head(rnn_features).permute(0, 2, 1) for head in self.heads)
+
+
 class BiLSTMWithSubWords(BaseModel):
 
     def __init__(self, config: RNNConfig, mapper: TokenMapperWithSubWordsWithPadding):
@@ -222,16 +664,19 @@ class BiLSTMWithSubWords(BaseModel):
         self.prefix_embedding = nn.Embedding(self.prefix_dim, self.embedding_dim, padding_idx=self.padding_idx)
         self.suffix_embedding = nn.Embedding(self.suffix_dim, self.embedding_dim, padding_idx=self.padding_idx)
 
-        self.LSTM = nn.LSTM(input_size=self.embedding_dim, hidden_size=self.hidden_dim,
-                            num_layers=2, bidirectional=True, dropout=0.5, batch_first=True)
+        self.LSTM = create_sentence_encoder(config, self.embedding_dim, self.hidden_dim)
         self.linear = nn.Linear(in_features=self.hidden_dim * 2, out_features=self.labels_dim)
+        self.pack_sequences = uses_sequence_lengths(config)
 
-    def forward(self, x: torch.tensor) -> torch.tensor:
+    def forward(self, x: torch.tensor, lengths: Optional[torch.tensor] = None) -> torch.tensor:
 
         words_tokens = x[:, 0, :]
         prefix_tokens = x[:, 1, :]
         suffix_tokens = x[:, 2, :]
 
+        if lengths is None and self.pack_sequences:
+            lengths = get_sequence_lengths(words_tokens != self.padding_idx)
+
         word_embeddings = self.word_embedding(words_tokens)
         prefix_embeddings = self.prefix_embedding(prefix_tokens)
         suffix_embeddings = self.suffix_embedding(suffix_tokens)
@@ -239,7 +684,7 @@ class BiLSTMWithSubWords(BaseModel):
         embeddings_sum = word_embeddings + prefix_embeddings + suffix_embeddings
         # embedding = torch.flatten(embeddings_sum, start_dim=1)
 
-        rnn_features, _ = self.LSTM(embeddings_sum)
+        rnn_features = run_sentence_encoder(self.LSTM, embeddings_sum, lengths)
         # RNN outputs has dimensions batch, sequence_length, features (features is num_directions * hidden dim)
 
         y_hat = self.linear(rnn_features)
@@ -249,7 +694,168 @@ class BiLSTMWithSubWords(BaseModel):
         return y_hat
 
 
-class BiLSTMWithChars(BaseModel):
+class CharsVectorsCache(object):
+    """
+    Eval mode cache of the char encoder word vectors, keyed by the chars indices of the word.
+    The vectors of the vocabulary words are computed once, other words are kept in a bounded LRU
+    """
+
+    def __init__(self, max_oov_words: int = 10000):
+        self.max_oov_words = max_oov_words
+        self.vocabulary_vectors = {}
+        self.oov_vectors = OrderedDict()
+
+    def get(self, word_chars: tuple) -> Optional[torch.tensor]:
+        vector = self.vocabulary_vectors.get(word_chars)
+        if vector is None:
+            vector = self.oov_vectors.get(word_chars)
+            if vector is not None:
+                self.oov_vectors.move_to_end(word_chars)  # mark as most recently used
+
+        return vector
+
+    def add_oov(self, word_chars: tuple, vector: torch.tensor) -> None:
+        self.oov_vectors[word_chars] = vector
+        if len(self.oov_vectors) > self.max_oov_words:
+            self.oov_vectors.popitem(last=False)  # remove least recently used
+
+
+class BaseBiLSTMWithChars(BaseModel):
+    """
+    Base class for the taggers that build word vectors from the word characters with the LSTM_c char encoder
+    """
+    chars_vectors_cache: Optional[CharsVectorsCache] = None
+
+    def __init__(self, config: RNNWithCharsEmbeddingsConfig, mapper: BaseMapperWithPadding):
+        super().__init__(config, mapper)
+        # run LSTM_c only on the real characters of every word (optional, so old checkpoints keep their behaviour)
+        self.pack_chars = "pack_chars" in config and config["pack_chars"]
+        self.pack_sequences = uses_sequence_lengths(config)
+
+        # chars encoder is either LSTM_c or a convolution per width followed by max pooling over the word
+        self.char_encoder = config["char_encoder"] if "char_encoder" in config else "lstm"
+        if self.char_encoder == "cnn":
+            self.char_cnn_widths = config["char_cnn_widths"]
+            self.char_cnn_filters = config["char_cnn_filters"]
+            self.chars_output_dim = len(self.char_cnn_widths) * self.char_cnn_filters
+        else:
+            self.chars_output_dim = config["char_hidden_dim"]
+
+    def create_chars_encoder(self, char_embedding_dim: int) -> None:
+        if self.char_encoder == "cnn":
+            self.chars_convolutions = nn.ModuleList([
+                nn.Conv1d(in_channels=char_embedding_dim, out_channels=self.char_cnn_filters, kernel_size=width)
+                for width in self.char_cnn_widths
+            ])
+        else:
+            self.LSTM_c = nn.LSTM(input_size=char_embedding_dim, hidden_size=self.char_hidden_dim,
+                                  num_layers=1, bidirectional=False, batch_first=True)
+
+    def get_chars_embedding_layer(self) -> nn.Embedding:
+        raise NotImplementedError("A model with chars encoder must define its chars embedding layer")
+
+    def get_vocabulary_words(self) -> List[str]:
+        # words whose char vectors are precomputed by the chars vectors cache
+        return []
+
+    def build_chars_vectors_cache(self, chars_length: int, max_oov_words: int = 10000, batch_size: int = 1024) -> None:
+        # should be called after the model was moved to its device, the cache is used only in eval mode
+        self.chars_vectors_cache = CharsVectorsCache(max_oov_words)
+        device = next(self.parameters()).device
+        vocabulary_words_chars = [tuple(self.mapper.get_word_chars_indices(word, chars_length)) for word in self.get_vocabulary_words()]
+
+        with torch.no_grad():
+            for start in range(0, len(vocabulary_words_chars), batch_size):
+                batch_words_chars = vocabulary_words_chars[start: start + batch_size]
+                batch_vectors = self.encode_chars(torch.tensor(batch_words_chars, device=device))
+                for word_chars, vector in zip(batch_words_chars, batch_vectors):
+                    self.chars_vectors_cache.vocabulary_vectors[word_chars] = vector
+
+    def train(self, mode: bool = True):
+        # the cached vectors are valid only as long as the weights are not updated
+        if mode:
+            self.chars_vectors_cache = None
+
+        return super().train(mode)
+
+    def encode_words_chars(self, chars_x: torch.tensor) -> torch.tensor:
+        # chars_x has dimensions batch, word_sequence, char_sequence
+        batch, word_sequence, char_sequence = chars_x.size()
+
+        # fold word sequence dimension into batch dimension
+        words_chars = chars_x.reshape(batch * word_sequence, char_sequence)
+
+        # every distinct word of the batch is encoded once and its vector is scattered back to all of its occurrences
+        # the padding words are kept as one distinct word, the bi-directional LSTM reads their vector as well
+        unique_words_chars, words_inverse_indices = torch.unique(words_chars, dim=0, return_inverse=True)
+        if self.chars_vectors_cache is not None and not self.training:
+            unique_words_vectors = self._encode_chars_with_cache(unique_words_chars)
+        else:
+            unique_words_vectors = self.encode_chars(unique_words_chars)
+
+        # now expand back
+        return unique_words_vectors[words_inverse_indices].view(batch, word_sequence, -1)
+
+    def encode_chars(self, words_chars: torch.tensor) -> torch.tensor:
+        # words_chars has dimensions words, char_sequence. returns the chars encoder vector of every word
+        chars_embedding_layer = self.get_chars_embedding_layer()
+        char_embeddings = chars_embedding_layer(words_chars)
+
+        if self.char_encoder == "cnn":
+            return self._encode_chars_with_convolutions(char_embeddings, self._get_chars_lengths(words_chars))
+
+        if self.pack_chars:
+            chars_lengths = self._get_chars_lengths(words_chars)
+            char_embeddings = pack_padded_sequence(char_embeddings, chars_lengths.cpu(), batch_first=True, enforce_sorted=False)
+
+        # the last hidden state is returned in the original words order also for packed sequences
+        _, (chars_last_hidden, _) = self.LSTM_c(char_embeddings)
+
+        return chars_last_hidden[-1]
+
+    def _get_chars_lengths(self, words_chars: torch.tensor) -> torch.tensor:
+        return get_sequence_lengths(words_chars != self.get_chars_embedding_layer().padding_idx)
+
+    def _encode_chars_with_convolutions(self, char_embeddings: torch.tensor, chars_lengths: torch.tensor) -> torch.tensor:
+        # convolutions expect dimensions words, features, char_sequence
+        char_embeddings = char_embeddings.permute(0, 2, 1)
+
+        # words shorter than the widest filter are padded with zeros (the embedding of the padding char)
+        _, _, char_sequence = char_embeddings.size()
+        max_width = max(self.char_cnn_widths)
+        if char_sequence < max_width:
+            char_embeddings = F.pad(char_embeddings, [0, max_width - char_sequence])
+
+        words_features = []
+        for width, convolution in zip(self.char_cnn_widths, self.chars_convolutions):
+            convolution_features = torch.relu(convolution(char_embeddings))  # words, filters, num_positions
+
+            # max pool only over the positions that start inside the word (at least the first position)
+            num_positions = convolution_features.size(2)
+            positions = torch.arange(num_positions, device=chars_lengths.device)
+            valid_positions = positions.unsqueeze(0) < torch.clamp(chars_lengths - width + 1, min=1).unsqueeze(1)
+            convolution_features = convolution_features.masked_fill(~valid_positions.unsqueeze(1), float("-inf"))
+
+            words_features.append(torch.max(convolution_features, dim=2)[0])
+
+        return torch.cat(words_features, dim=1)
+
+    def _encode_chars_with_cache(self, words_chars: torch.tensor) -> torch.tensor:
+        words_keys = [tuple(word_chars) for word_chars in words_chars.tolist()]
+        words_vectors = [self.chars_vectors_cache.get(word_key) for word_key in words_keys]
+
+        # only the words that are not in the cache are encoded
+        missing_words = [i for i, vector in enumerate(words_vectors) if vector is None]
+        if len(missing_words) > 0:
+            missing_words_vectors = self.encode_chars(words_chars[missing_words])
+            for i, vector in zip(missing_words, missing_words_vectors):
+                words_vectors[i] = vector
+                self.chars_vectors_cache.add_oov(words_keys[i], vector.clone())  # don't keep the whole batch alive
+
+        return torch.stack(words_vectors)
+
+
+class BiLSTMWithChars(BaseBiLSTMWithChars):
 
     def __init__(self, config: RNNWithCharsEmbeddingsConfig, mapper: TokenMapperWithCharsWithPadding):
         super().__init__(config, mapper)
@@ -261,26 +867,22 @@ class BiLSTMWithChars(BaseModel):
         self.char_hidden_dim = config["char_hidden_dim"]
 
         self.embedding = nn.Embedding(self.tokens_dim, self.embedding_dim, padding_idx=self.padding_idx)
-        self.LSTM_c = nn.LSTM(input_size=self.embedding_dim, hidden_size=self.char_hidden_dim,
-                              num_layers=1, bidirectional=False, batch_first=True)
-        self.LSTM = nn.LSTM(input_size=self.char_hidden_dim, hidden_size=self.hidden_dim,
-                            num_layers=2, bidirectional=True, dropout=0.5, batch_first=True)
+        self.create_chars_encoder(self.embedding_dim)
+        self.LSTM = create_sentence_encoder(config, self.chars_output_dim, self.hidden_dim)
         self.linear = nn.Linear(in_features=self.hidden_dim * 2, out_features=self.labels_dim)
 
-    def forward(self, x: torch.tensor) -> torch.tensor:
-
-        embeddings = self.embedding(x)
-        batch, word_sequence, char_sequence, features = embeddings.size()
+    def get_chars_embedding_layer(self) -> nn.Embedding:
+        return self.embedding
 
-        # fold word sequence dimension into batch dimension
-        embeddings = embeddings.view(batch * word_sequence, char_sequence, features)
-        _, (chars_last_hidden, _) = self.LSTM_c(embeddings)
+    def forward(self, x: torch.tensor, lengths: Optional[torch.tensor] = None) -> torch.tensor:
+        # padding words are made only of padding chars
+        if lengths is None and self.pack_sequences:
+            lengths = get_sequence_lengths(~torch.all(x == self.padding_idx, dim=2))
 
-        # now expand back
-        word_embeddings = chars_last_hidden.view(batch, word_sequence, self.char_hidden_dim)
+        word_embeddings = self.encode_words_chars(x)
 
         # now we are in the same situation as always - batch, sequence, features
-        rnn_features, _ = self.LSTM(word_embeddings)
+        rnn_features = run_sentence_encoder(self.LSTM, word_embeddings, lengths)
 
         # RNN outputs has dimensions batch, sequence_length, features (features is num_directions * hidden dim)
         y_hat = self.linear(rnn_features)
@@ -290,7 +892,7 @@ class BiLSTMWithChars(BaseModel):
         return y_hat
 
 
-class BiLSTMWithCharsAndWords(BaseModel):
+class BiLSTMWithCharsAndWords(BaseBiLSTMWithChars):
 
     def __init__(self, config: RNNWithCharsWithWordsEmbeddingsConfig, mapper: TokenMapperWithCharsWithWordsWithPadding):
         super().__init__(config, mapper)
@@ -308,29 +910,27 @@ class BiLSTMWithCharsAndWords(BaseModel):
         self.chars_embedding = nn.Embedding(self.chars_dim, self.char_embedding_dim,  padding_idx=self.char_padding_idx)
         self.words_embedding = nn.Embedding(self.words_dim,  self.word_embedding_dim, padding_idx=self.padding_idx)
 
-        self.LSTM_c = nn.LSTM(input_size=self.char_embedding_dim, hidden_size=self.char_hidden_dim,
-                              num_layers=1, bidirectional=False, batch_first=True)
-        self.liner_embeds = nn.Linear(in_features=(self.word_embedding_dim + self.char_hidden_dim), out_features=self.linear_embeds_out_dim)
+        self.create_chars_encoder(self.char_embedding_dim)
+        self.liner_embeds = nn.Linear(in_features=(self.word_embedding_dim + self.chars_output_dim), out_features=self.linear_embeds_out_dim)
         self.tanh = nn.Tanh()
-        self.LSTM = nn.LSTM(input_size=self.linear_embeds_out_dim, hidden_size=self.hidden_dim,
-                            num_layers=2, bidirectional=True, dropout=0.5, batch_first=True)
+        self.LSTM = create_sentence_encoder(config, self.linear_embeds_out_dim, self.hidden_dim)
 
         self.linear = nn.Linear(in_features=self.hidden_dim * 2, out_features=self.labels_dim)
 
-    def forward(self, x: torch.tensor) -> torch.tensor:
-        chars_x = x[:, :, :-1]
-        words_x = x[:, :, -1]
+    def get_chars_embedding_layer(self) -> nn.Embedding:
+        return self.chars_embedding
 
-        char_embeddings = self.chars_embedding(chars_x)
-        batch, word_sequence, char_sequence, features = char_embeddings.size()
+    def get_vocabulary_words(self) -> List[str]:
+        return self.mapper.get_vocabulary_words()
 
-        # fold word sequence dimension into batch dimension
-        char_embeddings = char_embeddings.view(batch * word_sequence, char_sequence, features)
-        _, (chars_last_hidden, _) = self.LSTM_c(char_embeddings)
+    def forward(self, x: torch.tensor, lengths: Optional[torch.tensor] = None) -> torch.tensor:
+        chars_x = x[:, :, :-1]
+        words_x = x[:, :, -1]
 
-        # now expand back
-        word_chars_embeddings = chars_last_hidden.view(batch, word_sequence, self.char_hidden_dim)
+        if lengths is None and self.pack_sequences:
+            lengths = get_sequence_lengths(words_x != self.padding_idx)
 
+        word_chars_embeddings = self.encode_words_chars(chars_x)
         word_embeddings = self.words_embedding(words_x)
 
         concat_word_embeddings = torch.cat([word_chars_embeddings,word_embeddings], dim=2)
@@ -338,7 +938,7 @@ class BiLSTMWithCharsAndWords(BaseModel):
         concat_word_embeddings = self.tanh(self.liner_embeds(concat_word_embeddings))
 
         # now we are in the same situation as always - batch, sequence, features
-        rnn_features, _ = self.LSTM(concat_word_embeddings)
+        rnn_features = run_sentence_encoder(self.LSTM, concat_word_embeddings, lengths)
 
         # RNN outputs has dimensions batch, sequence_length, features (features is num_directions * hidden dim)
         y_hat = self.linear(rnn_features)
@@ -0,0 +1,110 @@
+import torch
+from torch.utils import data
+
+from factory_classes import ConfigsFactory, MappersFactory, ModelsFactory, PredictorsFactory, DatasetsFactory, LossFunctionFactory
+from pos_and_ner.inference_script import load_trained_model, save_predictions_to_file, save_raw_text_predictions_to_file
+from pos_and_ner.models import MultiTaskBiLSTM, get_autocast_context
+from pos_and_ner.mappers import MultiTaskTokenMapperWithPadding
+from pos_and_ner.datasets import BiLSTMDataset, get_real_tokens_mask
+from pos_and_ner.trainers import MultiTaskTrainer
+
+MULTITASK_MODEL_TYPE = "multitask_pos_ner"
+
+
+def get_task_type(task: str) -> str:
+    # datasets, predictors and losses of a task are the ones of the single task lstm tagger
+    return f"lstm_{task}"
+
+
+def multitask_train(training_unique_name: str, pos_train_path: str, pos_dev_path: str, ner_train_path: str, ner_dev_path: str,
+                    model_config_path: str, training_config_path: str) -> None:
+    # initiate factory object
+    config_factory = ConfigsFactory()
+    mappers_factory = MappersFactory()
+    models_factory = ModelsFactory()
+    predictors_factory = PredictorsFactory()
+    datasets_factory = DatasetsFactory()
+    loss_function_factory = LossFunctionFactory()
+
+    training_config = config_factory("training").from_json_file(training_config_path)
+    model_config = config_factory(MULTITASK_MODEL_TYPE).from_json_file(model_config_path)
+    train_paths = {"pos": pos_train_path, "ner": ner_train_path}
+    dev_paths = {"pos": pos_dev_path, "ner": ner_dev_path}
+
+    # one words mapping for both corpora
+    mapper: MultiTaskTokenMapperWithPadding = mappers_factory(training_config, mapper_name=MULTITASK_MODEL_TYPE)
+    mapper.create_tasks_mapping(train_paths)
+
+    train_datasets, dev_datasets, predictors, loss_functions = {}, {}, {}, {}
+    for task in mapper.tasks:
+        task_mapper = mapper.get_task_mapper(task)
+        task_type = get_task_type(task)
+        train_datasets[task] = datasets_factory(training_config, train_paths[task], task_mapper, dataset_type=task_type)
+        dev_datasets[task] = datasets_factory(training_config, dev_paths[task], task_mapper, dataset_type=task_type)
+        predictors[task] = predictors_factory(training_config, task_mapper, predictor_type=task_type)
+        loss_functions[task] = loss_function_factory(task_type, task_mapper)
+
+    model = models_factory(training_config, model_config, mapper, model_name=MULTITASK_MODEL_TYPE)
+    trainer = MultiTaskTrainer(model, training_config, predictors, loss_functions)
+    trainer.train(training_unique_name, train_datasets=train_datasets, dev_datasets=dev_datasets)
+
+
+def multitask_inference(test_path: str, inference_config_path: str, saved_model_path: str, save_predictions_path: str) -> None:
+    # tags the test file for all the tasks in a single forward pass, every prediction line has the labels of the
+    # tasks in the order of the tasks (e.g. "word POS NER")
+    config_factory = ConfigsFactory()
+    predictors_factory = PredictorsFactory()
+    dataset_factory = DatasetsFactory()
+
+    inference_config = config_factory("inference").from_json_file(inference_config_path)
+    model, _ = load_trained_model(saved_model_path, MULTITASK_MODEL_TYPE)
+    model: MultiTaskBiLSTM
+    mapper: MultiTaskTokenMapperWithPadding = model.mapper
+    tasks_mappers = [mapper.get_task_mapper(task) for task in mapper.tasks]
+    predictors = [predictors_factory(inference_config, task_mapper, get_task_type(task))
+                  for task, task_mapper in zip(mapper.tasks, tasks_mappers)]
+
+    # the samples are the same for all the tasks, the dataset of the first task reads them
+    test_dataset: BiLSTMDataset = dataset_factory(inference_config, test_path, tasks_mappers[0], get_task_type(mapper.tasks[0]))
+    chunked = "chunk_overlap" in inference_config
+    if chunked:
+        test_dataset.set_chunking(test_dataset.sequence_length, inference_config["chunk_overlap"])
+
+    test_dataset.sequence_length = test_dataset.get_dataset_max_sequence_length()
+    test_config_dict = {"batch_size": inference_config["batch_size"], "num_workers": inference_config["num_workers"]}
+    test_loader = data.DataLoader(test_dataset, **test_config_dict)
+
+    device = torch.device(inference_config["device"])
+    precision = inference_config["precision"] if "precision" in inference_config else "fp32"
+    model = model.to(device)
+    model.eval()
+
+    # raw text predictions are tab separated
+    labels_separator = "\t" if test_dataset.tokenizer is not None else " "
+    padding_index = mapper.get_padding_index()
+    predictions = []
+    with torch.no_grad():
+
+        for sample in test_loader:
+            x, _ = sample
+            x = x.to(device)
+            with get_autocast_context(precision, device):
+                tasks_outputs = model(x)
+
+            real_tokens_mask = get_real_tokens_mask(x, MULTITASK_MODEL_TYPE, padding_index)
+            tasks_labels = []
+            for outputs, predictor, task_mapper in zip(tasks_outputs, predictors, tasks_mappers):
+                batch_predictions = predictor.infer_model_outputs(outputs, real_tokens_mask.view(x.size(0), -1))
+                batch_predictions = batch_predictions.flatten()[real_tokens_mask]
+                tasks_labels.append([task_mapper.get_label_from_idx(prediction) for prediction in batch_predictions.tolist()])
+
+            predictions.extend(labels_separator.join(token_labels) for token_labels in zip(*tasks_labels))
+
+    # every token gets the prediction of the chunk it is in the center of
+    if chunked:
+        predictions = test_dataset.stitch_chunks_predictions(predictions)
+
+    if test_dataset.tokenizer is not None:
+        save_raw_text_predictions_to_file(test_path, predictions, save_predictions_path, test_dataset.tokenizer)
+    else:
+        save_predictions_to_file(test_path, predictions, save_predictions_path)
@@ -0,0 +1,82 @@
+import json
+from typing import Dict
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils import data
+
+from factory_classes import ConfigsFactory, DatasetsFactory
+from pos_and_ner.inference_script import load_trained_model
+from pos_and_ner.models import BaseModel, WindowTagger, BasicBiLSTM, AcceptorLSTM
+from pos_and_ner.mappers import encode_mapper_state
+from pos_and_ner.numpy_runtime import NumpyModel
+
+# modules of every model that is supported by the numpy runtime, besides the embedding table
+NUMPY_MODELS_MODULES = {WindowTagger: ["hidden", "output"], BasicBiLSTM: ["LSTM", "linear"], AcceptorLSTM: ["lstm", "linear"]}
+
+
+def get_numpy_params(model: BaseModel) -> Dict[str, np.ndarray]:
+    # the embedding table is read by its weight, so compressed tables (pos_and_ner.compress) are exported decompressed
+    params = {"embedding": model.embedding.weight}
+    for module_name in NUMPY_MODELS_MODULES[type(model)]:
+        for name, tensor in getattr(model, module_name).state_dict().items():
+            params[f"{module_name}.{name}"] = tensor
+
+    return {name: tensor.detach().float().cpu().numpy() for name, tensor in params.items()}
+
+
+def export_numpy_model(model_type: str, trained_model_path: str, example_path: str, inference_config_path: str, export_prefix: str) -> None:
+    # saves the weights of a trained window tagger, lstm tagger or acceptor to <prefix>.npz and the mapper and the
+    # model settings to <prefix>.json, and checks that the numpy runtime (pos_and_ner.numpy_runtime) reproduces the
+    # model outputs on the samples of the example file
+    config_factory = ConfigsFactory()
+    dataset_factory = DatasetsFactory()
+
+    inference_config = config_factory("inference").from_json_file(inference_config_path)
+    model, _ = load_trained_model(trained_model_path, model_type)
+    model: BaseModel
+    model_name = type(model).__name__
+    mapper = model.mapper
+
+    if type(model) not in NUMPY_MODELS_MODULES:
+        raise ValueError(f"The numpy runtime supports the {', '.join(model_class.__name__ for model_class in NUMPY_MODELS_MODULES)} "
+                         f"models, got {model_name}")
+
+    if isinstance(model, BasicBiLSTM) and not isinstance(model.LSTM, nn.LSTM):
+        raise ValueError(f"The numpy runtime supports the lstm sentence encoder, got {type(model.LSTM).__name__}")
+
+    if any(option in inference_config and inference_config[option] for option in ["sentence_level", "raw_text"]):
+        raise ValueError("The numpy runtime reads per token windows of one-token-per-line files, "
+                         "sentence_level and raw_text are not supported")
+
+    example_dataset = dataset_factory(inference_config, example_path, mapper, model_type)
+    if isinstance(model, BasicBiLSTM):
+        example_dataset.sequence_length = example_dataset.get_dataset_max_sequence_length()
+
+    # the window size of window taggers, the padding of lstm taggers and the strings length of the acceptor
+    metadata = {
+        "model_type": model_type,
+        "model_name": model_name,
+        "mapper": {"name": mapper.__class__.__name__, "state": encode_mapper_state(mapper.serialize())},
+        "window_size": model.window_size if isinstance(model, WindowTagger) else None,
+        "pack_sequences": not isinstance(model, WindowTagger) and model.pack_sequences,
+        "padding_index": None if isinstance(model, WindowTagger) else model.padding_idx,
+        "sequence_length": example_dataset.sequence_length if isinstance(model, AcceptorLSTM) else None
+    }
+
+    np.savez(f"{export_prefix}.npz", **get_numpy_params(model))
+    with open(f"{export_prefix}.json", "w", encoding="utf8") as f:
+        json.dump(metadata, f)
+
+    # the numpy model is checked against the model in eval mode (no dropout) on CPU
+    numpy_model = NumpyModel(export_prefix)
+    model = model.to(torch.device("cpu"))
+    model.eval()
+    example_loader = data.DataLoader(example_dataset, batch_size=inference_config["batch_size"])
+
+    with torch.no_grad():
+        for sample in example_loader:
+            x, _ = sample
+            if not np.allclose(numpy_model.forward(x.numpy()), model(x).numpy(), atol=1e-4):
+                raise ValueError(f"The numpy {model_name} model doesn't reproduce the model outputs on {example_path}")
@@ -0,0 +1,198 @@
+import sys
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from pos_and_ner import mappers
+from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding, BEGIN, END, decode_mapper_state
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    # written with tanh so large negative inputs don't overflow exp
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+def linear(x: np.ndarray, weight: np.ndarray, bias: np.ndarray) -> np.ndarray:
+    # weight has the (out_features, in_features) layout of nn.Linear
+    return np.matmul(x, weight.T) + bias
+
+
+def get_sequence_lengths(real_tokens_mask: np.ndarray) -> np.ndarray:
+    # same as models.get_sequence_lengths - the position of the last real token, at least 1
+    positions = np.arange(1, real_tokens_mask.shape[1] + 1)
+    return np.maximum(np.max(real_tokens_mask * positions, axis=1), 1)
+
+
+def lstm_layer(inputs: np.ndarray, weight_ih: np.ndarray, weight_hh: np.ndarray, bias_ih: np.ndarray,
+               bias_hh: np.ndarray, lengths: Optional[np.ndarray] = None, reverse: bool = False) -> np.ndarray:
+    # runs one direction of an LSTM layer over inputs of dimensions batch, sequence, features and returns the hidden
+    # states of all the steps. the gates are ordered input, forget, cell, output as in nn.LSTM
+    # with lengths the states are zero outside of the real tokens of every sequence, as with packed sequences, so the
+    # reverse direction starts at the last real token
+    batch_size, sequence_length, _ = inputs.shape
+    hidden_dim = weight_hh.shape[1]
+
+    # the input projections of all the steps are computed at once, only the recurrence runs step by step
+    inputs_gates = linear(inputs, weight_ih, bias_ih + bias_hh)
+    h = np.zeros((batch_size, hidden_dim), dtype=inputs.dtype)
+    c = np.zeros((batch_size, hidden_dim), dtype=inputs.dtype)
+    outputs = np.zeros((batch_size, sequence_length, hidden_dim), dtype=inputs.dtype)
+
+    steps = range(sequence_length - 1, -1, -1) if reverse else range(sequence_length)
+    for step in steps:
+        gates = inputs_gates[:, step] + np.matmul(h, weight_hh.T)
+        input_gate, forget_gate, cell_gate, output_gate = np.split(gates, 4, axis=1)
+        c = sigmoid(forget_gate) * c + sigmoid(input_gate) * np.tanh(cell_gate)
+        h = sigmoid(output_gate) * np.tanh(c)
+
+        if lengths is not None:
+            real_tokens = (step < lengths)[:, np.newaxis]
+            c = c * real_tokens
+            h = h * real_tokens
+
+        outputs[:, step] = h
+
+    return outputs
+
+
+def lstm(inputs: np.ndarray, params: Dict[str, np.ndarray], num_layers: int, bidirectional: bool,
+         lengths: Optional[np.ndarray] = None) -> np.ndarray:
+    # multi layer LSTM over the parameters of an nn.LSTM state (weight_ih_l0, weight_hh_l0_reverse, ...), every layer
+    # reads the concatenated outputs of both directions of the previous layer
+    directions = ["", "_reverse"] if bidirectional else [""]
+    current_input = inputs
+    for layer in range(num_layers):
+        directions_outputs = []
+        for direction in directions:
+            suffix = f"l{layer}{direction}"
+            directions_outputs.append(lstm_layer(current_input, params[f"weight_ih_{suffix}"], params[f"weight_hh_{suffix}"],
+                                                 params[f"bias_ih_{suffix}"], params[f"bias_hh_{suffix}"],
+                                                 lengths, reverse=direction == "_reverse"))
+
+        current_input = np.concatenate(directions_outputs, axis=2)
+
+    return current_input
+
+
+def window_tagger_forward(x: np.ndarray, params: Dict[str, np.ndarray]) -> np.ndarray:
+    # x has the word indices of the windows, dimensions batch, window_size * 2 + 1
+    embedding = params["embedding"][x].reshape(x.shape[0], -1)
+    hidden = np.tanh(linear(embedding, params["hidden.weight"], params["hidden.bias"]))
+    return linear(hidden, params["output.weight"], params["output.bias"])
+
+
+def bilstm_forward(x: np.ndarray, params: Dict[str, np.ndarray], lengths: Optional[np.ndarray] = None) -> np.ndarray:
+    # x has the word indices of the padded sentences, outputs have dimensions batch, labels, sequence as in BasicBiLSTM
+    lstm_params = {name[len("LSTM."):]: value for name, value in params.items() if name.startswith("LSTM.")}
+    rnn_features = lstm(params["embedding"][x], lstm_params, num_layers=2, bidirectional=True, lengths=lengths)
+    y_hat = linear(rnn_features, params["linear.weight"], params["linear.bias"])
+    return np.transpose(y_hat, (0, 2, 1))
+
+
+def acceptor_forward(x: np.ndarray, params: Dict[str, np.ndarray], lengths: Optional[np.ndarray] = None) -> np.ndarray:
+    # x has the character indices of the padded strings, every string is classified from the state at its last real
+    # character when the lengths are given, and from the state after the padding otherwise (as in AcceptorLSTM)
+    lstm_params = {name[len("lstm."):]: value for name, value in params.items() if name.startswith("lstm.")}
+    rnn_features = lstm(params["embedding"][x], lstm_params, num_layers=1, bidirectional=False, lengths=lengths)
+
+    if lengths is not None:
+        h_n = rnn_features[np.arange(x.shape[0]), lengths - 1]
+    else:
+        h_n = rnn_features[:, -1]
+
+    return linear(h_n, params["linear.weight"], params["linear.bias"])
+
+
+class NumpyModel(object):
+    """
+    Runs inference with a WindowTagger, BasicBiLSTM or AcceptorLSTM model exported by pos_and_ner.numpy_export -
+    the weights (<prefix>.npz) and a json file with the mapper and the model settings (<prefix>.json).
+    Only numpy and the mappers module are imported (not torch), decoding is greedy
+    """
+
+    def __init__(self, export_prefix: str):
+        with open(f"{export_prefix}.json", "r", encoding="utf8") as f:
+            self.metadata = json.load(f)
+
+        self.model_name: str = self.metadata["model_name"]
+        self.mapper: BaseMapper = getattr(mappers, self.metadata["mapper"]["name"])()
+        self.mapper.deserialize(decode_mapper_state(self.metadata["mapper"]["state"]))
+
+        with np.load(f"{export_prefix}.npz") as weights:
+            self.params = {name: weights[name] for name in weights.files}
+
+    def forward(self, x: np.ndarray) -> np.ndarray:
+        # outputs have the layout of the outputs of the torch model
+        if self.model_name == "WindowTagger":
+            return window_tagger_forward(x, self.params)
+
+        lengths = None
+        if self.metadata["pack_sequences"]:
+            lengths = get_sequence_lengths(x != self.metadata["padding_index"])
+
+        if self.model_name == "BasicBiLSTM":
+            return bilstm_forward(x, self.params, lengths)
+
+        return acceptor_forward(x, self.params, lengths)
+
+    def read_samples(self, file_path: str) -> List[List[str]]:
+        # sentences of a tagging file (one token per line, labels are ignored) or strings of an acceptor file
+        samples = []
+        with open(file_path, "r", encoding="utf8") as f:
+            sentence = []
+            for line in f:
+                if self.model_name == "AcceptorLSTM":
+                    samples.append(list(line[:-1].split(self.mapper.split_char)[0]))
+                elif line == "\n":
+                    samples.append(sentence)
+                    sentence = []
+                else:
+                    sentence.append(line[:-1].split(self.mapper.split_char)[0])
+
+        return samples
+
+    def create_inputs(self, samples: List[List[str]]) -> np.ndarray:
+        if self.model_name == "WindowTagger":
+            # a window around every token of every sentence, as in WindowDataset
+            window_size = self.metadata["window_size"]
+            windows_offsets = np.arange(2 * window_size + 1)
+            windows = []
+            for sentence in samples:
+                padded_sentence = [BEGIN] * window_size + sentence + [END] * window_size
+                sentence_indices = np.array([self.mapper.get_token_idx(token) for token in padded_sentence], dtype=np.int64)
+                windows.append(sentence_indices[np.arange(len(sentence))[:, np.newaxis] + windows_offsets])
+
+            return np.concatenate(windows)
+
+        # sentences are padded to the longest sentence of the file (as in inference), strings to the acceptor length
+        self.mapper: BaseMapperWithPadding
+        sequence_length = self.metadata["sequence_length"] or max(len(sample) for sample in samples)
+        x = np.full((len(samples), sequence_length), self.mapper.get_padding_index(), dtype=np.int64)
+        for sample_index, sample in enumerate(samples):
+            sample = sample[:sequence_length]
+            x[sample_index, :len(sample)] = [self.mapper.get_token_idx(token) for token in sample]
+
+        return x
+
+    def predict(self, file_path: str, batch_size: int = 200) -> List[str]:
+        # returns the predicted label of every token (tagging models) or of every string (acceptor)
+        x = self.create_inputs(self.read_samples(file_path))
+        predictions = []
+        for start in range(0, x.shape[0], batch_size):
+            batch = x[start:start + batch_size]
+            batch_predictions = np.argmax(self.forward(batch), axis=1)
+
+            if self.model_name == "BasicBiLSTM":
+                batch_predictions = batch_predictions[batch != self.metadata["padding_index"]]
+
+            predictions.extend(self.mapper.get_label_from_idx(prediction) for prediction in batch_predictions.tolist())
+
+        return predictions
+
+
+if __name__ == '__main__':
+    # usage: numpy_runtime.py <export prefix> <test file> - prints a predicted label per line
+    numpy_model = NumpyModel(sys.argv[1])
+    for label in numpy_model.predict(sys.argv[2]):
+        print(label)
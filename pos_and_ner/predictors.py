@@ -1,8 +1,10 @@
-from typing import Tuple
+from typing import Tuple, Optional
 
 import torch
 
-from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding
+from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding, IGNORED_LABEL_INDEX
+
+IMPOSSIBLE_TRANSITION_SCORE = -10000.0  # finite, so a sequence with only impossible paths doesn't produce nan scores
 
 
 class BasePredictor(object):
@@ -10,7 +12,8 @@ class BasePredictor(object):
     def __init__(self, mapper: BaseMapper):
         self.mapper = mapper
 
-    def infer_model_outputs(self, model_outputs: torch.tensor) -> torch.tensor:
+    def infer_model_outputs(self, model_outputs: torch.tensor, mask: Optional[torch.tensor] = None) -> torch.tensor:
+        # mask (optional, for sequence models) marks the real tokens of every sequence
         raise NotImplementedError("A class deriving from BasePredictor must implement infer_model_outputs method")
 
     def infer_sample(self, model: torch.nn.Module, tokens_indices: torch.tensor):
@@ -30,9 +33,11 @@ class BasePredictor(object):
         num_correct: int
         num_predictions: int
 
-        num_predictions = len(labels)
+        # labels marked as ignored (padding of sentence level samples) are not counted
+        labels_mask = (labels != IGNORED_LABEL_INDEX).type(torch.int64)
+        num_predictions = torch.sum(labels_mask).item()
         predictions: torch.tensor = self.infer_model_outputs(model_outputs)
-        correct_predictions: torch.tensor = (predictions == labels).type(torch.int64)
+        correct_predictions: torch.tensor = (predictions == labels).type(torch.int64) * labels_mask
         num_correct = torch.sum(correct_predictions).item()
 
         return num_correct, num_predictions
@@ -43,7 +48,7 @@ class WindowModelPredictor(BasePredictor):
     def __init__(self, mapper: BaseMapper):
         super().__init__(mapper)
 
-    def infer_model_outputs(self, model_outputs: torch.tensor) -> torch.tensor:
+    def infer_model_outputs(self, model_outputs: torch.tensor, mask: Optional[torch.tensor] = None) -> torch.tensor:
         _, labels_tokens = torch.max(model_outputs, dim=1)
 
         return labels_tokens
@@ -67,6 +72,9 @@ class WindowNERTaggerPredictor(WindowModelPredictor):
         # finally, these are the samples we DO NOT want to count, so we will flip the result
         O_tag_mask = 1 - (labels_mask * predictions_mask)
 
+        # labels marked as ignored (padding of sentence level samples) are not counted as well
+        O_tag_mask = O_tag_mask * (labels != IGNORED_LABEL_INDEX).type(torch.int64)
+
         # now O_tag_mask contains all samples where the gold label is not 'O' or the predicated label is not O
         # number of predictions is just a sum of this tensor
         num_predictions = torch.sum(O_tag_mask).item()
@@ -84,7 +92,7 @@ class AcceptorPredictor(BasePredictor):
     def __init__(self, mapper: BaseMapper):
         super().__init__(mapper)
 
-    def infer_model_outputs(self, model_outputs: torch.tensor) -> torch.tensor:
+    def infer_model_outputs(self, model_outputs: torch.tensor, mask: Optional[torch.tensor] = None) -> torch.tensor:
         _, labels_tokens = torch.max(model_outputs, dim=1)
 
         return labels_tokens
@@ -94,7 +102,7 @@ class GreedyLSTMPredictor(BasePredictor):
     def __init__(self, mapper: BaseMapperWithPadding):
         super().__init__(mapper)
 
-    def infer_model_outputs(self, model_outputs: torch.tensor) -> torch.Tensor:
+    def infer_model_outputs(self, model_outputs: torch.tensor, mask: Optional[torch.tensor] = None) -> torch.Tensor:
         # dimension of model outputs is batch_size, num_features, sequence_length
         # that is why we are using max on dimension 1 - the features dimension
         _, labels_tokens = torch.max(model_outputs, dim=1)
@@ -113,7 +121,7 @@ class GreedyLSTMPredictor(BasePredictor):
         num_predictions = torch.sum(padding_mask).item()
 
         # compute prediction (greedy, argmax in each time sequence)
-        predictions = self.infer_model_outputs(model_outputs)
+        predictions = self.infer_model_outputs(model_outputs, padding_mask.bool())
 
         # compare between predictions and labels, masking out padding
         correct_predictions_raw = (predictions == labels).type(torch.int64)
@@ -132,15 +140,15 @@ class GreedyLSTMPredictorForNER(GreedyLSTMPredictor):
         num_correct: int
         num_predictions: int
 
-        # compute prediction (greedy, argmax in each time sequence)
-        predictions = self.infer_model_outputs(model_outputs)
-
         # get the indices of the padding label and the O label
         self.mapper: BaseMapperWithPadding
         padding_symbol = self.mapper.get_padding_symbol()
         label_padding_index = self.mapper.get_label_idx(padding_symbol)
         O_tag_label = self.mapper.get_label_idx('O')
 
+        # compute prediction (greedy, argmax in each time sequence)
+        predictions = self.infer_model_outputs(model_outputs, labels != label_padding_index)
+
         # create a mask to identify predictions and gold labels of the O tag
         labels_mask = (labels == O_tag_label).type(torch.int64)
         predictions_mask = (predictions == O_tag_label).type(torch.int64)
@@ -166,3 +174,100 @@ class GreedyLSTMPredictorForNER(GreedyLSTMPredictor):
         num_correct = torch.sum(correct_prediction).item()
 
         return num_correct, num_predictions
+
+
+class ViterbiDecoder(object):
+    """
+    Batched Viterbi decoding over a transition scores matrix (transitions[previous_label, next_label]).
+    Every time step is computed for the whole batch and all the labels at once, padding steps are masked
+    """
+
+    def __init__(self, transitions: torch.tensor, start_transitions: torch.tensor):
+        self.transitions = transitions
+        self.start_transitions = start_transitions
+
+    @staticmethod
+    def from_mapper(mapper: BaseMapperWithPadding) -> "ViterbiDecoder":
+        # hard constraints of the BIO (IOB2) scheme - "I-X" can only follow "B-X" or "I-X" and can't start a sentence
+        # the constraints apply only if the labels use the scheme, the padding label is never predicted
+        labels_dim = mapper.get_labels_dim()
+        transitions = torch.zeros(labels_dim, labels_dim)
+        start_transitions = torch.zeros(labels_dim)
+        is_bio_scheme = any(label.startswith("B-") for label in mapper.label_to_idx.keys())
+
+        for next_label, next_index in mapper.label_to_idx.items():
+            if is_bio_scheme and next_label.startswith("I-"):
+                entity_type = next_label[2:]
+                allowed_previous = {mapper.label_to_idx.get(f"B-{entity_type}"), next_index}
+                for previous_index in range(labels_dim):
+                    if previous_index not in allowed_previous:
+                        transitions[previous_index, next_index] = IMPOSSIBLE_TRANSITION_SCORE
+
+                start_transitions[next_index] = IMPOSSIBLE_TRANSITION_SCORE
+
+        label_padding_index = mapper.get_label_padding_index()
+        transitions[:, label_padding_index] = IMPOSSIBLE_TRANSITION_SCORE
+        start_transitions[label_padding_index] = IMPOSSIBLE_TRANSITION_SCORE
+
+        return ViterbiDecoder(transitions, start_transitions)
+
+    @staticmethod
+    def from_file(transitions_path: str) -> "ViterbiDecoder":
+        # a saved dictionary with "transitions" (labels x labels scores, e.g. learned by a CRF)
+        # and optionally "start_transitions" (labels scores)
+        transitions_data = torch.load(transitions_path)
+        transitions = transitions_data["transitions"]
+        start_transitions = transitions_data.get("start_transitions", torch.zeros(transitions.size(0)))
+
+        return ViterbiDecoder(transitions, start_transitions)
+
+    def decode(self, model_outputs: torch.tensor, mask: Optional[torch.tensor] = None) -> torch.tensor:
+        # model outputs has dimensions batch, labels, sequence_length (like the inputs of the loss)
+        emissions = torch.log_softmax(model_outputs, dim=1).permute(0, 2, 1)
+        batch_size, sequence_length, labels_dim = emissions.size()
+
+        if mask is None:
+            mask = torch.ones(batch_size, sequence_length, dtype=torch.bool, device=emissions.device)
+        mask = mask.view(batch_size, sequence_length).bool()
+
+        transitions = self.transitions.to(emissions)
+        scores = self.start_transitions.to(emissions) + emissions[:, 0]  # batch, labels
+        identity_pointers = torch.arange(labels_dim, device=emissions.device).expand(batch_size, labels_dim)
+
+        backpointers = []
+        for t in range(1, sequence_length):
+            # candidate scores of every (previous label, next label) pair for the whole batch
+            candidates_scores = scores.unsqueeze(2) + transitions.unsqueeze(0)
+            best_scores, best_previous = torch.max(candidates_scores, dim=1)
+
+            # padding steps keep the scores and point to the same label
+            step_mask = mask[:, t].unsqueeze(1)
+            scores = torch.where(step_mask, best_scores + emissions[:, t], scores)
+            backpointers.append(torch.where(step_mask, best_previous, identity_pointers))
+
+        # follow the back pointers from the best last label
+        _, best_label = torch.max(scores, dim=1)
+        best_path = [best_label]
+        for step_backpointers in reversed(backpointers):
+            best_label = torch.gather(step_backpointers, 1, best_label.unsqueeze(1)).squeeze(1)
+            best_path.append(best_label)
+
+        best_path.reverse()
+        return torch.stack(best_path, dim=1)
+
+
+class ViterbiLSTMPredictor(GreedyLSTMPredictor):
+    def __init__(self, mapper: BaseMapperWithPadding, transitions_path: Optional[str] = None):
+        super().__init__(mapper)
+        if transitions_path is not None:
+            self.decoder = ViterbiDecoder.from_file(transitions_path)
+        else:
+            self.decoder = ViterbiDecoder.from_mapper(mapper)
+
+    def infer_model_outputs(self, model_outputs: torch.tensor, mask: Optional[torch.tensor] = None) -> torch.Tensor:
+        return self.decoder.decode(model_outputs, mask)
+
+
+class ViterbiLSTMPredictorForNER(ViterbiLSTMPredictor, GreedyLSTMPredictorForNER):
+    # Viterbi decoding with the NER accuracy of GreedyLSTMPredictorForNER
+    pass
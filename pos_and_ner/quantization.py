@@ -0,0 +1,75 @@
+import io
+import time
+from typing import Set, Tuple
+
+import torch
+import torch.nn as nn
+from torch.utils import data
+
+from pos_and_ner.models import BaseModel, TransformerSentenceEncoder, get_autocast_context
+from pos_and_ner.mappers import BaseMapper, BaseMapperWithPadding, IGNORED_LABEL_INDEX
+from pos_and_ner.predictors import BasePredictor
+
+# layers replaced by their int8 dynamic quantized version
+QUANTIZED_LAYERS = {nn.LSTM, nn.Linear}
+
+
+def get_quantized_layers_names(model: BaseModel) -> Set[str]:
+    # the layers inside transformer sentence encoders stay float32 - nn.TransformerEncoder reads the weight tensors of
+    # its linear layers, which the quantized linear layers don't have
+    transformer_names = [name for name, module in model.named_modules() if isinstance(module, TransformerSentenceEncoder)]
+    return {name for name, module in model.named_modules()
+            if type(module) in QUANTIZED_LAYERS and not any(name.startswith(f"{transformer_name}.") for transformer_name in transformer_names)}
+
+
+def quantize_model(model: BaseModel) -> BaseModel:
+    # dynamic quantization - int8 weights, activations are quantized on the fly. runs on CPU only
+    # returns a quantized copy, the original model is not changed
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, get_quantized_layers_names(model), dtype=torch.qint8)
+
+
+def get_model_size(model: BaseModel) -> int:
+    # size in bytes of the serialized model weights
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def count_labeled_tokens(labels: torch.tensor, mapper: BaseMapper) -> int:
+    # models with a label per sample (window, acceptor, SNLI) predict one token per label
+    if labels.dim() < 2:
+        return labels.numel()
+
+    # sequence models - don't count the padding
+    real_tokens = labels != IGNORED_LABEL_INDEX
+    if isinstance(mapper, BaseMapperWithPadding):
+        real_tokens = real_tokens * (labels != mapper.get_label_padding_index())
+
+    return int(torch.sum(real_tokens))
+
+
+def evaluate_model(model: BaseModel, predictor: BasePredictor, data_loader: data.DataLoader, precision: str = "fp32") -> Tuple[float, float]:
+    # returns the accuracy (as computed by the predictor) and the number of tokens per second, the model runs on CPU
+    model.eval()
+    num_correct_predictions = 0
+    total_predictions = 0
+    num_tokens = 0
+    inference_time = 0.0
+
+    with torch.no_grad():
+        for sample in data_loader:
+            # SNLI samples have 2 inputs (premise and hypothesis), the other samples have one
+            *x, y = sample
+
+            start_time = time.perf_counter()
+            with get_autocast_context(precision, torch.device("cpu")):
+                outputs = model(*x)
+            inference_time += time.perf_counter() - start_time
+
+            num_correct_batch, total_predictions_batch = predictor.infer_model_outputs_with_gold_labels(outputs, y)
+            num_correct_predictions += num_correct_batch
+            total_predictions += total_predictions_batch
+            num_tokens += count_labeled_tokens(y, model.mapper)
+
+    return num_correct_predictions / max(total_predictions, 1), num_tokens / inference_time
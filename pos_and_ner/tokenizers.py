@@ -0,0 +1,90 @@
+import re
+from typing import Iterator, List, Tuple
+
+# a token is represented by its text and its [start, end) character offsets in the raw document
+Token = Tuple[str, int, int]
+
+TOKEN_PATTERN = re.compile(r"""
+      (?:[A-Za-z]\.){2,}                                        # acronyms, e.g. U.S.
+    | (?:Mr|Mrs|Ms|Dr|Prof|Sr|Jr|St|Inc|Co|Corp|Ltd|vs)\.       # common abbreviations
+    | \d+(?:[.,:/-]\d+)*\b                                      # numbers, dates and times
+    | \w+(?=[nN]'[tT]\b)                                        # "do" of "don't"
+    | [nN]'[tT]\b                                               # "n't" of "don't"
+    | '(?:[sSdDmM]|re|ve|ll|RE|VE|LL)\b                         # clitics, e.g. 's 're 'll
+    | \w+(?:[-']\w+)*                                           # words, possibly hyphenated
+    | \.\.\.|--|``|''                                           # multi character punctuation
+    | \S                                                        # any other single non space character
+""", re.VERBOSE)
+
+SENTENCE_END_TOKENS = {".", "!", "?", "..."}
+SENTENCE_CLOSING_TOKENS = {'"', "'", "''", ")", "]", "}"}
+
+
+class RawTextTokenizer(object):
+    """
+    Streaming tokenizer and sentence splitter for raw text documents.
+    Paragraphs (blocks separated by empty lines) are read one at a time, so memory
+    usage doesn't depend on the document size
+    """
+
+    def __init__(self, token_pattern: re.Pattern = TOKEN_PATTERN):
+        self.token_pattern = token_pattern
+
+    def tokenize(self, text: str, offset: int = 0) -> List[Token]:
+        return [(match.group(), match.start() + offset, match.end() + offset)
+                for match in self.token_pattern.finditer(text)]
+
+    def split_sentences(self, tokens: List[Token]) -> Iterator[List[Token]]:
+        sentence_start = 0
+        num_tokens = len(tokens)
+        i = 0
+        while i < num_tokens:
+            word = tokens[i][0]
+            i += 1
+            if word not in SENTENCE_END_TOKENS:
+                continue
+
+            # closing quotes and brackets belong to the sentence that just ended
+            while i < num_tokens and tokens[i][0] in SENTENCE_CLOSING_TOKENS:
+                i += 1
+
+            # a sentence ends only if the next token looks like the beginning of a new sentence
+            if i == num_tokens or not tokens[i][0][0].islower():
+                yield tokens[sentence_start:i]
+                sentence_start = i
+
+        if sentence_start < num_tokens:
+            yield tokens[sentence_start:]
+
+    def iter_sentences(self, filepath: str) -> Iterator[List[Token]]:
+        paragraph_lines = []
+        paragraph_start = 0
+        current_offset = 0
+
+        # newline="" keeps the line endings untouched so the offsets match the raw file
+        with open(filepath, "r", encoding="utf8", newline="") as f:
+            for line in f:
+                if line.strip() == "":  # empty line marks end of paragraph
+                    yield from self._paragraph_sentences(paragraph_lines, paragraph_start)
+                    paragraph_lines = []
+                    paragraph_start = current_offset + len(line)
+                else:
+                    paragraph_lines.append(line)
+
+                current_offset += len(line)
+
+        yield from self._paragraph_sentences(paragraph_lines, paragraph_start)
+
+    def iter_token_lines(self, filepath: str) -> Iterator[str]:
+        # emulates the one-token-per-line format (empty line after each sentence) used by the datasets
+        for sentence in self.iter_sentences(filepath):
+            for word, _, _ in sentence:
+                yield f"{word}\n"
+            yield "\n"
+
+    def _paragraph_sentences(self, paragraph_lines: List[str], paragraph_start: int) -> Iterator[List[Token]]:
+        if len(paragraph_lines) == 0:
+            return
+
+        paragraph_tokens = self.tokenize("".join(paragraph_lines), paragraph_start)
+        yield from self.split_sentences(paragraph_tokens)
@@ -1,16 +1,68 @@
 from pathlib import Path
 from datetime import date
-from typing import Tuple
+from typing import Dict, Tuple, List
 import time
 
 import torch
 from torch.utils import data
 
-from pos_and_ner.models import BaseModel
+from pos_and_ner.models import BaseModel, get_autocast_context
 from pos_and_ner.configs import TrainingConfig
 from pos_and_ner.predictors import BasePredictor
 
 
+# dense optimizers that can be chosen with the "optimizer" key of the training config
+DENSE_OPTIMIZERS = {"adam": torch.optim.Adam, "adagrad": torch.optim.Adagrad}
+
+
+def set_sparse_embeddings(model: torch.nn.Module) -> None:
+    # the trained embedding layers produce sparse gradients, only the rows of the batch tokens
+    for module in model.modules():
+        if isinstance(module, torch.nn.Embedding) and module.weight.requires_grad:
+            module.sparse = True
+
+
+class MultiOptimizer(object):
+    """
+    Steps several optimizers as one, e.g. SparseAdam for the parameters with sparse gradients and a dense
+    optimizer for the rest
+    """
+
+    def __init__(self, optimizers: List[torch.optim.Optimizer]):
+        self.optimizers = optimizers
+
+    def zero_grad(self) -> None:
+        for optimizer in self.optimizers:
+            optimizer.zero_grad()
+
+    def step(self) -> None:
+        for optimizer in self.optimizers:
+            optimizer.step()
+
+    def state_dict(self) -> List[dict]:
+        return [optimizer.state_dict() for optimizer in self.optimizers]
+
+    def load_state_dict(self, state_dicts: List[dict]) -> None:
+        for optimizer, state_dict in zip(self.optimizers, state_dicts):
+            optimizer.load_state_dict(state_dict)
+
+
+def create_optimizer(model: torch.nn.Module, optimizer_name: str, learning_rate: float):
+    # parameters that are not trained (frozen pre-trained embeddings) are not given to the optimizers
+    sparse_parameters = [module.weight for module in model.modules()
+                         if isinstance(module, torch.nn.Embedding) and module.sparse and module.weight.requires_grad]
+    sparse_parameters_ids = {id(parameter) for parameter in sparse_parameters}
+    dense_parameters = [parameter for parameter in model.parameters()
+                        if parameter.requires_grad and id(parameter) not in sparse_parameters_ids]
+
+    dense_optimizer = DENSE_OPTIMIZERS[optimizer_name](dense_parameters, lr=learning_rate)
+    if len(sparse_parameters) == 0:
+        return dense_optimizer
+
+    # SparseAdam updates only the embedding rows (and their moments) of the batch tokens
+    return MultiOptimizer([torch.optim.SparseAdam(sparse_parameters, lr=learning_rate), dense_optimizer])
+
+
 class ModelTrainer(object):
     def __init__(self, model: BaseModel, train_config: TrainingConfig, predictor: BasePredictor, loss_function):
         self.model = model
@@ -19,6 +71,22 @@ class ModelTrainer(object):
         self.loss_function = loss_function
         self.current_epoch = 0
 
+        # "bf16" runs the forward and backward passes under bfloat16 autocast
+        self.precision = train_config["precision"] if "precision" in train_config else "fp32"
+
+        # embedding layers can be trained with sparse gradients (SparseAdam) next to a dense optimizer
+        self.optimizer_name = train_config["optimizer"] if "optimizer" in train_config else self.get_default_optimizer_name()
+        self.sparse_embeddings = "sparse_embeddings" in train_config and train_config["sparse_embeddings"]
+
+    def get_default_optimizer_name(self) -> str:
+        return "adam"
+
+    def create_optimizer(self, model: torch.nn.Module, learning_rate: float):
+        if self.sparse_embeddings:
+            set_sparse_embeddings(model)
+
+        return create_optimizer(model, self.optimizer_name, learning_rate)
+
     def save_checkpoint(self, model_name: str) -> None:
         checkpoint_base_dir = self.train_config["checkpoints_path"]
         current_date = date.today().strftime("%d-%m-%y")
@@ -28,8 +96,12 @@ class ModelTrainer(object):
         checkpoint_path.mkdir(parents=True, exist_ok=True)
         checkpoint_file = checkpoint_path / f"{current_date}_best_model.pth"
 
+        # frozen parameters can be saved once to side files in the checkpoint folder instead of in every checkpoint
+        save_frozen_files = "frozen_parameters_files" in self.train_config and self.train_config["frozen_parameters_files"]
+        frozen_parameters_dir = str(checkpoint_path) if save_frozen_files else None
+
         # save data to disk
-        torch.save(self.model.serialize_model(), checkpoint_file)
+        torch.save(self.model.serialize_model(frozen_parameters_dir), checkpoint_file)
 
     def train(self, model_name: str, train_dataset: data.Dataset, dev_dataset: data.Dataset):
         # training hyper parameters and configuration
@@ -42,7 +114,7 @@ class ModelTrainer(object):
 
         # model, loss and optimizer
         model = self.model
-        optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+        optimizer = self.create_optimizer(model, learning_rate)
 
         # create data loaders
         train_config_dict = {"batch_size": batch_size, "num_workers": num_workers}
@@ -67,8 +139,9 @@ class ModelTrainer(object):
                 x, y = x.to(device), y.to(device)
 
                 optimizer.zero_grad()
-                outputs = model(x)
-                loss = self.loss_function(outputs, y)
+                with get_autocast_context(self.precision, device):
+                    outputs = model(x)
+                    loss = self.loss_function(outputs, y)
 
                 loss.backward()
                 optimizer.step()
@@ -94,10 +167,11 @@ class ModelTrainer(object):
                 for batch_idx, sample in enumerate(dev_loader):
                     x, y = sample
                     x, y = x.to(device), y.to(device)
-                    outputs = model(x)
+                    with get_autocast_context(self.precision, device):
+                        outputs = model(x)
 
-                    # compute the loss of the batch
-                    loss = self.loss_function(outputs, y)
+                        # compute the loss of the batch
+                        loss = self.loss_function(outputs, y)
                     epoch_dev_loss += loss.item() * len(x)  # sum of losses, so multiply with batch size
 
                     # compute number of correct predictions for the batch
@@ -136,7 +210,7 @@ class AcceptorTrainer(ModelTrainer):
 
         # model, loss and optimizer
         model = self.model
-        optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+        optimizer = self.create_optimizer(model, learning_rate)
 
         # create data loaders
         train_config_dict = {"batch_size": batch_size, "num_workers": num_workers}
@@ -163,8 +237,9 @@ class AcceptorTrainer(ModelTrainer):
                 x, y = x.to(device), y.to(device)
 
                 optimizer.zero_grad()
-                outputs = model(x)
-                loss = self.loss_function(outputs, y)
+                with get_autocast_context(self.precision, device):
+                    outputs = model(x)
+                    loss = self.loss_function(outputs, y)
 
                 loss.backward()
                 optimizer.step()
@@ -196,10 +271,11 @@ class AcceptorTrainer(ModelTrainer):
                 for batch_idx, sample in enumerate(dev_loader):
                     x, y = sample
                     x, y = x.to(device), y.to(device)
-                    outputs = model(x)
+                    with get_autocast_context(self.precision, device):
+                        outputs = model(x)
 
-                    # compute the loss of the batch
-                    loss = self.loss_function(outputs, y)
+                        # compute the loss of the batch
+                        loss = self.loss_function(outputs, y)
                     epoch_dev_loss += loss.item() * len(x)  # sum of losses, so multiply with batch size
 
                     # compute number of correct predictions for the batch
@@ -242,7 +318,7 @@ class BiLSTMTrainer(ModelTrainer):
 
         # model, loss and optimizer
         model = self.model
-        optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+        optimizer = self.create_optimizer(model, learning_rate)
 
         # create data loaders
         train_config_dict = {"batch_size": train_batch_size, "num_workers": num_workers}
@@ -268,8 +344,9 @@ class BiLSTMTrainer(ModelTrainer):
                 x, y = x.to(device), y.to(device)
 
                 optimizer.zero_grad()
-                outputs = model(x)
-                loss = self.loss_function(outputs, y)
+                with get_autocast_context(self.precision, device):
+                    outputs = model(x)
+                    loss = self.loss_function(outputs, y)
 
                 loss.backward()
                 optimizer.step()
@@ -319,10 +396,11 @@ class BiLSTMTrainer(ModelTrainer):
             for batch_idx, sample in enumerate(dev_loader):
                 x, y = sample
                 x, y = x.to(device), y.to(device)
-                outputs = model(x)
+                with get_autocast_context(self.precision, device):
+                    outputs = model(x)
 
-                # compute the loss of the batch
-                loss = self.loss_function(outputs, y)
+                    # compute the loss of the batch
+                    loss = self.loss_function(outputs, y)
                 dev_loss += loss.item() * len(x)  # sum of losses, so multiply with batch size
 
                 # compute number of correct predictions for the batch
@@ -334,3 +412,112 @@ class BiLSTMTrainer(ModelTrainer):
         dev_accuracy = num_correct_predictions / total_predictions
 
         return average_dev_loss, dev_accuracy
+
+
+class MultiTaskTrainer(ModelTrainer):
+    """
+    Trains a multi task model on the corpora of all its tasks. The batches of the tasks are interleaved, and every
+    batch updates the shared encoder and the output layer of its task. The model with the best mean dev accuracy
+    over the tasks is saved
+    """
+
+    def __init__(self, model: BaseModel, train_config: TrainingConfig, predictors: Dict[str, BasePredictor], loss_functions: Dict[str, torch.nn.Module]):
+        super().__init__(model, train_config, None, None)
+        self.tasks: List[str] = model.tasks
+        self.predictors = predictors
+        self.loss_functions = loss_functions
+
+    def train(self, model_name: str, train_datasets: Dict[str, data.Dataset], dev_datasets: Dict[str, data.Dataset]) -> None:
+        # training hyper parameters and configuration
+        batch_size = self.train_config["batch_size"]
+        num_workers = self.train_config["num_workers"]
+        num_epochs = self.train_config["num_epochs"]
+        learning_rate = self.train_config["learning_rate"]
+        print_batch_step = self.train_config["print_step"]
+        device = torch.device(self.train_config["device"])
+
+        # model and optimizer
+        model = self.model
+        optimizer = self.create_optimizer(model, learning_rate)
+
+        # create data loaders
+        train_config_dict = {"batch_size": batch_size, "num_workers": num_workers}
+        dev_config_dict = {"batch_size": batch_size * 40, "num_workers": num_workers}
+        training_loaders = {task: data.DataLoader(train_datasets[task], **train_config_dict) for task in self.tasks}
+        dev_loaders = {task: data.DataLoader(dev_datasets[task], **dev_config_dict) for task in self.tasks}
+
+        # Start training
+        model = model.to(device)
+        start_epoch = self.current_epoch
+        best_dev_accuracy = -1000
+        for epoch in range(start_epoch, num_epochs):
+
+            model.train(mode=True)
+            running_batch_loss = 0
+            running_batch_samples = 0
+            epoch_num = epoch + 1
+
+            # one batch of every task in turn, until the batches of all the tasks are used
+            training_iterators = {task_index: iter(training_loaders[task]) for task_index, task in enumerate(self.tasks)}
+            batch_idx = 0
+            while len(training_iterators) > 0:
+                for task_index in list(training_iterators):
+                    sample = next(training_iterators[task_index], None)
+                    if sample is None:
+                        del training_iterators[task_index]
+                        continue
+
+                    x, y = sample
+                    x, y = x.to(device), y.to(device)
+
+                    optimizer.zero_grad()
+                    with get_autocast_context(self.precision, device):
+                        outputs = model(x)[task_index]
+                        loss = self.loss_functions[self.tasks[task_index]](outputs, y)
+
+                    loss.backward()
+                    optimizer.step()
+
+                    # print inter epoch statistics
+                    batch_idx += 1
+                    running_batch_loss += loss.item() * len(outputs)
+                    running_batch_samples += len(outputs)
+                    if batch_idx % print_batch_step == 0:
+                        print("Train Epoch: {} [{} batches]\t Average Loss: {:.6f}".format(
+                            epoch_num, batch_idx, running_batch_loss / running_batch_samples))
+                        running_batch_loss = 0
+                        running_batch_samples = 0
+
+            # end of epoch - compute accuracy of every task on its dev set
+            tasks_accuracies = []
+            for task_index, task in enumerate(self.tasks):
+                task_accuracy = self.predict_task_accuracy(model, device, dev_loaders[task], task_index)
+                tasks_accuracies.append(task_accuracy)
+                print("Epoch {} Accuracy on {} Dev set is:\t{:.6f}".format(epoch_num, task, task_accuracy))
+
+            # save checkpoint of the model if needed
+            epoch_dev_accuracy = sum(tasks_accuracies) / len(tasks_accuracies)
+            if epoch_dev_accuracy > best_dev_accuracy:
+                best_dev_accuracy = epoch_dev_accuracy
+                print("Epoch {} Saving best model so far with mean accuracy of {:.6f} on Dev sets".format(epoch_num, best_dev_accuracy))
+                self.save_checkpoint(model_name)
+
+    def predict_task_accuracy(self, model: torch.nn.Module, device: torch.device, dev_loader: data.DataLoader, task_index: int) -> float:
+        model.eval()
+        predictor = self.predictors[self.tasks[task_index]]
+        total_predictions = 0
+        num_correct_predictions = 0
+        with torch.no_grad():
+
+            for sample in dev_loader:
+                x, y = sample
+                x, y = x.to(device), y.to(device)
+                with get_autocast_context(self.precision, device):
+                    outputs = model(x)[task_index]
+
+                # compute number of correct predictions for the batch
+                num_correct_batch, total_predictions_batch = predictor.infer_model_outputs_with_gold_labels(outputs, y)
+                num_correct_predictions += num_correct_batch
+                total_predictions += total_predictions_batch
+
+        return num_correct_predictions / total_predictions